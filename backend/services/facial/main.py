@@ -1,24 +1,62 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import pipeline
-from PIL import Image
+from fastapi.responses import ORJSONResponse
+from PIL import Image, ImageFile
+from typing import List, Optional
+import asyncio
+import hashlib
 import io
 import time
 import sys
 import os
+import tempfile
 
 # Agregar el directorio padre al path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from shared.schemas import FacialAnalysisResponse, HealthResponse, ErrorResponse
-from shared.utils import get_logger
+from shared.schemas import (
+    FacialAnalysisResponse, HealthResponse, ErrorResponse, SharedPayload, VideoAnalysisResponse,
+    VideoFrameEmotion, canonical_label
+)
+from shared.config import get_settings
+from shared.utils import get_logger, collect_stats, sampled, RequestIdMiddleware
+from shared.database import start_persistence, stop_persistence, record_result
+from shared.serialization import negotiated_response
+from shared.admission import AdmissionMiddleware, get_admission_controller
+from shared.prefork import run_prefork
+from shared.uploads import (
+    BodySizeLimitMiddleware, iter_upload, max_body_bytes, max_video_body_bytes, max_video_bytes
+)
+from shared.model_registry import (
+    ModelUnavailable, create_models_router, get_model_registry, health_status,
+    hf_pipeline_loader, model_unavailable_handler
+)
+from shared.startup_profiler import startup_profiler
+from shared.admin import log_admin_status
+from shared.profiling import ProfilingMiddleware, create_profiling_router
+from shared.singleflight import get_singleflight
+from shared.transport import BufferReader, open_shared_payload
+from services.facial.video import VideoDecodeError, VideoFrames
 
 logger = get_logger()
+settings = get_settings()
 
 app = FastAPI(
     title="Facial Emotion Analysis Service",
     description="Microservicio para análisis de emociones faciales",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
+
+# Control de admisión (concurrencia, cola acotada, prioridades).
+# Se registra antes que CORS para que las respuestas 429/503 lleven sus headers
+app.add_middleware(AdmissionMiddleware, controller=get_admission_controller())
+
+# Rechazo temprano (413) de cuerpos que superan max_file_size_mb (max_video_size_mb para videos)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=max_body_bytes(),
+    path_limits={"/analyze/video": max_video_body_bytes()}
 )
 
 # CORS
@@ -30,42 +68,144 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Cargar modelo
-emotion_classifier = None
+# Perfilado de CPU de los requests con X-Profile (dentro de RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
+# X-Request-ID en logs y respuestas (más externo para cubrir también los rechazos)
+app.add_middleware(RequestIdMiddleware)
+
+# Administración de modelos (/models) y 503 si el modelo no se puede cargar
+app.include_router(create_models_router())
+app.add_exception_handler(ModelUnavailable, model_unavailable_handler)
+
+# Perfilado de CPU bajo demanda (/profile, requiere X-Admin-Key)
+app.include_router(create_profiling_router())
+
+# Modelo pre-entrenado específico para emociones en imágenes (se carga al iniciar)
+models = get_model_registry()
+models.register(
+    "facial",
+    "dima806/facial_emotions_image_detection",
+    hf_pipeline_loader("image-classification"),
+    preload=True,
+    warmup=lambda classifier: classifier(Image.new("RGB", (224, 224)))
+)
+
+
+# Imágenes idénticas en curso comparten una sola inferencia
+face_flights = get_singleflight("facial")
+
 
 def load_model():
-    global emotion_classifier
-    try:
-        logger.info("Cargando modelo de reconocimiento facial de emociones...")
-        # Modelo pre-entrenado específico para emociones en imágenes
-        emotion_classifier = pipeline(
-            "image-classification",
-            model="dima806/facial_emotions_image_detection"
-        )
-        logger.info("Modelo facial cargado exitosamente")
-    except Exception as e:
-        logger.error(f"Error al cargar modelo: {str(e)}")
-        emotion_classifier = None
+    """Carga los modelos de arranque (en el padre si hay fork de workers)"""
+    models.preload()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Cargar modelo al iniciar"""
-    load_model()
+    """
+    Cargar el modelo en segundo plano (ya cargado si el worker viene de un fork)
+
+    /health responde "starting" hasta que el modelo está listo.
+    """
+    startup_profiler.mark("listening")
+    log_admin_status()
+    models.preload_async()
+    models.start()
+    start_persistence()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Volcar resultados pendientes"""
+    models.stop()
+    stop_persistence()
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    model_status = "loaded" if emotion_classifier is not None else "not_loaded"
     return HealthResponse(
-        status="healthy" if emotion_classifier else "degraded",
-        service=f"facial-analysis (model: {model_status})"
+        status=health_status(models),
+        service=f"facial-analysis (model: {models.status('facial')})"
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """Métricas internas del servicio"""
+    return collect_stats()
+
+
+def analyze_image_bytes(contents: bytes, filename: str = None) -> FacialAnalysisResponse:
+    """
+    Ejecuta el análisis facial sobre los bytes de una imagen
+
+    Usado por el endpoint HTTP y por el gateway de fusión en modo monolito.
+
+    Args:
+        contents: Bytes de la imagen
+        filename: Nombre original del archivo (solo para logs)
+
+    Returns:
+        Análisis de emociones faciales con confianza
+    """
+    return analyze_image(Image.open(io.BytesIO(contents)), filename)
+
+
+def emotion_scores(predictions: list) -> dict:
+    """Suma las predicciones del modelo por emoción canónica"""
+    all_emotions = {}
+    for pred in predictions:
+        label = canonical_label(pred['label'])
+        all_emotions[label] = all_emotions.get(label, 0.0) + pred['score']
+    return all_emotions
+
+
+def analyze_image(image: Image.Image, filename: str = None,
+                  start_time: float = None) -> FacialAnalysisResponse:
+    """
+    Ejecuta el análisis facial sobre una imagen ya decodificada
+
+    Args:
+        image: Imagen PIL
+        filename: Nombre original del archivo (solo para logs)
+        start_time: Inicio del request (para processing_time)
+
+    Returns:
+        Análisis de emociones faciales con confianza
+    """
+    start_time = start_time or time.time()
+    
+    logger.debug("Procesando imagen: {}", filename)
+    
+    # Analizar con el modelo (se carga aquí si fue descargado por inactividad)
+    with models.use("facial") as emotion_classifier:
+        predictions = emotion_classifier(image)
+    
+    all_emotions = emotion_scores(predictions)
+    
+    # Emoción dominante
+    dominant_emotion = max(all_emotions, key=all_emotions.get)
+    confidence = all_emotions[dominant_emotion]
+    
+    processing_time = time.time() - start_time
+    
+    if sampled():
+        logger.info("Emoción detectada: {} ({:.2f})", dominant_emotion, confidence)
+    
+    return FacialAnalysisResponse(
+        emotion=dominant_emotion,
+        confidence=confidence,
+        all_emotions=all_emotions,
+        processing_time=processing_time,
+        face_detected=True,
+        face_region=None
     )
 
 
 @app.post("/analyze/face", response_model=FacialAnalysisResponse)
-async def analyze_face(file: UploadFile = File(...)):
+async def analyze_face(request: Request, file: UploadFile = File(...)):
     """
     Analiza emociones en una imagen facial
     
@@ -77,47 +217,65 @@ async def analyze_face(file: UploadFile = File(...)):
     """
     start_time = time.time()
     
-    if emotion_classifier is None:
-        raise HTTPException(status_code=503, detail="Modelo no disponible")
-    
     try:
         # Validar tipo de archivo
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
         
-        # Leer imagen
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        logger.info(f"Procesando imagen: {file.filename}")
-        
-        # Analizar con el modelo
-        predictions = emotion_classifier(image)
-        
-        # Procesar resultados
-        all_emotions = {}
-        for pred in predictions:
-            label = pred['label'].lower()
-            score = pred['score']
-            all_emotions[label] = score
-        
-        # Emoción dominante
-        dominant_emotion = max(all_emotions, key=all_emotions.get)
-        confidence = all_emotions[dominant_emotion]
-        
-        processing_time = time.time() - start_time
+        # Decodificar por bloques: límite de tamaño y magic bytes desde el primer bloque,
+        # sin mantener una copia completa de los bytes además de la imagen decodificada
+        parser = ImageFile.Parser()
+        digest = hashlib.sha256()
+        async for chunk in iter_upload(file, kind="image"):
+            parser.feed(chunk)
+            digest.update(chunk)
+        image = parser.close()
         
-        logger.info(f"Emoción detectada: {dominant_emotion} ({confidence:.2f})")
+        # Imágenes idénticas en curso comparten una inferencia
+        result = await face_flights.do(
+            digest.hexdigest(),
+            lambda: asyncio.to_thread(analyze_image, image, file.filename, start_time)
+        )
+        record_result("facial", result)
+        return negotiated_response(request, result)
         
-        return FacialAnalysisResponse(
-            emotion=dominant_emotion,
-            confidence=confidence,
-            all_emotions=all_emotions,
-            processing_time=processing_time,
-            face_detected=True,
-            face_region=None
+    except (HTTPException, ModelUnavailable):
+        raise
+    except Exception as e:
+        logger.error(f"Error al analizar imagen: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al procesar la imagen: {str(e)}"
         )
+
+
+@app.post("/analyze/face/shm", response_model=FacialAnalysisResponse)
+async def analyze_face_shared(request: Request, payload: SharedPayload):
+    """
+    Analiza una imagen pasada por memoria compartida (gateway en el mismo host)
+    
+    Args:
+        payload: Segmento con la imagen
+    
+    Returns:
+        Análisis de emociones faciales con confianza
+    """
+    start_time = time.time()
+    
+    try:
+        # La imagen se decodifica (en analyze_image) directamente del segmento
+        with open_shared_payload(payload, kind="image") as contents:
+            image = Image.open(BufferReader(contents))
+            
+            result = await face_flights.do(
+                hashlib.sha256(contents).hexdigest(),
+                lambda: asyncio.to_thread(analyze_image, image, payload.filename, start_time)
+            )
+        record_result("facial", result)
+        return negotiated_response(request, result)
         
+    except (HTTPException, ModelUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error al analizar imagen: {str(e)}")
         raise HTTPException(
@@ -126,6 +284,147 @@ async def analyze_face(file: UploadFile = File(...)):
         )
 
 
+def classify_frames(images: List[Image.Image]) -> List[dict]:
+    """Clasifica un lote de frames en una sola llamada al modelo"""
+    with models.use("facial") as emotion_classifier:
+        predictions = emotion_classifier(images, batch_size=len(images))
+    return [emotion_scores(frame_predictions) for frame_predictions in predictions]
+
+
+async def analyze_video_file(path: str, sample_fps: float = None,
+                             start_time: float = None) -> VideoAnalysisResponse:
+    """
+    Analiza los frames muestreados de un video en disco
+
+    La decodificación (FFmpeg) y la inferencia por lotes se solapan: mientras
+    el modelo procesa un lote, FFmpeg ya está entregando el siguiente.
+
+    Args:
+        path: Ruta del video
+        sample_fps: Frames por segundo a analizar (default: video_sample_fps)
+        start_time: Inicio del request (para processing_time)
+
+    Returns:
+        Línea de tiempo de emociones por frame y distribución agregada
+    """
+    start_time = start_time or time.time()
+    sample_fps = sample_fps or settings.video_sample_fps
+    frames = VideoFrames(
+        path, sample_fps,
+        frame_size=settings.video_frame_size,
+        max_frames=settings.video_max_frames,
+        timeout=settings.video_timeout
+    )
+    
+    timeline = []
+    totals = {}
+    async for batch in frames.batches(settings.video_batch_size):
+        scores = await asyncio.to_thread(classify_frames, [image for _, image in batch])
+        for (timestamp, _), all_emotions in zip(batch, scores):
+            emotion = max(all_emotions, key=all_emotions.get)
+            timeline.append(VideoFrameEmotion(
+                timestamp=round(timestamp, 3),
+                emotion=emotion,
+                confidence=all_emotions[emotion],
+                all_emotions=all_emotions
+            ))
+            for label, score in all_emotions.items():
+                totals[label] = totals.get(label, 0.0) + score
+    
+    if not timeline:
+        raise HTTPException(status_code=422, detail="No se pudo extraer ningún frame del video")
+    
+    # Distribución agregada: media de las distribuciones de todos los frames
+    distribution = {label: total / len(timeline) for label, total in totals.items()}
+    dominant_emotion = max(distribution, key=distribution.get)
+    truncated = frames.frames >= settings.video_max_frames and (
+        frames.duration is None or frames.duration > frames.frames / sample_fps
+    )
+    
+    if sampled():
+        logger.info("Video: {} frames, emoción dominante {} ({:.2f})",
+                    len(timeline), dominant_emotion, distribution[dominant_emotion])
+    
+    return VideoAnalysisResponse(
+        emotion=dominant_emotion,
+        confidence=distribution[dominant_emotion],
+        all_emotions=distribution,
+        processing_time=time.time() - start_time,
+        video_duration=frames.duration,
+        sample_fps=sample_fps,
+        frames_analyzed=len(timeline),
+        truncated=truncated,
+        timeline=timeline
+    )
+
+
+async def analyze_video_bytes(contents: bytes, filename: str = None,
+                              sample_fps: float = None) -> VideoAnalysisResponse:
+    """analyze_video_file sobre los bytes completos (gateway de fusión en modo monolito)"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename or "")[1]) as temp_input:
+        temp_input.write(contents)
+    try:
+        return await analyze_video_file(temp_input.name, sample_fps)
+    except VideoDecodeError as e:
+        logger.error(f"Error en FFmpeg: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"No se pudo procesar el video: {str(e)}")
+    finally:
+        os.unlink(temp_input.name)
+
+
+def validate_sample_fps(sample_fps: Optional[float]):
+    if sample_fps is not None and not 0 < sample_fps <= 30:
+        raise HTTPException(status_code=400, detail="sample_fps debe estar entre 0 y 30")
+
+
+@app.post("/analyze/video", response_model=VideoAnalysisResponse)
+async def analyze_video(request: Request, file: UploadFile = File(...),
+                        sample_fps: Optional[float] = Form(None)):
+    """
+    Analiza emociones faciales a lo largo de un video
+    
+    Args:
+        file: Video (mp4, mov, webm, mkv, avi)
+        sample_fps: Frames por segundo a analizar (default: VIDEO_SAMPLE_FPS)
+    
+    Returns:
+        Línea de tiempo de emociones por frame y distribución agregada
+    """
+    start_time = time.time()
+    
+    try:
+        if not file.content_type.startswith('video/'):
+            raise HTTPException(status_code=400, detail="El archivo debe ser un video")
+        validate_sample_fps(sample_fps)
+        
+        # Los contenedores como MP4 necesitan seek: el video va a un archivo
+        # temporal; los frames se decodifican en memoria por el pipe de FFmpeg
+        temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename or "")[1])
+        try:
+            with temp_input:
+                async for chunk in iter_upload(file, max_video_bytes(), kind="video"):
+                    temp_input.write(chunk)
+            result = await analyze_video_file(temp_input.name, sample_fps, start_time)
+        finally:
+            os.unlink(temp_input.name)
+        return negotiated_response(request, result)
+        
+    except (HTTPException, ModelUnavailable):
+        raise
+    except VideoDecodeError as e:
+        logger.error(f"Error en FFmpeg: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"No se pudo procesar el video: {str(e)}"
+        )
+    except Exception as e:
+        logger.error(f"Error al analizar video: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al procesar el video: {str(e)}"
+        )
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Con WORKERS > 1 los modelos se cargan una vez y se comparten entre workers
+    run_prefork(app, load_model, port=8001, uds=settings.facial_service_socket)
@@ -0,0 +1,131 @@
+"""
+Decodificación de video por FFmpeg en frames muestreados
+
+FFmpeg muestrea el video a sample_fps, escala cada frame a un cuadrado de
+frame_size (manteniendo la proporción, con relleno) y los escribe como RGB
+crudo por pipe:1: los frames nunca pasan por disco y su tamaño en bytes es
+fijo, así que se leen sin parsear ningún contenedor.
+
+Una tarea lee los frames y arma lotes mientras el modelo procesa el lote
+anterior (cola de max_pending lotes), de modo que decodificación e
+inferencia se solapan.
+"""
+import asyncio
+import re
+from typing import AsyncIterator, List, Optional, Tuple
+
+from PIL import Image
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.utils.ffmpeg import resolve_ffmpeg, spawn_ffmpeg, FFMPEG_MISSING
+
+DURATION_PATTERN = re.compile(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+class VideoDecodeError(Exception):
+    """FFmpeg no pudo decodificar el video (o no está disponible)"""
+
+
+class VideoFrames:
+    """
+    Frames muestreados de un video, por lotes
+
+    Uso:
+        frames = VideoFrames(path, sample_fps=1.0)
+        async for batch in frames.batches(16):
+            ...  # batch: [(timestamp, Image), ...]
+        frames.duration  # duración del video según FFmpeg (None si no la informa)
+    """
+
+    def __init__(self, path: str, sample_fps: float, frame_size: int = 224,
+                 max_frames: int = 600, timeout: float = 120.0):
+        self.path = path
+        self.sample_fps = sample_fps
+        self.frame_size = frame_size
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.duration: Optional[float] = None
+        self.frames = 0
+
+    def _args(self, ffmpeg_path: str) -> list:
+        size = self.frame_size
+        video_filter = (
+            f"fps={self.sample_fps},"
+            f"scale={size}:{size}:force_original_aspect_ratio=decrease,"
+            f"pad={size}:{size}:(ow-iw)/2:(oh-ih)/2"
+        )
+        return [
+            ffmpeg_path, '-hide_banner', '-nostats', '-loglevel', 'info',
+            '-i', self.path,
+            '-an',                                  # Sin audio
+            '-vf', video_filter,
+            '-frames:v', str(self.max_frames),
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            'pipe:1'
+        ]
+
+    async def batches(self, batch_size: int, max_pending: int = 2) -> AsyncIterator[List[Tuple[float, Image.Image]]]:
+        """
+        Lotes de (timestamp en segundos, frame) en orden
+
+        Raises:
+            VideoDecodeError: si FFmpeg falla, no termina en timeout o no está instalado
+        """
+        ffmpeg_path = resolve_ffmpeg()
+        if ffmpeg_path is None:
+            raise VideoDecodeError(FFMPEG_MISSING)
+
+        process = await spawn_ffmpeg(self._args(ffmpeg_path))
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        frame_bytes = self.frame_size * self.frame_size * 3
+
+        async def read_frames():
+            batch = []
+            while True:
+                try:
+                    data = await process.stdout.readexactly(frame_bytes)
+                except asyncio.IncompleteReadError:
+                    break
+                image = Image.frombuffer("RGB", (self.frame_size, self.frame_size), data, "raw", "RGB", 0, 1)
+                batch.append((self.frames / self.sample_fps, image))
+                self.frames += 1
+                if len(batch) == batch_size:
+                    await queue.put(batch)
+                    batch = []
+            if batch:
+                await queue.put(batch)
+
+        async def decode():
+            try:
+                _, stderr = await asyncio.gather(read_frames(), process.stderr.read())
+                returncode = await process.wait()
+                match = DURATION_PATTERN.search(stderr)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    self.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                if returncode != 0:
+                    raise VideoDecodeError(stderr.decode(errors="replace").strip()[-500:] or f"código {returncode}")
+            finally:
+                await queue.put(None)
+
+        decoder = asyncio.create_task(asyncio.wait_for(decode(), self.timeout))
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                yield batch
+            await decoder
+        except asyncio.TimeoutError:
+            raise VideoDecodeError(f"FFmpeg no terminó en {self.timeout}s")
+        finally:
+            decoder.cancel()
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
@@ -0,0 +1,298 @@
+"""
+Analizadores usados por el gateway de fusión
+
+Abstrae cómo se obtiene el análisis de cada modalidad:
+- ServiceAnalyzers: llama a los microservicios facial/voice/text por HTTP
+- LocalAnalyzers: ejecuta los analizadores en el mismo proceso (modo monolito)
+
+En ambos modos las peticiones idénticas en curso (misma imagen o texto) se
+unen a una sola llamada (CoalescingAnalyzers). Los archivos que llegan en
+streaming (analyze_*_stream) no se coalescen: su hash no se conoce hasta
+haberlos recibido enteros.
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats, get_request_id, REQUEST_ID_HEADER
+from shared.serialization import accept_headers, decode_response
+from shared.admission import request_headers
+from shared.singleflight import get_singleflight, input_key
+from shared.profiling import profile_headers
+from shared.transport import create_segment, create_service_client, release_segment, use_shared_memory
+from load_balancer import Endpoint, EndpointPool
+from upload_stream import UploadStream, streaming_file_request
+
+logger = get_logger()
+settings = get_settings()
+
+
+class ServiceAnalyzers:
+    """
+    Analizadores remotos: cada modalidad es un microservicio HTTP
+
+    Cada modalidad puede tener varias réplicas (EndpointPool) con balanceo
+    least-outstanding-requests, health checks y circuit breaker.
+    """
+
+    mode = "microservices"
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.pools = {
+            "facial": EndpointPool("facial", settings.facial_service_urls or [settings.facial_service_url]),
+            "voice": EndpointPool("voice", settings.voice_service_urls or [settings.voice_service_url]),
+            "text": EndpointPool("text", settings.text_service_urls or [settings.text_service_url]),
+        }
+        register_stats("upstreams", lambda: {name: pool.stats() for name, pool in self.pools.items()})
+
+    async def startup(self):
+        # Cliente compartido para reutilizar conexiones entre requests
+        # (por socket Unix a los servicios del mismo host que lo tengan configurado)
+        self._client = create_service_client(timeout=30.0)
+        for pool in self.pools.values():
+            pool.start_health_checks(self._client, settings.health_check_interval)
+
+    async def shutdown(self):
+        for pool in self.pools.values():
+            pool.stop_health_checks()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = create_service_client(timeout=30.0)
+        return self._client
+
+    async def _post(self, modality: str, path: str, timeout: float, priority: str,
+                    attempts: int = None, headers: dict = None, record_latency: bool = True,
+                    **kwargs) -> dict:
+        """POST a la mejor réplica de la modalidad, con failover a otra si falla"""
+        headers = {
+            **accept_headers(),
+            **request_headers(priority, timeout),
+            REQUEST_ID_HEADER: get_request_id(),
+            # Un request perfilado (X-Profile) se perfila también en el servicio
+            **profile_headers(),
+            **(headers or {})
+        }
+
+        async def send(endpoint: Endpoint) -> dict:
+            response = await self.client.post(
+                f"{endpoint.url}{path}",
+                headers=headers,
+                timeout=timeout,
+                **kwargs
+            )
+            response.raise_for_status()
+            return decode_response(response.content, response.headers.get("content-type", ""))
+
+        return await self.pools[modality].call(send, attempts, record_latency)
+
+    async def _post_file(self, modality: str, path: str, data: bytes, filename: str, content_type: str,
+                         timeout: float, priority: str, record_latency: bool = True) -> dict:
+        """Envía un archivo por memoria compartida si el servicio está en este host; si no, multipart"""
+        endpoints = self.pools[modality].endpoints
+        if len(endpoints) == 1 and use_shared_memory(endpoints[0].url, len(data)):
+            segment = create_segment(data)
+            try:
+                payload = {"name": segment.name, "size": len(data), "filename": filename, "content_type": content_type}
+                return await self._post(
+                    modality, f"{path}/shm", timeout, priority, record_latency=record_latency, json=payload
+                )
+            except httpx.HTTPStatusError as e:
+                # 409: el servicio no ve el segmento (otro host o namespace IPC)
+                if e.response.status_code != 409:
+                    raise
+                logger.warning(f"Memoria compartida no disponible para {modality}, se envía por multipart")
+            finally:
+                release_segment(segment)
+        files = {"file": (filename, data, content_type)}
+        return await self._post(modality, path, timeout, priority, record_latency=record_latency, files=files)
+
+    async def _post_stream(self, modality: str, path: str, upload: UploadStream,
+                           timeout: float, priority: str) -> dict:
+        """Reenvía un archivo a medida que se sube (un único intento: el cuerpo no se puede repetir)"""
+        headers, body = streaming_file_request(upload)
+        try:
+            # La duración incluye la subida del cliente: no cuenta para la latencia del breaker
+            return await self._post(
+                modality, path, timeout, priority,
+                attempts=1, headers=headers, record_latency=False, content=body
+            )
+        finally:
+            # Si la llamada falla antes de leer todo el cuerpo (sin conexión, sin réplicas,
+            # rechazo temprano), el resto del archivo se descarta sin bloquear el request
+            upload.abandon()
+
+    async def analyze_face(self, image_bytes: bytes, filename: str, content_type: str,
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        return await self._post_file("facial", "/analyze/face", image_bytes, filename, content_type, timeout, priority)
+
+    async def analyze_voice(self, audio_bytes: bytes, filename: str, content_type: str,
+                            timeout: float = 30.0, priority: str = "bulk") -> dict:
+        # La pista de audio de un video (minutos) no cuenta para la latencia del breaker
+        return await self._post_file(
+            "voice", "/analyze/voice", audio_bytes, filename, content_type, timeout, priority,
+            record_latency=not content_type.startswith("video/")
+        )
+
+    async def analyze_face_stream(self, upload: UploadStream, timeout: float = 30.0,
+                                  priority: str = "bulk") -> dict:
+        return await self._post_stream("facial", "/analyze/face", upload, timeout, priority)
+
+    async def analyze_voice_stream(self, upload: UploadStream, timeout: float = 30.0,
+                                   priority: str = "bulk") -> dict:
+        return await self._post_stream("voice", "/analyze/voice", upload, timeout, priority)
+
+    async def analyze_video(self, video_bytes: bytes, filename: str, content_type: str,
+                            sample_fps: float = None, timeout: float = 120.0, priority: str = "bulk") -> dict:
+        files = {"file": (filename, video_bytes, content_type)}
+        data = {"sample_fps": str(sample_fps)} if sample_fps else None
+        # Un video tarda de segundos a minutos según su duración: no cuenta para la
+        # latencia del breaker del que dependen los frames en tiempo real
+        return await self._post(
+            "facial", "/analyze/video", timeout, priority,
+            record_latency=False, files=files, data=data
+        )
+
+    async def analyze_text(self, text: str, language: str = "auto",
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        return await self._post(
+            "text", "/analyze/text", timeout, priority,
+            json={"text": text, "language": language}
+        )
+
+
+class LocalAnalyzers:
+    """
+    Analizadores en proceso (modo monolito)
+
+    Importa los módulos de los servicios facial/voice/text y llama
+    directamente a su lógica de análisis, sin serialización ni red.
+    La inferencia es síncrona, así que se ejecuta en un hilo para no
+    bloquear el event loop.
+    """
+
+    mode = "monolith"
+
+    def __init__(self):
+        self.facial = None
+        self.voice = None
+        self.text = None
+
+    async def startup(self):
+        from shared.model_registry import get_model_registry
+        from shared.startup_profiler import timed_import
+
+        logger.info("Modo monolito: cargando analizadores en proceso...")
+        self.facial = timed_import("services.facial.main", "facial")
+        self.voice = timed_import("services.voice.main", "voice")
+        self.text = timed_import("services.text.main", "text")
+
+        # Los tres servicios comparten el registro de modelos del proceso;
+        # los modelos se cargan en segundo plano sin retrasar el arranque del gateway
+        models = get_model_registry()
+        models.preload_async()
+        models.start()
+        await self.voice.decoder_pool.start()
+
+    async def shutdown(self):
+        from shared.model_registry import get_model_registry
+        get_model_registry().stop()
+        await self.voice.decoder_pool.stop()
+
+    async def analyze_face(self, image_bytes: bytes, filename: str, content_type: str,
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(self.facial.analyze_image_bytes, image_bytes, filename),
+            timeout
+        )
+        return result.model_dump()
+
+    async def analyze_voice(self, audio_bytes: bytes, filename: str, content_type: str,
+                            timeout: float = 30.0, priority: str = "bulk") -> dict:
+        # La pista de audio de un video puede tardar más que FFMPEG_TIMEOUT en decodificarse
+        decode_timeout = settings.video_timeout if content_type.startswith("video/") else None
+
+        async def analyze():
+            # Decodificación asíncrona (pool de FFmpeg) e inferencia en un hilo
+            audio, sample_rate = await self.voice.decode_audio_bytes(audio_bytes, decode_timeout)
+            return await asyncio.to_thread(self.voice.analyze_audio_signal, audio, sample_rate)
+
+        result = await asyncio.wait_for(analyze(), timeout)
+        return result.model_dump()
+
+    # En proceso no hay a quién reenviar: se reúne el archivo y se analiza
+    async def analyze_face_stream(self, upload: UploadStream, timeout: float = 30.0,
+                                  priority: str = "bulk") -> dict:
+        image_bytes = await upload.read()
+        return await self.analyze_face(image_bytes, upload.filename, upload.content_type, timeout, priority)
+
+    async def analyze_voice_stream(self, upload: UploadStream, timeout: float = 30.0,
+                                   priority: str = "bulk") -> dict:
+        audio_bytes = await upload.read()
+        return await self.analyze_voice(audio_bytes, upload.filename, upload.content_type, timeout, priority)
+
+    async def analyze_video(self, video_bytes: bytes, filename: str, content_type: str,
+                            sample_fps: float = None, timeout: float = 120.0, priority: str = "bulk") -> dict:
+        # Decodificación asíncrona (FFmpeg) e inferencia por lotes en un hilo
+        result = await asyncio.wait_for(
+            self.facial.analyze_video_bytes(video_bytes, filename, sample_fps),
+            timeout
+        )
+        return result.model_dump()
+
+    async def analyze_text(self, text: str, language: str = "auto",
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(self.text.analyze_text_content, text, language),
+            timeout
+        )
+        return result.model_dump()
+
+
+class CoalescingAnalyzers:
+    """Une las peticiones idénticas en curso del gateway a una sola llamada"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.face_flights = get_singleflight("gateway_facial")
+        self.text_flights = get_singleflight("gateway_text")
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    async def analyze_face(self, image_bytes: bytes, filename: str, content_type: str,
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        return await self.face_flights.do(
+            input_key(image_bytes),
+            lambda: self.inner.analyze_face(image_bytes, filename, content_type, timeout, priority),
+            timeout
+        )
+
+    async def analyze_text(self, text: str, language: str = "auto",
+                           timeout: float = 30.0, priority: str = "bulk") -> dict:
+        return await self.text_flights.do(
+            input_key(text, language or "auto"),
+            lambda: self.inner.analyze_text(text, language, timeout, priority),
+            timeout
+        )
+
+
+def create_analyzers():
+    """Crea los analizadores según settings.deployment_mode"""
+    if settings.deployment_mode == "monolith":
+        return CoalescingAnalyzers(LocalAnalyzers())
+    return CoalescingAnalyzers(ServiceAnalyzers())
+
+
+analyzers = create_analyzers()
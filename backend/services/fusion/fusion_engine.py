@@ -0,0 +1,174 @@
+"""
+Motor de fusión vectorizado
+
+Trabaja sobre tensores (B, M, L):
+- B: número de requests / muestras a fusionar de una vez
+- M: modalidades (MODALITIES)
+- L: emociones del índice canónico (EMOTION_LABELS)
+"""
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.emotions import N_EMOTIONS, to_vector
+from shared.schemas import MODALITIES
+
+settings = get_settings()
+
+MODALITY_INDEX = {modality: i for i, modality in enumerate(MODALITIES)}
+N_MODALITIES = len(MODALITIES)
+
+
+class FusionStrategy:
+    """Estrategia base: combinación lineal con pesos por modalidad"""
+
+    name = "base"
+
+    def weights(self, confidences: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Pesos sin normalizar (B, M) para cada modalidad presente"""
+        return mask.astype(np.float32)
+
+    def fuse(self, distributions: np.ndarray, confidences: np.ndarray, mask: np.ndarray,
+             keys: Optional[Sequence[Hashable]] = None) -> np.ndarray:
+        """
+        Fusiona un lote de distribuciones
+
+        Args:
+            distributions: (B, M, L) distribuciones por modalidad
+            confidences: (B, M) confianza de cada modalidad
+            mask: (B, M) 1.0 si la modalidad está presente
+            keys: Identificadores de flujo (solo estrategias temporales)
+
+        Returns:
+            (B, L) distribuciones fusionadas
+        """
+        weights = self.weights(confidences, mask) * mask
+        total = weights.sum(axis=1, keepdims=True)
+
+        # Si todos los pesos son cero, repartir por igual entre las modalidades presentes
+        uniform = mask / np.maximum(mask.sum(axis=1, keepdims=True), 1.0)
+        weights = np.where(total > 0, weights / np.where(total > 0, total, 1.0), uniform)
+
+        return np.einsum('bm,bml->bl', weights, distributions)
+
+
+class ConfidenceWeighted(FusionStrategy):
+    """Pondera cada modalidad por la confianza de su predicción"""
+
+    name = "weighted_by_confidence"
+
+    def weights(self, confidences: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        return confidences
+
+
+class FixedWeights(FusionStrategy):
+    """Pesos fijos por modalidad (las modalidades sin peso cuentan 1.0)"""
+
+    name = "fixed_weights"
+
+    def __init__(self, weights: Dict[str, float]):
+        self.vector = np.ones(N_MODALITIES, dtype=np.float32)
+        for modality, weight in weights.items():
+            self.vector[MODALITY_INDEX[modality]] = weight
+
+    def weights(self, confidences: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        return np.broadcast_to(self.vector, mask.shape)
+
+
+class TemporalEMA(FusionStrategy):
+    """
+    Suavizado temporal (media móvil exponencial) sobre otra estrategia
+
+    Mantiene el último resultado por clave de flujo (p. ej. una conexión
+    WebSocket) y lo mezcla con cada nueva fusión. Sin claves no hay flujo
+    que suavizar y el resultado es el de la estrategia base; quien pasa una
+    clave la libera con reset() al terminar el flujo.
+    """
+
+    name = "temporal_ema"
+
+    def __init__(self, base: FusionStrategy, alpha: float = 0.5):
+        self.base = base
+        self.alpha = alpha
+        self.state: Dict[Hashable, np.ndarray] = {}
+
+    def fuse(self, distributions: np.ndarray, confidences: np.ndarray, mask: np.ndarray,
+             keys: Optional[Sequence[Hashable]] = None) -> np.ndarray:
+        fused = self.base.fuse(distributions, confidences, mask)
+        if keys is None:
+            return fused
+
+        previous = np.stack([self.state.get(key, row) for key, row in zip(keys, fused)])
+        fused = self.alpha * fused + (1.0 - self.alpha) * previous
+        for key, row in zip(keys, fused):
+            self.state[key] = row
+        return fused
+
+    def reset(self, key: Hashable):
+        self.state.pop(key, None)
+
+
+def create_strategy(name: str = None, temporal: bool = True) -> FusionStrategy:
+    """
+    Crea la estrategia configurada en settings.fusion_strategy
+
+    Args:
+        name: "confidence" | "fixed" | "ema" (default: settings.fusion_strategy)
+        temporal: False para fusiones sin flujo (requests HTTP independientes):
+            "ema" se reduce a su estrategia base, que es lo que se aplica
+    """
+    name = name or settings.fusion_strategy
+    if name == "fixed":
+        return FixedWeights(settings.fusion_weights)
+    if name == "ema" and temporal:
+        return TemporalEMA(ConfidenceWeighted(), settings.fusion_ema_alpha)
+    return ConfidenceWeighted()
+
+
+class FusionEngine:
+    """Empaqueta resultados por modalidad en tensores y aplica una estrategia"""
+
+    def __init__(self, strategy: FusionStrategy = None):
+        self.strategy = strategy or create_strategy()
+
+    @property
+    def method(self) -> str:
+        return self.strategy.name
+
+    @staticmethod
+    def pack(batch: List[Dict[str, dict]]) -> tuple:
+        """
+        Convierte una lista de {modalidad: resultado} en tensores
+
+        Returns:
+            (distributions (B, M, L), confidences (B, M), mask (B, M))
+        """
+        size = len(batch)
+        distributions = np.zeros((size, N_MODALITIES, N_EMOTIONS), dtype=np.float32)
+        confidences = np.zeros((size, N_MODALITIES), dtype=np.float32)
+        mask = np.zeros((size, N_MODALITIES), dtype=np.float32)
+
+        for b, results in enumerate(batch):
+            for modality, result in results.items():
+                m = MODALITY_INDEX[modality]
+                to_vector(result['all_emotions'], out=distributions[b, m])
+                confidences[b, m] = result['confidence']
+                mask[b, m] = 1.0
+
+        return distributions, confidences, mask
+
+    def fuse_batch(self, batch: List[Dict[str, dict]],
+                   keys: Optional[Sequence[Hashable]] = None) -> np.ndarray:
+        """Fusiona varios requests o muestras en una sola operación (B, L)"""
+        distributions, confidences, mask = self.pack(batch)
+        return self.strategy.fuse(distributions, confidences, mask, keys)
+
+    def fuse_results(self, results: Dict[str, dict], key: Hashable = None) -> np.ndarray:
+        """Fusiona los resultados de un único request (L,)"""
+        keys = None if key is None else [key]
+        return self.fuse_batch([results], keys)[0]
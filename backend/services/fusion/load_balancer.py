@@ -0,0 +1,232 @@
+"""
+Balanceo de carga entre réplicas y circuit breaker
+
+Cada modalidad tiene un EndpointPool con una o más réplicas. Las peticiones
+van a la réplica disponible con menos peticiones en curso; un health check
+activo contra /health y un circuit breaker por réplica las sacan de la
+rotación cuando fallan o se vuelven lentas, y la petición se reintenta
+de inmediato en otra réplica.
+"""
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger
+
+logger = get_logger()
+settings = get_settings()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Muestras de latencia antes de evaluar picos y peso de la media móvil
+LATENCY_MIN_SAMPLES = 5
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class NoHealthyEndpoint(Exception):
+    """Ninguna réplica disponible para la modalidad"""
+
+
+class CircuitBreaker:
+    """Circuit breaker por réplica: fallos consecutivos o latencia excesiva"""
+
+    def __init__(self, failure_threshold: int, open_seconds: float, latency_threshold: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.latency_threshold = latency_threshold
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.ewma_latency = 0.0
+        self.samples = 0
+        self.probe_in_flight = False
+        self.trips = 0
+
+    def available(self) -> bool:
+        """True si la réplica puede recibir una petición ahora"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        # En half-open solo se deja pasar una petición de prueba
+        return self.state == HALF_OPEN and not self.probe_in_flight
+
+    def on_request(self):
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = True
+
+    def record_success(self, latency: Optional[float]):
+        """Petición completada; latency=None si su duración no mide a la réplica"""
+        self.probe_in_flight = False
+        if latency is not None:
+            self.samples += 1
+            if self.samples == 1:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += LATENCY_EWMA_ALPHA * (latency - self.ewma_latency)
+
+            if self.samples >= LATENCY_MIN_SAMPLES and self.ewma_latency > self.latency_threshold:
+                self.trip(f"latencia media {self.ewma_latency:.2f}s")
+                return
+
+        self.consecutive_failures = 0
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.trip(f"{self.consecutive_failures} fallos consecutivos")
+
+    def release_probe(self):
+        """La prueba se canceló sin resultado: volver a abierto"""
+        if self.probe_in_flight:
+            self.probe_in_flight = False
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def trip(self, reason: str):
+        if self.state != OPEN:
+            self.trips += 1
+            logger.warning(f"Circuit breaker abierto: {reason}")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        # La latencia se vuelve a medir desde cero al cerrar
+        self.samples = 0
+
+
+class Endpoint:
+    """Una réplica de un servicio"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.breaker = CircuitBreaker(
+            settings.breaker_failure_threshold,
+            settings.breaker_open_seconds,
+            settings.breaker_latency_threshold,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "trips": self.breaker.trips,
+            "ewma_latency": round(self.breaker.ewma_latency, 4),
+        }
+
+
+def is_replica_failure(error: Exception) -> bool:
+    """Errores atribuibles a la réplica (red, timeout, 5xx, 429), no al request"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class EndpointPool:
+    """Réplicas de una modalidad con balanceo least-outstanding-requests"""
+
+    def __init__(self, name: str, urls: List[str]):
+        self.name = name
+        self.endpoints = [Endpoint(url) for url in urls]
+        self._health_task: Optional[asyncio.Task] = None
+
+    def select(self, exclude=()) -> Optional[Endpoint]:
+        available = [e for e in self.endpoints if e not in exclude and e.breaker.available()]
+        # Si el health check marca todas como caídas se prueba igualmente (el breaker decide)
+        candidates = [e for e in available if e.healthy] or available
+        if not candidates:
+            return None
+        least = min(e.outstanding for e in candidates)
+        return random.choice([e for e in candidates if e.outstanding == least])
+
+    async def call(self, send: Callable[[Endpoint], Awaitable], attempts: int = None,
+                   record_latency: bool = True):
+        """
+        Ejecuta send(endpoint) en la mejor réplica, reintentando en otra si falla
+
+        Args:
+            send: Corrutina que hace la petición a una réplica
+            attempts: Réplicas a probar como máximo (default: hasta 2)
+            record_latency: Si la duración cuenta para la latencia del breaker
+                (False cuando depende del cliente, p. ej. subidas en streaming)
+        """
+        attempts = attempts or min(len(self.endpoints), 2)
+        tried = set()
+        last_error = None
+
+        for _ in range(attempts):
+            endpoint = self.select(exclude=tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint)
+
+            endpoint.outstanding += 1
+            endpoint.breaker.on_request()
+            start = time.perf_counter()
+            try:
+                result = await send(endpoint)
+            except Exception as e:
+                if not is_replica_failure(e):
+                    endpoint.breaker.record_success(time.perf_counter() - start if record_latency else None)
+                    raise
+                endpoint.breaker.record_failure()
+                logger.warning(f"Fallo en réplica {endpoint.url} ({self.name}): {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                # Cancelación: la prueba en half-open no llegó a completarse
+                endpoint.breaker.release_probe()
+                raise
+            finally:
+                endpoint.outstanding -= 1
+
+            endpoint.breaker.record_success(time.perf_counter() - start if record_latency else None)
+            return result
+
+        if last_error is not None:
+            raise last_error
+        raise NoHealthyEndpoint(f"No hay réplicas disponibles para {self.name}")
+
+    async def check_health(self, client: httpx.AsyncClient):
+        for endpoint in self.endpoints:
+            try:
+                response = await client.get(f"{endpoint.url}/health", timeout=2.0)
+                healthy = response.status_code == 200 and response.json().get("status") == "healthy"
+            except Exception:
+                healthy = False
+            if healthy != endpoint.healthy:
+                logger.warning(f"Réplica {endpoint.url} ({self.name}) ahora {'sana' if healthy else 'no disponible'}")
+            endpoint.healthy = healthy
+
+    async def _health_loop(self, client: httpx.AsyncClient, interval: float):
+        while True:
+            await self.check_health(client)
+            await asyncio.sleep(interval)
+
+    def start_health_checks(self, client: httpx.AsyncClient, interval: float):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(client, interval))
+
+    def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> list:
+        return [e.stats() for e in self.endpoints]
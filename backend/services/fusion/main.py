@@ -1,7 +1,9 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
+from fastapi.responses import ORJSONResponse
 from typing import Optional
+import asyncio
+import httpx
 import time
 from datetime import datetime
 import sys
@@ -12,22 +14,52 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from shared.schemas import (
     MultimodalAnalysisResponse,
-    FacialAnalysisResponse,
-    VoiceAnalysisResponse,
-    TextAnalysisResponse,
+    VideoAnalysisResponse,
     HealthResponse
 )
 from shared.config import get_settings
-from shared.utils import get_logger
-from websocket_handler import websocket_endpoint
+from shared.utils import get_logger, collect_stats, sampled, RequestIdMiddleware
+from shared.serialization import decode_response
+from shared.database import start_persistence, stop_persistence, record_result
+from shared.admission import AdmissionMiddleware, get_admission_controller
+from shared.emotions import from_vector, dominant
+from shared.uploads import (
+    BodySizeLimitMiddleware, max_body_bytes, max_video_body_bytes, max_video_bytes, read_upload
+)
+from shared.model_registry import create_models_router
+from shared.admin import log_admin_status
+from shared.profiling import ProfilingMiddleware, create_profiling_router
+from websocket_handler import websocket_endpoint, observer_endpoint
+from pubsub import get_broker
+from upload_stream import MultipartStreamReader, UploadStream
+from session_recorder import start_recording, stop_recording
+from fusion_engine import FusionEngine, FixedWeights, create_strategy
+from analyzers import analyzers
 
 logger = get_logger()
 settings = get_settings()
+# Cada request HTTP es independiente: sin suavizado temporal aunque FUSION_STRATEGY=ema
+fusion_engine = FusionEngine(create_strategy(temporal=False))
 
 app = FastAPI(
     title="Multimodal Fusion Service",
     description="Microservicio para fusión de análisis multimodal de emociones",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
+
+# Control de admisión: compartido con el WebSocket, que entra con prioridad realtime.
+# Se registra antes que CORS para que las respuestas 429/503 lleven sus headers
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=get_admission_controller(settings.fusion_admission_max_concurrency)
+)
+
+# Rechazo temprano (413): hasta dos archivos (imagen y audio) por request, o un video
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=max_body_bytes(files=2),
+    path_limits={"/analyze/video": max_video_body_bytes()}
 )
 
 # CORS
@@ -39,16 +71,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Perfilado de CPU de los requests con X-Profile (dentro de RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
+# X-Request-ID en logs y respuestas (más externo para cubrir también los rechazos)
+app.add_middleware(RequestIdMiddleware)
+
+# Administración de modelos (solo hay modelos en proceso en modo monolito)
+app.include_router(create_models_router())
+
+# Perfilado de CPU bajo demanda (/profile, requiere X-Admin-Key)
+app.include_router(create_profiling_router())
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Inicializar analizadores (clientes HTTP o modelos en proceso)"""
+    log_admin_status()
+    logger.info(f"Modo de despliegue: {analyzers.mode}")
+    await analyzers.startup()
+    await get_broker().start()
+    start_persistence()
+    start_recording()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Liberar recursos de los analizadores"""
+    await analyzers.shutdown()
+    await get_broker().stop()
+    stop_persistence()
+    stop_recording()
+
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
     return HealthResponse(
         status="healthy",
-        service="fusion"
+        service=f"fusion (mode: {analyzers.mode})"
     )
 
 
+@app.get("/stats")
+async def stats():
+    """Métricas internas del servicio"""
+    return collect_stats()
+
+
 def weighted_fusion(results: dict, weights: dict = None) -> dict:
     """
     Fusión ponderada de resultados de múltiples modalidades
@@ -62,128 +132,114 @@ def weighted_fusion(results: dict, weights: dict = None) -> dict:
     """
     if weights is None:
         # Pesos iguales por defecto
-        n_modalities = len(results)
-        weights = {k: 1.0 / n_modalities for k in results.keys()}
-    
-    # Normalizar pesos
-    total_weight = sum(weights.values())
-    weights = {k: v / total_weight for k, v in weights.items()}
-    
-    # Fusionar emociones
-    fused_emotions = {}
+        weights = {k: 1.0 for k in results.keys()}
     
-    for modality, result in results.items():
-        weight = weights[modality]
-        
-        for emotion, score in result['all_emotions'].items():
-            if emotion not in fused_emotions:
-                fused_emotions[emotion] = 0.0
-            fused_emotions[emotion] += score * weight
-    
-    return fused_emotions
+    fused = FusionEngine(FixedWeights(weights)).fuse_results(results)
+    return from_vector(fused)
 
 
-@app.post("/analyze/multimodal", response_model=MultimodalAnalysisResponse)
-async def analyze_multimodal(
-    image: Optional[UploadFile] = File(None),
-    audio: Optional[UploadFile] = File(None),
-    text: Optional[str] = Form(None),
-    language: Optional[str] = Form("auto")
-):
+# El cuerpo se parsea en streaming (sin File/Form): se documenta el formulario a mano
+MULTIMODAL_FORM = {
+    "requestBody": {
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "image": {"type": "string", "format": "binary"},
+                        "audio": {"type": "string", "format": "binary"},
+                        "text": {"type": "string"},
+                        "language": {"type": "string", "default": "auto"},
+                    },
+                }
+            }
+        },
+        "required": True,
+    }
+}
+
+MODALITY_NAMES = {"facial": "facial", "voice": "de voz", "text": "de texto"}
+
+
+@app.post("/analyze/multimodal", response_model=MultimodalAnalysisResponse, openapi_extra=MULTIMODAL_FORM)
+async def analyze_multimodal(request: Request):
     """
     Análisis multimodal de emociones con fusión de resultados
     
-    Args:
+    Campos del formulario (multipart/form-data):
         image: Imagen facial (opcional)
         audio: Archivo de audio (opcional)
         text: Texto a analizar (opcional)
         language: Idioma del texto (auto, es, en)
     
+    La imagen y el audio se reenvían a sus servicios a medida que se suben:
+    el análisis facial empieza mientras el audio todavía está llegando.
+    
     Returns:
         Resultado fusionado de todas las modalidades
     """
     start_time = time.time()
     
+    # Los archivos demasiado grandes o con formato inválido se rechazan (413/415)
+    # en cuanto se detectan, cancelando las llamadas ya iniciadas
+    reader = MultipartStreamReader(request, kinds={"image": "image", "audio": "audio"})
+    tasks = {}
+    fields = {}
+    try:
+        async for item in reader:
+            if isinstance(item, UploadStream):
+                if item.field == "image" and "facial" not in tasks:
+                    logger.debug("Reenviando imagen para análisis facial...")
+                    tasks["facial"] = asyncio.create_task(analyzers.analyze_face_stream(item))
+                elif item.field == "audio" and "voice" not in tasks:
+                    logger.debug("Reenviando audio para análisis de voz...")
+                    tasks["voice"] = asyncio.create_task(analyzers.analyze_voice_stream(item))
+                else:
+                    item.abandon()
+            else:
+                name, value = item
+                fields[name] = value
+    except BaseException:
+        reader.abandon()
+        for task in tasks.values():
+            task.cancel()
+        raise
+    
+    text = fields.get("text")
+    language = fields.get("language") or "auto"
+    
     # Validar que al menos una modalidad esté presente
-    if not any([image, audio, text]):
+    if not tasks and not text:
         raise HTTPException(
             status_code=400,
             detail="Debe proporcionar al menos una modalidad (imagen, audio o texto)"
         )
     
+    if text and text.strip():
+        tasks["text"] = asyncio.create_task(analyzers.analyze_text(text, language))
+    
+    # Las modalidades se analizan en paralelo
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    
     results = {}
     modalities_used = []
+    for modality in ("facial", "voice", "text"):
+        task = tasks.get(modality)
+        if task is None:
+            continue
+        error = task.exception()
+        if error is not None:
+            # Con traceback completo
+            logger.opt(exception=error).error(f"Error en análisis {MODALITY_NAMES[modality]}: {str(error)}")
+            continue
+        results[modality] = task.result()
+        modalities_used.append(modality)
+        logger.debug("Análisis {} completado: {}", MODALITY_NAMES[modality], results[modality]['emotion'])
     
     # Resultados individuales
-    facial_result = None
-    voice_result = None
-    text_result = None
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        
-        # Análisis facial
-        if image:
-            try:
-                logger.info("Enviando imagen para análisis facial...")
-                image_bytes = await image.read()
-                files = {"file": (image.filename, image_bytes, image.content_type)}
-                
-                response = await client.post(
-                    f"{settings.facial_service_url}/analyze/face",
-                    files=files
-                )
-                response.raise_for_status()
-                
-                facial_result = FacialAnalysisResponse(**response.json())
-                results['facial'] = facial_result.dict()
-                modalities_used.append("facial")
-                logger.info(f"Análisis facial completado: {facial_result.emotion}")
-                
-            except Exception as e:
-                logger.error(f"Error en análisis facial: {str(e)}")
-                logger.exception(e)  # Traceback completo
-        
-        # Análisis de voz
-        if audio:
-            try:
-                logger.info("Enviando audio para análisis de voz...")
-                audio_bytes = await audio.read()
-                files = {"file": (audio.filename, audio_bytes, audio.content_type)}
-                
-                response = await client.post(
-                    f"{settings.voice_service_url}/analyze/voice",
-                    files=files
-                )
-                response.raise_for_status()
-                
-                voice_result = VoiceAnalysisResponse(**response.json())
-                results['voice'] = voice_result.dict()
-                modalities_used.append("voice")
-                logger.info(f"Análisis de voz completado: {voice_result.emotion}")
-                
-            except Exception as e:
-                logger.error(f"Error en análisis de voz: {str(e)}")
-                logger.exception(e)  # Traceback completo
-        
-        # Análisis de texto
-        if text and text.strip():
-            try:
-                logger.info("Enviando texto para análisis...")
-                
-                response = await client.post(
-                    f"{settings.text_service_url}/analyze/text",
-                    json={"text": text, "language": language}
-                )
-                response.raise_for_status()
-                
-                text_result = TextAnalysisResponse(**response.json())
-                results['text'] = text_result.dict()
-                modalities_used.append("text")
-                logger.info(f"Análisis de texto completado: {text_result.emotion}")
-                
-            except Exception as e:
-                logger.error(f"Error en análisis de texto: {str(e)}")
-                logger.exception(e)  # Traceback completo
+    facial_result = results.get("facial")
+    voice_result = results.get("voice")
+    text_result = results.get("text")
     
     # Validar que al menos un análisis fue exitoso
     if not results:
@@ -195,45 +251,114 @@ async def analyze_multimodal(
         )
     
     # Fusión de resultados
-    logger.info(f"Fusionando resultados de {len(results)} modalidades...")
+    logger.debug("Fusionando resultados de {} modalidades...", len(results))
     
-    # Pesos adaptativos basados en confianza
-    weights = {}
-    for modality, result in results.items():
-        weights[modality] = result['confidence']
-    
-    # Fusionar emociones
-    fused_emotions = weighted_fusion(results, weights)
+    # Fusionar emociones con la estrategia configurada (por defecto: ponderada por confianza)
+    fused = fusion_engine.fuse_results(results)
+    fused_emotions = from_vector(fused)
     
     # Emoción final
-    final_emotion = max(fused_emotions, key=fused_emotions.get)
-    final_confidence = fused_emotions[final_emotion]
+    final_emotion, final_confidence = dominant(fused)
+    final_confidence = min(final_confidence, 1.0)  # Redondeo float32
     
     total_time = time.time() - start_time
     
-    logger.info(f"Emoción final: {final_emotion} ({final_confidence:.2f})")
-    
-    return MultimodalAnalysisResponse(
-        final_emotion=final_emotion,
-        final_confidence=final_confidence,
-        all_emotions=fused_emotions,
-        facial_result=facial_result,
-        voice_result=voice_result,
-        text_result=text_result,
-        modalities_used=modalities_used,
-        fusion_method="weighted_by_confidence",
-        total_processing_time=total_time,
-        timestamp=datetime.utcnow()
-    )
+    if sampled():
+        logger.info("Emoción final: {} ({:.2f}) [{}]", final_emotion, final_confidence, ",".join(modalities_used))
+    
+    # Los resultados de los servicios ya son dicts validados en origen:
+    # se serializan directamente sin reconstruir los modelos Pydantic
+    response = {
+        "final_emotion": final_emotion,
+        "final_confidence": final_confidence,
+        "all_emotions": fused_emotions,
+        "facial_result": facial_result,
+        "voice_result": voice_result,
+        "text_result": text_result,
+        "modalities_used": modalities_used,
+        "fusion_method": fusion_engine.method,
+        "total_processing_time": total_time,
+        "timestamp": datetime.utcnow()
+    }
+    record_result("fusion", response)
+    
+    return ORJSONResponse(response)
+
+
+@app.post("/analyze/video", response_model=VideoAnalysisResponse)
+async def analyze_video(
+    video: UploadFile = File(...),
+    sample_fps: Optional[float] = Form(None),
+    include_audio: bool = Form(True)
+):
+    """
+    Análisis de un video: emociones faciales por frame y, opcionalmente, de la pista de audio
+    
+    Args:
+        video: Video (mp4, mov, webm, mkv, avi)
+        sample_fps: Frames por segundo a analizar (default: VIDEO_SAMPLE_FPS)
+        include_audio: Analizar también la voz de la pista de audio
+    
+    Returns:
+        Línea de tiempo de emociones por frame, distribución agregada y resultado de voz
+    """
+    if not video.content_type.startswith('video/'):
+        raise HTTPException(status_code=400, detail="El archivo debe ser un video")
+    if sample_fps is not None and not 0 < sample_fps <= 30:
+        raise HTTPException(status_code=400, detail="sample_fps debe estar entre 0 y 30")
+    
+    video_bytes = await read_upload(video, max_video_bytes(), kind="video")
+    
+    # Frames (servicio facial) y pista de audio (servicio de voz) en paralelo
+    tasks = [analyzers.analyze_video(
+        video_bytes, video.filename, video.content_type, sample_fps, timeout=settings.video_timeout
+    )]
+    if include_audio:
+        tasks.append(analyzers.analyze_voice(
+            video_bytes, video.filename, video.content_type, timeout=settings.video_timeout
+        ))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    video_result = results[0]
+    if isinstance(video_result, Exception):
+        logger.error(f"Error en análisis de video: {str(video_result)}")
+        if isinstance(video_result, HTTPException):
+            raise video_result
+        if isinstance(video_result, httpx.HTTPStatusError) and video_result.response.status_code < 500:
+            # Errores del video (413, 415, 422...) se devuelven tal cual los dio el servicio facial
+            response = video_result.response
+            detail = decode_response(response.content, response.headers.get("content-type", ""))
+            raise HTTPException(status_code=response.status_code, detail=detail.get("detail", str(video_result)))
+        raise HTTPException(status_code=500, detail=f"Error al procesar el video: {str(video_result)}")
+    
+    if include_audio:
+        # Un video sin pista de audio (o con audio ilegible) devuelve solo los frames
+        if isinstance(results[1], Exception):
+            logger.warning(f"No se pudo analizar el audio del video: {str(results[1])}")
+        else:
+            video_result["audio_result"] = results[1]
+    
+    return ORJSONResponse(video_result)
 
 
 @app.websocket("/ws/realtime")
-async def websocket_realtime(websocket: WebSocket):
+async def websocket_realtime(websocket: WebSocket, session_id: Optional[str] = None):
     """
     WebSocket endpoint para análisis en tiempo real
     Permite streaming de frames de video y texto
+    
+    El cliente puede fijar su ID de sesión con ?session_id=...
+    """
+    await websocket_endpoint(websocket, session_id)
+
+
+@app.websocket("/ws/observe/{session_id}")
+async def websocket_observe(websocket: WebSocket, session_id: str):
+    """
+    WebSocket de observación (p. ej. panel de supervisión)
+    Recibe en vivo los resultados y la fusión de la sesión indicada
     """
-    await websocket_endpoint(websocket)
+    await observer_endpoint(websocket, session_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+"""
+Publicación de resultados de sesiones en tiempo real a observadores
+
+Cada sesión WebSocket de análisis publica sus resultados bajo su session_id;
+los observadores (p. ej. un panel de supervisión) se suscriben a una sesión.
+
+- publish() nunca espera a los observadores ni a Redis: solo encola en la
+  cola acotada de cada suscriptor, y una tarea por suscriptor envía en paralelo
+- Si un observador no da abasto se descartan sus mensajes más antiguos
+  (recibe solo los más recientes); si un envío no termina en
+  observer_send_timeout se le desconecta
+- Con pubsub_backend="redis" los mensajes pasan por Redis pub/sub, así que
+  un observador conectado a otra instancia del gateway también los recibe
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+import orjson
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+CHANNEL_PREFIX = "emotions:session:"
+
+
+class Subscriber:
+    """Un observador con su cola acotada y su tarea de envío"""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], queue_size: int, send_timeout: float):
+        self.send = send
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.dropped = 0
+        self.closed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def offer(self, message: dict):
+        """Encola sin bloquear; con la cola llena se descarta el mensaje más antiguo"""
+        if self.closed.is_set():
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def _run(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.send(message), self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"Observador desconectado: envío bloqueado más de {self.send_timeout}s")
+        except Exception as e:
+            logger.warning(f"Observador desconectado: {str(e)}")
+        finally:
+            self.closed.set()
+
+    def close(self):
+        self._task.cancel()
+
+
+class SessionBroker:
+    """Suscripciones por sesión y reparto local"""
+
+    def __init__(self, queue_size: int = 32, send_timeout: float = 5.0):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self.published = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.close()
+        self._subscribers.clear()
+
+    async def subscribe(self, session_id: str, send: Callable[[dict], Awaitable[None]]) -> Subscriber:
+        subscriber = Subscriber(send, self.queue_size, self.send_timeout)
+        self._subscribers.setdefault(session_id, set()).add(subscriber)
+        return subscriber
+
+    async def unsubscribe(self, session_id: str, subscriber: Subscriber):
+        subscriber.close()
+        subscribers = self._subscribers.get(session_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[session_id]
+
+    def has_subscribers(self, session_id: str) -> bool:
+        return bool(self._subscribers.get(session_id))
+
+    def deliver(self, session_id: str, message: dict):
+        """Reparte un mensaje a los observadores locales de la sesión"""
+        for subscriber in tuple(self._subscribers.get(session_id, ())):
+            subscriber.offer(message)
+
+    def publish(self, session_id: str, message: dict):
+        """Publica un mensaje de la sesión (no bloquea)"""
+        self.published += 1
+        self.deliver(session_id, message)
+
+    def stats(self) -> dict:
+        subscribers = [s for group in self._subscribers.values() for s in group]
+        return {
+            "backend": "local",
+            "published": self.published,
+            "sessions_observed": len(self._subscribers),
+            "subscribers": len(subscribers),
+            "sent": sum(s.sent for s in subscribers),
+            "dropped": sum(s.dropped for s in subscribers),
+        }
+
+
+class RedisSessionBroker(SessionBroker):
+    """
+    Reparto entre instancias del gateway a través de Redis pub/sub
+
+    Cada instancia se suscribe en Redis solo a las sesiones que tienen
+    observadores locales; publish() publica en Redis y el listener entrega
+    a los observadores locales (también los de esta misma instancia).
+    """
+
+    def __init__(self, queue_size: int = 32, send_timeout: float = 5.0):
+        super().__init__(queue_size, send_timeout)
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._publisher: Optional[asyncio.Task] = None
+        # Mensajes pendientes de publicar: la sesión no espera a Redis
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        self.publish_errors = 0
+        self.publish_dropped = 0
+
+    async def start(self):
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            password=settings.redis_password or None,
+        )
+        self._pubsub = self._redis.pubsub()
+        self._listener = asyncio.create_task(self._listen())
+        self._publisher = asyncio.create_task(self._publish_loop())
+        logger.info(f"Observadores vía Redis ({settings.redis_host}:{settings.redis_port})")
+
+    async def stop(self):
+        await super().stop()
+        for task in (self._listener, self._publisher):
+            if task is not None:
+                task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def subscribe(self, session_id: str, send: Callable[[dict], Awaitable[None]]) -> Subscriber:
+        first = not self.has_subscribers(session_id)
+        subscriber = await super().subscribe(session_id, send)
+        if first:
+            await self._pubsub.subscribe(CHANNEL_PREFIX + session_id)
+        return subscriber
+
+    async def unsubscribe(self, session_id: str, subscriber: Subscriber):
+        await super().unsubscribe(session_id, subscriber)
+        if not self.has_subscribers(session_id):
+            await self._pubsub.unsubscribe(CHANNEL_PREFIX + session_id)
+
+    async def _listen(self):
+        while True:
+            try:
+                # Sin suscripciones get_message() vuelve de inmediato
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.5)
+                    continue
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message["channel"].decode()
+                self.deliver(channel[len(CHANNEL_PREFIX):], orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el listener de Redis: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    def publish(self, session_id: str, message: dict):
+        self.published += 1
+        if self._outbox.full():
+            self._outbox.get_nowait()
+            self.publish_dropped += 1
+        self._outbox.put_nowait((session_id, orjson.dumps(message)))
+
+    async def _publish_loop(self):
+        while True:
+            session_id, payload = await self._outbox.get()
+            try:
+                await self._redis.publish(CHANNEL_PREFIX + session_id, payload)
+            except Exception as e:
+                # Un fallo de Redis no debe afectar a la sesión que publica
+                self.publish_errors += 1
+                if self.publish_errors % 100 == 1:
+                    logger.error(f"Error al publicar en Redis: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "backend": "redis",
+            "publish_errors": self.publish_errors,
+            "publish_dropped": self.publish_dropped,
+        }
+
+
+_broker: Optional[SessionBroker] = None
+
+
+def get_broker() -> SessionBroker:
+    """Broker del proceso según settings.pubsub_backend ("local" | "redis")"""
+    global _broker
+    if _broker is None:
+        broker_class = RedisSessionBroker if settings.pubsub_backend == "redis" else SessionBroker
+        _broker = broker_class(
+            queue_size=settings.observer_queue_size,
+            send_timeout=settings.observer_send_timeout,
+        )
+        register_stats("pubsub", _broker.stats)
+    return _broker
@@ -0,0 +1,167 @@
+"""
+Control adaptativo de la tasa de envío de los clientes en tiempo real
+
+El gateway mide la latencia de cada análisis (espera en admisión incluida)
+por conexión y de forma global, y la compara con el intervalo al que el
+cliente envía esa modalidad: si un frame tarda más de lo que falta para el
+siguiente, la cola crece. Con esa utilización se elige un nivel de la
+tabla RATE_LEVELS y se envía al cliente un mensaje "rate_hint" con el
+intervalo entre frames, la resolución de imagen y la duración de los
+chunks de audio a usar.
+
+- Utilización por encima de rate_high_utilization (o un "busy" de
+  admisión): se sube un nivel (menos tráfico)
+- Por debajo de rate_low_utilization: se baja un nivel
+- Entre ambos umbrales no se cambia (histéresis), y nunca más de un
+  cambio cada rate_hint_min_interval segundos
+"""
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+# De menos a más restrictivo; el nivel 1 son los valores por defecto del cliente
+RATE_LEVELS = [
+    {"frame_interval_ms": 500, "image_max_width": 640, "jpeg_quality": 0.8, "audio_chunk_ms": 4000},
+    {"frame_interval_ms": 1000, "image_max_width": 640, "jpeg_quality": 0.8, "audio_chunk_ms": 6000},
+    {"frame_interval_ms": 2000, "image_max_width": 480, "jpeg_quality": 0.7, "audio_chunk_ms": 8000},
+    {"frame_interval_ms": 3000, "image_max_width": 320, "jpeg_quality": 0.6, "audio_chunk_ms": 10000},
+    {"frame_interval_ms": 5000, "image_max_width": 240, "jpeg_quality": 0.5, "audio_chunk_ms": 12000},
+]
+DEFAULT_LEVEL = 1
+
+# Intervalo de envío de cada modalidad en un nivel (texto: sin límite propio)
+INTERVAL_KEYS = {"facial": "frame_interval_ms", "voice": "audio_chunk_ms"}
+
+EWMA_ALPHA = 0.3
+
+
+class Ewma:
+    """Media móvil exponencial"""
+
+    def __init__(self, alpha: float = EWMA_ALPHA):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def update(self, sample: float) -> float:
+        self.value = sample if self.value is None else self.value + self.alpha * (sample - self.value)
+        return self.value
+
+
+class GlobalLoad:
+    """Utilización agregada de todas las conexiones del gateway"""
+
+    def __init__(self):
+        self.utilization: Dict[str, Ewma] = {modality: Ewma() for modality in INTERVAL_KEYS}
+        self.latency_ms: Dict[str, Ewma] = {modality: Ewma() for modality in INTERVAL_KEYS}
+        self.busy = 0
+        self.hints_sent = 0
+        self.level_counts: Dict[int, int] = {}
+
+    def utilization_max(self) -> float:
+        return max((e.value or 0.0) for e in self.utilization.values())
+
+    def stats(self) -> dict:
+        return {
+            "utilization": {m: round(e.value or 0.0, 3) for m, e in self.utilization.items()},
+            "latency_ms": {m: round(e.value or 0.0, 1) for m, e in self.latency_ms.items()},
+            "busy": self.busy,
+            "hints_sent": self.hints_sent,
+            "connections_by_level": dict(sorted(self.level_counts.items())),
+        }
+
+
+global_load = GlobalLoad()
+register_stats("rate_control", global_load.stats)
+
+
+class RateController:
+    """Nivel de tasa de una conexión y envío de rate_hint"""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]]):
+        self.send = send
+        self.enabled = settings.rate_control_enabled
+        self.level = DEFAULT_LEVEL
+        self.utilization: Dict[str, Ewma] = {modality: Ewma() for modality in INTERVAL_KEYS}
+        self.busy_pending = False
+        self.changed_at = 0.0
+        global_load.level_counts[self.level] = global_load.level_counts.get(self.level, 0) + 1
+
+    @property
+    def hint(self) -> dict:
+        return RATE_LEVELS[self.level]
+
+    def record(self, modality: str, latency: float):
+        """Registra la latencia (s) de un análisis de la conexión"""
+        key = INTERVAL_KEYS.get(modality)
+        if key is None:
+            return
+        utilization = latency * 1000 / self.hint[key]
+        self.utilization[modality].update(utilization)
+        global_load.utilization[modality].update(utilization)
+        global_load.latency_ms[modality].update(latency * 1000)
+
+    def record_busy(self):
+        """La admisión rechazó un mensaje: reducir la tasa sin esperar a la latencia"""
+        self.busy_pending = True
+        global_load.busy += 1
+
+    def _target_level(self) -> int:
+        utilization = max(
+            max((e.value or 0.0) for e in self.utilization.values()),
+            global_load.utilization_max()
+        )
+        if self.busy_pending or utilization > settings.rate_high_utilization:
+            return min(self.level + 1, len(RATE_LEVELS) - 1)
+        if utilization < settings.rate_low_utilization:
+            return max(self.level - 1, 0)
+        return self.level
+
+    async def send_hint(self, reason: str):
+        global_load.hints_sent += 1
+        await self.send({
+            "type": "rate_hint",
+            "level": self.level,
+            **self.hint,
+            "reason": reason,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+    async def update(self):
+        """Reevalúa el nivel y envía un rate_hint si cambia"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self.changed_at < settings.rate_hint_min_interval:
+            return
+
+        target = self._target_level()
+        self.busy_pending = False
+        if target == self.level:
+            return
+
+        reason = "load" if target > self.level else "idle"
+        self._set_level(target)
+        self.changed_at = now
+        # Las medias se expresaban respecto al intervalo anterior
+        for ewma in self.utilization.values():
+            ewma.value = None
+        logger.debug("Nivel de tasa {} ({})", self.level, reason)
+        await self.send_hint(reason)
+
+    def _set_level(self, level: int):
+        global_load.level_counts[self.level] -= 1
+        self.level = level
+        global_load.level_counts[level] = global_load.level_counts.get(level, 0) + 1
+
+    def close(self):
+        global_load.level_counts[self.level] -= 1
@@ -0,0 +1,161 @@
+"""
+Fusión en tiempo real del lado del servidor
+
+Cada conexión WebSocket mantiene la última distribución recibida por
+modalidad. Al llegar un resultado nuevo solo se actualiza su fila y se
+marca el estado como pendiente; una tarea por conexión recalcula la
+fusión y envía un único mensaje "fused_result" como máximo max_rate_hz
+veces por segundo, agrupando las actualizaciones intermedias.
+
+La estrategia es la configurada en FUSION_STRATEGY (create_strategy), con
+una instancia por conexión: con "ema" el suavizado temporal se mantiene
+por sesión y se libera al cerrarla.
+"""
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Hashable, Optional
+
+import numpy as np
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.emotions import N_EMOTIONS, to_vector, from_vector, dominant
+from shared.schemas import MODALITIES
+from shared.utils import get_logger
+from fusion_engine import MODALITY_INDEX, N_MODALITIES, create_strategy
+
+logger = get_logger()
+settings = get_settings()
+
+# Peso mínimo (tras el decaimiento) para que una modalidad siga contando
+MIN_DECAY_WEIGHT = 0.05
+
+MIN_RATE_HZ = 0.1
+MAX_RATE_HZ = 30.0
+
+
+class RealtimeFusionState:
+    """Estado de fusión incremental de una conexión"""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], key: Hashable = "session"):
+        self.send = send
+        self.key = key
+        self.enabled = False
+        self.max_rate_hz = settings.realtime_fusion_max_rate_hz
+        self.half_life = settings.realtime_fusion_half_life
+
+        # Estrategia configurada (instancia propia: el estado de "ema" es de esta sesión)
+        self.strategy = create_strategy()
+
+        # Tensores (1, M, L) actualizados fila a fila
+        self.distributions = np.zeros((1, N_MODALITIES, N_EMOTIONS), dtype=np.float32)
+        self.confidences = np.zeros((1, N_MODALITIES), dtype=np.float32)
+        self.mask = np.zeros((1, N_MODALITIES), dtype=np.float32)
+        self.updated_at = np.zeros(N_MODALITIES, dtype=np.float64)
+
+        self._pending = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _positive(name: str, value) -> float:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = math.nan
+        if isinstance(value, bool) or not math.isfinite(number) or number <= 0:
+            raise ValueError(f"{name} debe ser un número positivo")
+        return number
+
+    def configure(self, enabled: bool = True, max_rate_hz: float = None, half_life: float = None):
+        """
+        Aplica la configuración elegida por el cliente
+
+        Raises:
+            ValueError: si algún valor no es válido (no se aplica ninguno)
+        """
+        if not isinstance(enabled, bool):
+            raise ValueError("enabled debe ser true o false")
+        if max_rate_hz is not None:
+            max_rate_hz = min(max(self._positive("max_rate_hz", max_rate_hz), MIN_RATE_HZ), MAX_RATE_HZ)
+        if half_life is not None:
+            half_life = self._positive("half_life", half_life)
+
+        if max_rate_hz is not None:
+            self.max_rate_hz = max_rate_hz
+        if half_life is not None:
+            self.half_life = half_life
+
+        self.enabled = enabled
+        if enabled and self._task is None:
+            self._task = asyncio.create_task(self._push_loop())
+        elif not enabled:
+            self.stop()
+
+    def update(self, modality: str, result: dict):
+        """Registra el último resultado de una modalidad"""
+        m = MODALITY_INDEX[modality]
+        self.distributions[0, m] = 0.0
+        to_vector(result['all_emotions'], out=self.distributions[0, m])
+        self.confidences[0, m] = result['confidence']
+        self.mask[0, m] = 1.0
+        self.updated_at[m] = time.monotonic()
+
+        if self.enabled:
+            self._pending.set()
+
+    def compute(self) -> Optional[dict]:
+        """Fusiona las distribuciones vigentes aplicando decaimiento temporal"""
+        age = time.monotonic() - self.updated_at
+        decay = np.power(0.5, age / self.half_life).astype(np.float32)
+        mask = self.mask * (decay >= MIN_DECAY_WEIGHT)
+        if not mask.any():
+            return None
+
+        confidences = self.confidences * decay
+        fused = self.strategy.fuse(self.distributions, confidences, mask, [self.key])[0]
+        final_emotion, final_confidence = dominant(fused)
+
+        return {
+            "final_emotion": final_emotion,
+            "final_confidence": min(final_confidence, 1.0),
+            "all_emotions": from_vector(fused),
+            "modalities_used": [m for i, m in enumerate(MODALITIES) if mask[0, i]],
+            "modality_weights": {
+                m: float(decay[i]) for i, m in enumerate(MODALITIES) if mask[0, i]
+            },
+            "fusion_method": f"{self.strategy.name}+decay",
+        }
+
+    async def _push_loop(self):
+        """Envía como máximo un fused_result por intervalo"""
+        try:
+            while True:
+                await self._pending.wait()
+                self._pending.clear()
+
+                result = self.compute()
+                if result is not None:
+                    await self.send({
+                        "type": "fused_result",
+                        "result": result,
+                        "timestamp": datetime.utcnow().isoformat()
+                    })
+
+                # Las actualizaciones que lleguen durante la espera se agrupan
+                await asyncio.sleep(1.0 / self.max_rate_hz)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error en fusión en tiempo real: {str(e)}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if hasattr(self.strategy, "reset"):
+            self.strategy.reset(self.key)
@@ -0,0 +1,242 @@
+"""
+Grabación de sesiones WebSocket en tiempo real para reproducirlas después
+
+Con SESSION_RECORDING_ENABLED=True cada sesión de /ws/realtime guarda los
+mensajes que envía el cliente, con el instante en que llegaron, en un
+archivo JSON Lines comprimido con gzip:
+
+    {"session_id": "...", "started_at": "...", "version": 1}
+    {"t": 0.512, "m": "{\"type\": \"analyze_frame\", ...}"}
+    ...
+    {"t": 63.2, "end": true}
+
+"t" son los segundos desde el inicio de la sesión y "m" el mensaje tal
+cual llegó. tools/replay_sessions.py reproduce estos archivos contra un
+gateway.
+
+La sesión nunca espera al disco: los mensajes se encolan en una cola
+acotada y un hilo en segundo plano los comprime y escribe (si la cola se
+llena se descartan y se cuentan en GET /stats, "recorder"). El cierre
+de una sesión no se pierde aunque la cola esté llena: el hilo escribe el
+registro "end" y cierra el archivo al terminar lo que ya estaba encolado.
+"""
+import gzip
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import orjson
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+FORMAT_VERSION = 1
+_OPEN, _WRITE, _CLOSE = "open", "write", "close"
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class RecordingWriter:
+    """Hilo que escribe los archivos de todas las sesiones grabadas"""
+
+    def __init__(self, directory: str, queue_size: int = 10000):
+        self.directory = Path(directory)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._files: Dict[str, gzip.GzipFile] = {}
+        self._thread: Optional[threading.Thread] = None
+        # Operaciones encoladas y aplicadas: orden FIFO, así que aplicadas >= N
+        # significa que ya se escribió todo lo encolado antes de la N-ésima
+        self._submitted = 0
+        self._applied = 0
+        # Cierres que no cupieron en la cola: clave -> (registro final, operaciones previas)
+        self._pending_closes: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        self.metrics = {
+            "sessions": 0,
+            "messages": 0,
+            "dropped": 0,
+            "bytes": 0,
+            "failed": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+        self._thread.start()
+        logger.info(f"Grabación de sesiones activa en {self.directory}")
+
+    def stop(self, timeout: float = 5.0):
+        """Cierra los archivos abiertos tras escribir lo pendiente"""
+        if not self.running:
+            return
+        # None como centinela: se procesa después de todo lo encolado
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Cola de grabación llena al detener: se pierden los mensajes pendientes")
+            return
+        self._thread.join(timeout)
+
+    def submit(self, op: str, key: str, payload=None) -> bool:
+        """Encola una operación sin bloquear"""
+        if self._put((op, key, payload)):
+            return True
+        self.metrics["dropped"] += 1
+        return False
+
+    def close_file(self, key: str, payload):
+        """Escribe el registro final y cierra el archivo; con la cola llena lo hace el hilo después"""
+        if not self._put((_CLOSE, key, payload)):
+            with self._lock:
+                self._pending_closes[key] = (payload, self._submitted)
+
+    def _put(self, item: tuple) -> bool:
+        with self._lock:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                return False
+            self._submitted += 1
+            return True
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "open_files": len(self._files),
+            "pending_closes": len(self._pending_closes),
+            "queue_size": self._queue.qsize(),
+            "directory": str(self.directory),
+        }
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                self._close_pending()
+                continue
+            if item is None:
+                break
+            try:
+                self._apply(*item)
+            except Exception as e:
+                self.metrics["failed"] += 1
+                logger.error(f"Error al grabar la sesión: {str(e)}")
+            self._applied += 1
+            self._close_pending()
+        self._close_pending(force=True)
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+    def _close_pending(self, force: bool = False):
+        """Aplica los cierres diferidos cuyas operaciones previas ya se escribieron"""
+        if not self._pending_closes:
+            return
+        with self._lock:
+            ready = [
+                (key, payload) for key, (payload, submitted) in self._pending_closes.items()
+                if force or submitted <= self._applied
+            ]
+            for key, _ in ready:
+                del self._pending_closes[key]
+        for key, payload in ready:
+            try:
+                self._apply(_CLOSE, key, payload)
+            except Exception as e:
+                self.metrics["failed"] += 1
+                logger.error(f"Error al cerrar la grabación de la sesión: {str(e)}")
+
+    def _apply(self, op: str, key: str, payload):
+        if op == _OPEN:
+            path = self.directory / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._files[key] = gzip.open(path, "wb", compresslevel=6)
+            self.metrics["sessions"] += 1
+            op = _WRITE
+        handle = self._files.get(key)
+        if handle is None:
+            return
+        line = orjson.dumps(payload) + b"\n"
+        handle.write(line)
+        self.metrics["bytes"] += len(line)
+        if op == _CLOSE:
+            handle.close()
+            del self._files[key]
+
+
+class SessionRecorder:
+    """Grabación de una sesión: registra cada mensaje recibido con su instante"""
+
+    def __init__(self, writer: RecordingWriter, session_id: str, connection_id: str):
+        self.writer = writer
+        self.start = time.monotonic()
+        started_at = datetime.utcnow()
+        # Un archivo por conexión (varias conexiones pueden compartir session_id);
+        # el session_id lo elige el cliente, así que se limpia antes de usarlo en la ruta
+        safe_id = _UNSAFE_CHARS.sub("_", session_id)[:64]
+        self.key = f"{started_at:%Y-%m-%d}/{safe_id}-{connection_id}.jsonl.gz"
+        self.active = writer.submit(_OPEN, self.key, {
+            "session_id": session_id,
+            "started_at": started_at.isoformat(),
+            "version": FORMAT_VERSION,
+        })
+
+    def record(self, text: str):
+        """Registra un mensaje tal como llegó del cliente"""
+        if self.active and self.writer.submit(_WRITE, self.key, {"t": round(time.monotonic() - self.start, 4), "m": text}):
+            self.writer.metrics["messages"] += 1
+
+    def close(self):
+        if self.active:
+            self.writer.close_file(self.key, {"t": round(time.monotonic() - self.start, 4), "end": True})
+            self.active = False
+
+
+_writer: Optional[RecordingWriter] = None
+
+
+def start_recording():
+    """Arranca el writer si la grabación está habilitada"""
+    global _writer
+    if not settings.session_recording_enabled or _writer is not None:
+        return
+    try:
+        _writer = RecordingWriter(settings.session_recording_dir)
+        _writer.start()
+        register_stats("recorder", _writer.stats)
+    except Exception as e:
+        _writer = None
+        logger.error(f"No se pudo iniciar la grabación de sesiones: {str(e)}")
+
+
+def stop_recording():
+    if _writer is not None:
+        _writer.stop()
+
+
+def create_recorder(session_id: str, connection_id: str) -> Optional[SessionRecorder]:
+    """Grabador para una nueva sesión, o None si no se graba (deshabilitado o fuera de la muestra)"""
+    if _writer is None or not _writer.running:
+        return None
+    if random.random() >= settings.session_recording_sample_rate:
+        return None
+    return SessionRecorder(_writer, session_id, connection_id)
@@ -0,0 +1,235 @@
+"""
+Reenvío en streaming de archivos multipart del gateway a los servicios
+
+En lugar de dejar que el framework guarde cada archivo del request y
+luego reconstruir un multipart para cada servicio, el gateway parsea el
+cuerpo a medida que llega (python-multipart) y pasa los bloques de cada
+archivo a la petición HTTP del servicio correspondiente, que empieza en
+cuanto llegan las cabeceras de esa parte:
+
+- Cada archivo es un UploadStream con una cola acotada de bloques: si el
+  servicio lee más despacio de lo que sube el cliente, se deja de leer el
+  request (la memoria por request no crece con el tamaño de los archivos)
+- El límite de tamaño y el formato (magic bytes) se validan sobre la
+  marcha, con los mismos 413/415 que read_upload
+- Si el servicio termina antes de leer todo (p. ej. lo rechaza), el resto
+  de la parte se descarta sin bloquear la lectura del request
+
+Uso:
+    reader = MultipartStreamReader(request, kinds={"image": "image", "audio": "audio"})
+    async for item in reader:
+        if isinstance(item, UploadStream):
+            ...  # iniciar la petición al servicio con item.chunks()
+        else:
+            name, value = item  # campo de formulario
+"""
+import asyncio
+import uuid
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
+
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.uploads import max_upload_bytes, sniff_format
+
+# Bloques en cola por archivo antes de dejar de leer el request
+QUEUE_CHUNKS = 8
+
+# Bytes necesarios para identificar el formato (el magic más lejano está en el offset 8)
+SNIFF_BYTES = 16
+
+_END = object()
+
+
+class UploadStream:
+    """Un archivo del request que se consume por bloques mientras se sube"""
+
+    def __init__(self, field: str, filename: str, content_type: str,
+                 kind: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.kind = kind
+        self.max_bytes = max_bytes or max_upload_bytes()
+        self.size = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+        self._head = b""
+        self._sniffed = kind is None
+        self._abandoned = False
+
+    async def feed(self, data: bytes):
+        """Entrega un bloque (espera si el consumidor va atrasado)"""
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"El archivo supera el límite de {self.max_bytes // (1024 * 1024)} MB"
+            )
+        if not self._sniffed:
+            # Se retienen los primeros bytes hasta poder validar el formato
+            self._head += data
+            if len(self._head) < SNIFF_BYTES:
+                return
+            data = self._release_head()
+        await self._put(data)
+
+    async def finish(self):
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="El archivo está vacío")
+        if not self._sniffed:
+            await self._put(self._release_head())
+        await self._put(_END)
+
+    def _release_head(self) -> bytes:
+        if sniff_format(self._head, self.kind) is None:
+            raise HTTPException(status_code=415, detail=f"Formato de {self.kind} no soportado")
+        self._sniffed = True
+        head, self._head = self._head, b""
+        return head
+
+    async def _put(self, item):
+        if not self._abandoned:
+            await self._queue.put(item)
+
+    def abandon(self):
+        """El consumidor ya no va a leer: se descarta lo pendiente y lo que llegue"""
+        self._abandoned = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Bloques del archivo hasta el final de la parte"""
+        try:
+            while True:
+                chunk = await self._queue.get()
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            self.abandon()
+
+    async def read(self) -> bytes:
+        """Archivo completo (analizadores en proceso, que necesitan los bytes)"""
+        return b"".join([chunk async for chunk in self.chunks()])
+
+
+async def multipart_body(field: str, upload: UploadStream, boundary: str) -> AsyncIterator[bytes]:
+    """Cuerpo multipart/form-data de un único archivo, generado a medida que llegan sus bloques"""
+    filename = (upload.filename or field).replace('"', "%22")
+    yield (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {upload.content_type}\r\n\r\n'
+    ).encode()
+    async for chunk in upload.chunks():
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def streaming_file_request(upload: UploadStream, field: str = "file") -> Tuple[dict, AsyncIterator[bytes]]:
+    """Cabeceras y cuerpo (generador) para reenviar un UploadStream con httpx"""
+    boundary = uuid.uuid4().hex
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    return headers, multipart_body(field, upload, boundary)
+
+
+class MultipartStreamReader:
+    """
+    Parser incremental del cuerpo multipart/form-data de un request
+
+    Al iterar produce un UploadStream por cada archivo (en cuanto llegan sus
+    cabeceras, antes que sus datos) y una tupla (nombre, valor) por cada
+    campo de texto completo. Los datos de los archivos se entregan a su
+    UploadStream mientras la iteración continúa.
+    """
+
+    def __init__(self, request: Request, kinds: Dict[str, str] = None, max_field_bytes: int = 64 * 1024):
+        self.request = request
+        self.kinds = kinds or {}
+        self.max_field_bytes = max_field_bytes
+        self.streams = []
+
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Se esperaba un cuerpo multipart/form-data")
+
+        self._events = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        callbacks = {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": lambda data, start, end: self._events.append(("data", data[start:end])),
+            "on_part_end": lambda: self._events.append(("end", None)),
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self._events.append(("headers", dict(self._headers))),
+        }
+        self._parser = MultipartParser(params[b"boundary"], callbacks)
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    async def __aiter__(self) -> AsyncIterator[Union[UploadStream, Tuple[str, str]]]:
+        current: Optional[UploadStream] = None
+        field_name = None
+        field_value = bytearray()
+
+        async for chunk in self.request.stream():
+            if not chunk:
+                continue
+            self._parser.write(chunk)
+            events, self._events = self._events, []
+
+            for event, value in events:
+                if event == "headers":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    field_name = options.get(b"name", b"").decode()
+                    if b"filename" in options:
+                        current = UploadStream(
+                            field_name,
+                            options[b"filename"].decode(errors="replace"),
+                            value.get(b"content-type", b"application/octet-stream").decode(),
+                            kind=self.kinds.get(field_name)
+                        )
+                        self.streams.append(current)
+                        yield current
+                    else:
+                        current = None
+                        field_value = bytearray()
+                elif event == "data":
+                    if current is not None:
+                        await current.feed(value)
+                    else:
+                        field_value += value
+                        if len(field_value) > self.max_field_bytes:
+                            raise HTTPException(status_code=413, detail=f"El campo {field_name} es demasiado grande")
+                elif event == "end":
+                    if current is not None:
+                        await current.finish()
+                        current = None
+                    else:
+                        yield field_name, field_value.decode(errors="replace")
+
+        self._parser.finalize()
+
+    def abandon(self):
+        """Libera los archivos pendientes (el request terminó con error)"""
+        for stream in self.streams:
+            stream.abandon()
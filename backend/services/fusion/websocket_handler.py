@@ -4,23 +4,32 @@ WebSocket handler para análisis en tiempo real
 from fastapi import WebSocket, WebSocketDisconnect
 from typing import Dict, Set
 import asyncio
-import json
-import httpx
+import orjson
 from datetime import datetime
 import base64
-import io
-from PIL import Image
+import time
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from shared.config import get_settings
-from shared.utils import get_logger
+from shared.utils import get_logger, sampled, new_request_id, set_request_id
+from shared.serialization import dumps_text
+from shared.admission import AdmissionRejected, PRIORITY_REALTIME, get_admission_controller
+from shared.admin import ADMIN_KEY_HEADER, admin_enabled, is_admin_key
+from analyzers import analyzers
+from realtime_fusion import RealtimeFusionState
+from pubsub import get_broker
+from rate_control import RateController
+from session_recorder import create_recorder
 
 logger = get_logger()
 settings = get_settings()
 
+# Espera máxima del mensaje de autenticación de un observador
+OBSERVER_AUTH_TIMEOUT = 5.0
+
 
 class ConnectionManager:
     """Administrador de conexiones WebSocket"""
@@ -38,19 +47,81 @@ class ConnectionManager:
         logger.info(f"Conexión cerrada. Total: {len(self.active_connections)}")
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        await websocket.send_text(dumps_text(message))
+    
+    async def _send_or_drop(self, connection: WebSocket, text: str):
+        try:
+            await asyncio.wait_for(connection.send_text(text), settings.observer_send_timeout)
+        except Exception as e:
+            logger.warning(f"Error en broadcast, conexión descartada: {type(e).__name__}: {str(e)}")
+            self.active_connections.discard(connection)
     
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+        # Envío concurrente: una conexión lenta no retrasa a las demás
+        text = dumps_text(message)
+        await asyncio.gather(*(
+            self._send_or_drop(connection, text) for connection in tuple(self.active_connections)
+        ))
 
 
 manager = ConnectionManager()
 
 
+class RealtimeSession:
+    """Estado de una conexión WebSocket de análisis en tiempo real"""
+    
+    def __init__(self, websocket: WebSocket, session_id: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.broker = get_broker()
+        self.fusion = RealtimeFusionState(self.emit, session_id)
+        self.rate = RateController(self.send)
+        # Si es False solo se envían los fused_result (menos mensajes al cliente)
+        self.emit_modality_results = True
+        # "seq" del mensaje analyze_* en curso: se devuelve en su respuesta (replay)
+        self.seq = None
+        self._send_lock = asyncio.Lock()
+    
+    def reply(self, message: dict) -> dict:
+        """Añade a una respuesta el seq del mensaje que la originó, si lo traía"""
+        if self.seq is not None:
+            message["seq"] = self.seq
+        return message
+    
+    async def send(self, message: dict):
+        # La tarea de fusión y el loop de mensajes comparten el socket
+        async with self._send_lock:
+            await manager.send_personal_message(message, self.websocket)
+    
+    async def emit(self, message: dict):
+        """Envía un resultado al cliente y lo publica a los observadores de la sesión"""
+        await self.send(message)
+        self.broker.publish(self.session_id, message)
+    
+    async def publish_result(self, modality: str, result: dict):
+        """Entrega un resultado de modalidad al cliente, a los observadores y al estado de fusión"""
+        message = self.reply({
+            "type": "analysis_result",
+            "modality": modality,
+            "result": result,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+        if self.emit_modality_results:
+            await self.send(message)
+        # Los observadores reciben siempre los resultados por modalidad
+        self.broker.publish(self.session_id, message)
+        self.fusion.update(modality, result)
+    
+    def close(self):
+        self.fusion.stop()
+        self.rate.close()
+        self.broker.publish(self.session_id, {
+            "type": "session_ended",
+            "session_id": self.session_id,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+
+
 async def analyze_frame_realtime(image_data: str) -> dict:
     """
     Analiza un frame de imagen en tiempo real
@@ -65,14 +136,7 @@ async def analyze_frame_realtime(image_data: str) -> dict:
         # Decodificar imagen base64
         image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            files = {"file": ("frame.jpg", image_bytes, "image/jpeg")}
-            response = await client.post(
-                f"{settings.facial_service_url}/analyze/face",
-                files=files
-            )
-            response.raise_for_status()
-            return response.json()
+        return await analyzers.analyze_face(image_bytes, "frame.jpg", "image/jpeg", timeout=10.0, priority="realtime")
     
     except Exception as e:
         logger.error(f"Error en análisis de frame: {str(e)}")
@@ -93,14 +157,7 @@ async def analyze_audio_realtime(audio_data: str) -> dict:
         # Decodificar audio base64
         audio_bytes = base64.b64decode(audio_data.split(',')[1] if ',' in audio_data else audio_data)
         
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            files = {"file": ("audio_chunk.webm", audio_bytes, "audio/webm")}
-            response = await client.post(
-                f"{settings.voice_service_url}/analyze/voice",
-                files=files
-            )
-            response.raise_for_status()
-            return response.json()
+        return await analyzers.analyze_voice(audio_bytes, "audio_chunk.webm", "audio/webm", timeout=15.0, priority="realtime")
     
     except Exception as e:
         logger.error(f"Error en análisis de audio: {str(e)}")
@@ -119,64 +176,50 @@ async def analyze_text_realtime(text: str, language: str = "auto") -> dict:
         Resultado del análisis de texto
     """
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                f"{settings.text_service_url}/analyze/text",
-                json={"text": text, "language": language}
-            )
-            response.raise_for_status()
-            return response.json()
+        return await analyzers.analyze_text(text, language, timeout=10.0, priority="realtime")
     
     except Exception as e:
         logger.error(f"Error en análisis de texto: {str(e)}")
         return None
 
 
-async def handle_websocket_message(websocket: WebSocket, data: dict):
+ANALYSIS_MESSAGES = {"analyze_frame": "facial", "analyze_audio": "voice", "analyze_text": "text"}
+
+
+async def handle_analysis_message(session: RealtimeSession, message_type: str, data: dict):
     """
-    Maneja mensajes entrantes del WebSocket
+    Ejecuta el análisis pedido por un mensaje analyze_*
     
     Args:
-        websocket: Conexión WebSocket
+        session: Sesión de la conexión WebSocket
+        message_type: Tipo de mensaje
         data: Datos del mensaje
     """
-    message_type = data.get("type")
-    
     if message_type == "analyze_frame":
         # Análisis de frame de video
         image_data = data.get("image")
         if image_data:
             result = await analyze_frame_realtime(image_data)
             if result:
-                await manager.send_personal_message({
-                    "type": "analysis_result",
-                    "modality": "facial",
-                    "result": result,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, websocket)
+                await session.publish_result("facial", result)
     
     elif message_type == "analyze_audio":
         # Análisis de audio en tiempo real
         audio_data = data.get("audio")
         if audio_data:
-            logger.info("Procesando análisis de audio en tiempo real...")
             result = await analyze_audio_realtime(audio_data)
             if result:
-                logger.info(f"Enviando resultado de audio: {result.get('emotion')} ({result.get('confidence'):.2f})")
-                await manager.send_personal_message({
-                    "type": "analysis_result",
-                    "modality": "voice",
-                    "result": result,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, websocket)
+                if sampled("realtime"):
+                    logger.info("Resultado de audio: {} ({:.2f})", result.get('emotion'), result.get('confidence'))
+                await session.publish_result("voice", result)
             else:
                 logger.warning("No se obtuvo resultado del análisis de audio")
-                await manager.send_personal_message({
+                await session.send(session.reply({
                     "type": "error",
                     "modality": "voice",
                     "message": "Error al analizar audio",
                     "timestamp": datetime.utcnow().isoformat()
-                }, websocket)
+                }))
     
     elif message_type == "analyze_text":
         # Análisis de texto en tiempo real
@@ -185,45 +228,115 @@ async def handle_websocket_message(websocket: WebSocket, data: dict):
         if text and len(text.strip()) > 5:
             result = await analyze_text_realtime(text, language)
             if result:
-                await manager.send_personal_message({
-                    "type": "analysis_result",
-                    "modality": "text",
-                    "result": result,
-                    "timestamp": datetime.utcnow().isoformat()
-                }, websocket)
+                await session.publish_result("text", result)
+
+
+async def handle_websocket_message(session: RealtimeSession, data: dict):
+    """
+    Maneja mensajes entrantes del WebSocket
+    
+    Args:
+        session: Sesión de la conexión WebSocket
+        data: Datos del mensaje
+    """
+    message_type = data.get("type")
+    
+    if message_type in ANALYSIS_MESSAGES:
+        # El tráfico en tiempo real tiene prioridad sobre las subidas masivas
+        start = time.perf_counter()
+        session.seq = data.get("seq")
+        try:
+            async with get_admission_controller().admit(PRIORITY_REALTIME):
+                await handle_analysis_message(session, message_type, data)
+            # Latencia completa (espera en admisión incluida) para el control de tasa
+            session.rate.record(ANALYSIS_MESSAGES[message_type], time.perf_counter() - start)
+        except AdmissionRejected as e:
+            # Se descarta el frame/chunk: el siguiente llegará enseguida
+            session.rate.record_busy()
+            await session.send(session.reply({
+                "type": "busy",
+                "message": e.detail,
+                "retry_after": e.retry_after,
+                "timestamp": datetime.utcnow().isoformat()
+            }))
+        finally:
+            session.seq = None
+        await session.rate.update()
+    
+    elif message_type == "configure_fusion":
+        # Fusión del lado del servidor con tasa máxima elegida por el cliente
+        try:
+            session.fusion.configure(
+                enabled=data.get("enabled", True),
+                max_rate_hz=data.get("max_rate_hz"),
+                half_life=data.get("half_life")
+            )
+        except ValueError as e:
+            # Configuración inválida: se informa sin cerrar la sesión
+            await session.send({
+                "type": "error",
+                "message": f"configure_fusion: {str(e)}",
+                "timestamp": datetime.utcnow().isoformat()
+            })
+            return
+        session.emit_modality_results = bool(data.get("emit_modality_results", True))
+        await session.send({
+            "type": "fusion_configured",
+            "enabled": session.fusion.enabled,
+            "max_rate_hz": session.fusion.max_rate_hz,
+            "half_life": session.fusion.half_life,
+            "emit_modality_results": session.emit_modality_results,
+            "timestamp": datetime.utcnow().isoformat()
+        })
     
     elif message_type == "ping":
         # Keepalive
-        await manager.send_personal_message({
+        await session.send({
             "type": "pong",
             "timestamp": datetime.utcnow().isoformat()
-        }, websocket)
+        })
 
 
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, session_id: str = None):
     """
     Endpoint principal de WebSocket para análisis en tiempo real
     
     Args:
         websocket: Conexión WebSocket
+        session_id: ID de sesión para los observadores (default: uno nuevo)
     """
     await manager.connect(websocket)
+    connection_id = new_request_id()
+    session = RealtimeSession(websocket, session_id or connection_id)
+    recorder = create_recorder(session.session_id, connection_id)
+    message_count = 0
     
     try:
-        # Enviar mensaje de bienvenida
-        await manager.send_personal_message({
+        # Enviar mensaje de bienvenida (con el ID que usan los observadores)
+        await session.send({
             "type": "connected",
             "message": "Conectado al servicio de análisis en tiempo real",
+            "session_id": session.session_id,
             "timestamp": datetime.utcnow().isoformat()
-        }, websocket)
+        })
+        # Parámetros de envío iniciales; se ajustan con nuevos rate_hint según la carga
+        if session.rate.enabled:
+            await session.rate.send_hint("initial")
         
         # Loop de recepción de mensajes
         while True:
             # Recibir datos
-            data = await websocket.receive_json()
+            text = await websocket.receive_text()
+            if recorder is not None:
+                recorder.record(text)
+            data = orjson.loads(text)
+            
+            # Un request ID por mensaje para correlacionar con los logs de los servicios
+            message_count += 1
+            set_request_id(f"{connection_id}-{message_count}", "realtime")
             
             # Procesar mensaje
-            await handle_websocket_message(websocket, data)
+            await handle_websocket_message(session, data)
     
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -232,3 +345,95 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"Error en WebSocket: {str(e)}")
         manager.disconnect(websocket)
+    
+    finally:
+        session.close()
+        if recorder is not None:
+            recorder.close()
+
+
+async def authenticate_observer(websocket: WebSocket) -> bool:
+    """
+    Comprueba la clave de administración de un observador
+
+    Se acepta en el header X-Admin-Key o, desde un navegador (que no puede
+    fijar headers en un WebSocket), en un primer mensaje
+    {"type": "auth", "key": "..."} enviado antes de OBSERVER_AUTH_TIMEOUT.
+    """
+    if is_admin_key(websocket.headers.get(ADMIN_KEY_HEADER)):
+        return True
+    if not admin_enabled():
+        return False
+    try:
+        data = orjson.loads(await asyncio.wait_for(websocket.receive_text(), OBSERVER_AUTH_TIMEOUT))
+    except (asyncio.TimeoutError, orjson.JSONDecodeError):
+        return False
+    return (
+        isinstance(data, dict)
+        and data.get("type") == "auth"
+        and isinstance(data.get("key"), str)
+        and is_admin_key(data["key"])
+    )
+
+
+async def observer_endpoint(websocket: WebSocket, session_id: str):
+    """
+    WebSocket de observación: recibe en vivo los resultados de una sesión
+
+    Requiere la clave de administración (ver authenticate_observer); si no
+    es válida se cierra con el código 1008 (policy violation).
+    
+    Args:
+        websocket: Conexión WebSocket del observador
+        session_id: Sesión a observar
+    """
+    await websocket.accept()
+    try:
+        authorized = await authenticate_observer(websocket)
+    except WebSocketDisconnect:
+        return
+    if not authorized:
+        logger.warning(f"Observador de la sesión {session_id} rechazado: clave de administración inválida")
+        await websocket.send_text(dumps_text({
+            "type": "error",
+            "message": "Se requiere la clave de administración",
+            "timestamp": datetime.utcnow().isoformat()
+        }))
+        await websocket.close(code=1008)
+        return
+    broker = get_broker()
+    
+    async def send(message: dict):
+        await websocket.send_text(dumps_text(message))
+    
+    await send({
+        "type": "observing",
+        "session_id": session_id,
+        "timestamp": datetime.utcnow().isoformat()
+    })
+    subscriber = await broker.subscribe(session_id, send)
+    logger.info(f"Observador suscrito a la sesión {session_id}")
+    
+    async def receive_loop():
+        while True:
+            data = orjson.loads(await websocket.receive_text())
+            if data.get("type") == "ping":
+                # Por la cola del suscriptor: el socket solo lo usa su tarea de envío
+                subscriber.offer({"type": "pong", "timestamp": datetime.utcnow().isoformat()})
+    
+    receiver = asyncio.create_task(receive_loop())
+    dropped = asyncio.create_task(subscriber.closed.wait())
+    try:
+        # Termina cuando el observador se desconecta o se le descarta por lento
+        await asyncio.wait({receiver, dropped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        too_slow = dropped.done() and not receiver.done()
+        receiver.cancel()
+        dropped.cancel()
+        await broker.unsubscribe(session_id, subscriber)
+        logger.info(f"Observador de la sesión {session_id} desconectado")
+        if too_slow:
+            try:
+                await websocket.close(code=1013)  # Try again later
+            except Exception:
+                pass
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import pipeline
+from fastapi.responses import ORJSONResponse
+import asyncio
 import time
 import sys
 import os
@@ -8,17 +9,40 @@ import os
 # Agregar el directorio padre al path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from shared.schemas import TextAnalysisRequest, TextAnalysisResponse, HealthResponse
-from shared.utils import get_logger
+from shared.schemas import TextAnalysisRequest, TextAnalysisResponse, HealthResponse, canonical_label
+from shared.config import get_settings
+from shared.utils import get_logger, collect_stats, sampled, RequestIdMiddleware
+from shared.database import start_persistence, stop_persistence, record_result
+from shared.serialization import negotiated_response
+from shared.admission import AdmissionMiddleware, get_admission_controller
+from shared.prefork import run_prefork
+from shared.uploads import BodySizeLimitMiddleware, max_body_bytes
+from shared.model_registry import (
+    ModelUnavailable, create_models_router, get_model_registry, health_status,
+    hf_pipeline_loader, model_unavailable_handler
+)
+from shared.startup_profiler import startup_profiler
+from shared.admin import log_admin_status
+from shared.profiling import ProfilingMiddleware, create_profiling_router
+from shared.singleflight import get_singleflight, input_key
 
 logger = get_logger()
+settings = get_settings()
 
 app = FastAPI(
     title="Text Emotion Analysis Service",
     description="Microservicio para análisis de emociones en texto usando BERT",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Control de admisión (concurrencia, cola acotada, prioridades).
+# Se registra antes que CORS para que las respuestas 429/503 lleven sus headers
+app.add_middleware(AdmissionMiddleware, controller=get_admission_controller())
+
+# Rechazo temprano (413) de cuerpos que superan max_file_size_mb
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=max_body_bytes())
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -28,51 +52,86 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Modelos (se cargan al iniciar)
-spanish_classifier = None
-multilingual_classifier = None
+# Perfilado de CPU de los requests con X-Profile (dentro de RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
+# X-Request-ID en logs y respuestas (más externo para cubrir también los rechazos)
+app.add_middleware(RequestIdMiddleware)
+
+# Administración de modelos (/models) y 503 si un modelo no se puede cargar
+app.include_router(create_models_router())
+app.add_exception_handler(ModelUnavailable, model_unavailable_handler)
+
+# Perfilado de CPU bajo demanda (/profile, requiere X-Admin-Key)
+app.include_router(create_profiling_router())
+
+# Un modelo por idioma, cargado con el primer texto en ese idioma
+# (MODEL_PRELOAD=["text-es","text-en"] para cargarlos al iniciar)
+MODEL_BY_LANGUAGE = {"es": "text-es", "en": "text-en"}
+
+models = get_model_registry()
+# Modelo BETO para español
+models.register(
+    "text-es",
+    "finiteautomata/beto-sentiment-analysis",
+    hf_pipeline_loader("text-classification", top_k=None),
+    warmup=lambda classifier: classifier("hola")
+)
+# Modelo de emociones en inglés (alternativo para el resto de idiomas)
+models.register(
+    "text-en",
+    "j-hartmann/emotion-english-distilroberta-base",
+    hf_pipeline_loader("text-classification", top_k=None),
+    warmup=lambda classifier: classifier("hello")
+)
+
+
+# Textos idénticos en curso comparten una sola inferencia
+text_flights = get_singleflight("text")
 
 
 def load_models():
-    global spanish_classifier, multilingual_classifier
-    try:
-        logger.info("Cargando modelos de análisis de texto...")
-        
-        # Modelo BETO para español
-        spanish_classifier = pipeline(
-            "text-classification",
-            model="finiteautomata/beto-sentiment-analysis",
-            top_k=None
-        )
-        
-        # Modelo multilingüe (alternativo)
-        multilingual_classifier = pipeline(
-            "text-classification",
-            model="j-hartmann/emotion-english-distilroberta-base",
-            top_k=None
-        )
-        
-        logger.info("Modelos de texto cargados exitosamente")
-    except Exception as e:
-        logger.error(f"Error al cargar modelos: {str(e)}")
+    """Carga los modelos de arranque (en el padre si hay fork de workers)"""
+    models.preload()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Cargar modelos al iniciar"""
-    load_models()
+    """
+    Cargar en segundo plano los modelos configurados (ya cargados si el worker viene de un fork)
+
+    /health responde "starting" hasta que están listos.
+    """
+    startup_profiler.mark("listening")
+    log_admin_status()
+    models.preload_async()
+    models.start()
+    start_persistence()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Volcar resultados pendientes"""
+    models.stop()
+    stop_persistence()
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    model_status = "loaded" if spanish_classifier and multilingual_classifier else "not_loaded"
+    model_status = ", ".join(f"{name}={models.status(name)}" for name in MODEL_BY_LANGUAGE.values())
     return HealthResponse(
-        status="healthy" if spanish_classifier and multilingual_classifier else "degraded",
+        status=health_status(models),
         service=f"text-analysis (models: {model_status})"
     )
 
 
+@app.get("/stats")
+async def stats():
+    """Métricas internas del servicio"""
+    return collect_stats()
+
+
 def detect_language(text: str) -> str:
     """Detección simple de idioma"""
     spanish_words = {'el', 'la', 'de', 'que', 'y', 'es', 'en', 'un', 'por', 'para', 'con', 'no', 'una', 'su', 'se'}
@@ -91,27 +150,79 @@ def detect_language(text: str) -> str:
         return "en"  # Default a inglés
 
 
-def map_emotion(label: str, score: float) -> tuple[str, dict]:
+def map_emotion(label: str, score: float) -> str:
     """Mapea las etiquetas del modelo a nuestras categorías de emociones"""
-    # Mapeo de sentimientos a emociones
-    emotion_mapping = {
-        'POS': 'happy',
-        'NEG': 'sad',
-        'NEU': 'neutral',
-        'joy': 'happy',
-        'anger': 'angry',
-        'sadness': 'sad',
-        'fear': 'fear',
-        'surprise': 'surprise',
-        'disgust': 'disgust',
-        'neutral': 'neutral'
-    }
+    # POS/NEG/NEU y las etiquetas de DistilRoBERTa se resuelven en el índice canónico
+    return canonical_label(label)
+
+
+def analyze_text_content(text: str, language: str = "auto") -> TextAnalysisResponse:
+    """
+    Ejecuta el análisis de texto
+
+    Usado por el endpoint HTTP y por el gateway de fusión en modo monolito.
+
+    Args:
+        text: Texto a analizar
+        language: Idioma del texto (auto, es, en)
+
+    Returns:
+        Análisis de emociones en texto con confianza
+    """
+    start_time = time.time()
+    
+    # Detectar idioma si es automático
+    if not language or language == "auto":
+        language = detect_language(text)
+    
+    # La vista previa del texto solo se formatea si DEBUG está activo
+    logger.opt(lazy=True).debug("Analizando texto ({}): {}...", lambda: language, lambda: text[:50])
+    
+    # Seleccionar modelo según idioma (se carga aquí si aún no está en memoria)
+    with models.use(MODEL_BY_LANGUAGE.get(language, "text-en")) as classifier:
+        predictions = classifier(text)[0]
+    
+    # Procesar predicciones
+    all_emotions = {}
+    for pred in predictions:
+        label = pred['label']
+        score = pred['score']
+        
+        # Mapear a emoción
+        emotion = map_emotion(label, score)
+        
+        # Acumular si ya existe
+        if emotion in all_emotions:
+            all_emotions[emotion] += score
+        else:
+            all_emotions[emotion] = score
+    
+    # Normalizar si es necesario
+    total = sum(all_emotions.values())
+    if total > 1.0:
+        all_emotions = {k: v / total for k, v in all_emotions.items()}
+    
+    # Emoción dominante
+    dominant_emotion = max(all_emotions, key=all_emotions.get)
+    confidence = all_emotions[dominant_emotion]
+    
+    processing_time = time.time() - start_time
+    
+    if sampled():
+        logger.info("Emoción detectada: {} ({:.2f}, {} caracteres)", dominant_emotion, confidence, len(text))
     
-    return emotion_mapping.get(label.lower(), 'neutral')
+    return TextAnalysisResponse(
+        emotion=dominant_emotion,
+        confidence=confidence,
+        all_emotions=all_emotions,
+        processing_time=processing_time,
+        text_length=len(text),
+        detected_language=language
+    )
 
 
 @app.post("/analyze/text", response_model=TextAnalysisResponse)
-async def analyze_text(request: TextAnalysisRequest):
+async def analyze_text(request: TextAnalysisRequest, http_request: Request):
     """
     Analiza emociones en texto
     
@@ -121,64 +232,17 @@ async def analyze_text(request: TextAnalysisRequest):
     Returns:
         Análisis de emociones en texto con confianza
     """
-    start_time = time.time()
-    
-    if not spanish_classifier or not multilingual_classifier:
-        raise HTTPException(status_code=503, detail="Modelos no disponibles")
-    
     try:
-        text = request.text
-        language = request.language
-        
-        # Detectar idioma si es automático
-        if language == "auto":
-            language = detect_language(text)
-        
-        logger.info(f"Analizando texto ({language}): {text[:50]}...")
-        
-        # Seleccionar modelo según idioma
-        if language == "es":
-            predictions = spanish_classifier(text)[0]
-        else:
-            predictions = multilingual_classifier(text)[0]
-        
-        # Procesar predicciones
-        all_emotions = {}
-        for pred in predictions:
-            label = pred['label']
-            score = pred['score']
-            
-            # Mapear a emoción
-            emotion = map_emotion(label, score)
-            
-            # Acumular si ya existe
-            if emotion in all_emotions:
-                all_emotions[emotion] += score
-            else:
-                all_emotions[emotion] = score
-        
-        # Normalizar si es necesario
-        total = sum(all_emotions.values())
-        if total > 1.0:
-            all_emotions = {k: v / total for k, v in all_emotions.items()}
-        
-        # Emoción dominante
-        dominant_emotion = max(all_emotions, key=all_emotions.get)
-        confidence = all_emotions[dominant_emotion]
-        
-        processing_time = time.time() - start_time
-        
-        logger.info(f"Emoción detectada: {dominant_emotion} ({confidence:.2f})")
-        
-        return TextAnalysisResponse(
-            emotion=dominant_emotion,
-            confidence=confidence,
-            all_emotions=all_emotions,
-            processing_time=processing_time,
-            text_length=len(text),
-            detected_language=language
+        # Textos idénticos en curso (saludos, respuestas predefinidas) comparten una inferencia
+        result = await text_flights.do(
+            input_key(request.text, request.language or "auto"),
+            lambda: asyncio.to_thread(analyze_text_content, request.text, request.language)
         )
+        record_result("text", result)
+        return negotiated_response(http_request, result)
         
+    except (HTTPException, ModelUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error al analizar texto: {str(e)}")
         raise HTTPException(
@@ -186,7 +250,6 @@ async def analyze_text(request: TextAnalysisRequest):
             detail=f"Error al procesar el texto: {str(e)}"
         )
 
-
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8003)
+    # Con WORKERS > 1 los modelos se cargan una vez y se comparten entre workers
+    run_prefork(app, load_models, port=8003, uds=settings.text_service_socket)
@@ -0,0 +1,87 @@
+"""
+Lectura de audio como señal mono float32 a 16 kHz
+
+Camino rápido para el modelo de voz:
+- soundfile lee el PCM directamente en float32 (sin conversiones intermedias)
+- si la frecuencia ya es 16 kHz no se remuestrea
+- si no, remuestreo polifásico con soxr (o scipy.signal.resample_poly)
+- la mezcla a mono es una media en NumPy
+
+librosa solo se usa como último recurso para formatos que libsndfile no lee.
+"""
+import io
+from math import gcd
+from typing import BinaryIO, Tuple, Union
+
+import numpy as np
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.startup_profiler import timed_import
+from shared.utils import get_logger
+
+logger = get_logger()
+
+TARGET_SAMPLE_RATE = 16000
+
+# Formatos que libsndfile decodifica (ver shared.uploads.sniff_format)
+SOUNDFILE_FORMATS = {"wav", "flac", "ogg"}
+
+
+def to_mono(audio: np.ndarray) -> np.ndarray:
+    """Mezcla (frames, canales) a mono; una señal ya mono se devuelve sin copiar"""
+    if audio.ndim == 1:
+        return audio
+    if audio.shape[1] == 1:
+        return audio[:, 0]
+    return audio.mean(axis=1, dtype=np.float32)
+
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Remuestreo polifásico; no hace nada si las frecuencias coinciden"""
+    if orig_sr == target_sr:
+        return audio
+    try:
+        soxr = timed_import("soxr", "voice")
+        return soxr.resample(audio, orig_sr, target_sr, quality="HQ")
+    except ImportError:
+        signal = timed_import("scipy.signal", "voice")
+        factor = gcd(orig_sr, target_sr)
+        resampled = signal.resample_poly(audio, target_sr // factor, orig_sr // factor)
+        return resampled.astype(np.float32, copy=False)
+
+
+def _read(source: Union[str, BinaryIO]) -> Tuple[np.ndarray, int]:
+    sf = timed_import("soundfile", "voice")
+    try:
+        return sf.read(source, dtype="float32", always_2d=False)
+    except (sf.LibsndfileError, RuntimeError) as e:
+        # Formatos sin soporte en libsndfile (mp3 antiguos, mp4...): decodificador genérico
+        logger.debug("soundfile no pudo leer el audio ({}), usando librosa", e)
+        if not isinstance(source, str):
+            source.seek(0)
+        librosa = timed_import("librosa", "voice")
+        return librosa.load(source, sr=None, mono=True, dtype=np.float32)
+
+
+def load_audio(source: Union[str, BinaryIO], target_sr: int = TARGET_SAMPLE_RATE) -> Tuple[np.ndarray, int]:
+    """
+    Lee un archivo de audio como señal mono float32 a target_sr
+
+    Args:
+        source: Ruta o archivo abierto (WAV, FLAC, OGG...)
+        target_sr: Frecuencia de salida
+
+    Returns:
+        (audio, sample_rate)
+    """
+    audio, sample_rate = _read(source)
+    audio = resample(to_mono(audio), sample_rate, target_sr)
+    return np.ascontiguousarray(audio, dtype=np.float32), target_sr
+
+
+def load_audio_bytes(contents: bytes, target_sr: int = TARGET_SAMPLE_RATE) -> Tuple[np.ndarray, int]:
+    """load_audio sobre bytes en memoria (sin archivo temporal)"""
+    return load_audio(io.BytesIO(contents), target_sr)
@@ -0,0 +1,204 @@
+"""
+Pool de decodificadores FFmpeg para audio comprimido (WebM, MP3...)
+
+Un proceso de FFmpeg decodifica un único stream (termina al cerrar su
+entrada), así que el pool mantiene procesos ya arrancados esperando en
+stdin: cada job toma uno listo, le envía los bytes por pipe:0 y lee PCM
+float32 mono a 16 kHz de pipe:1, mientras en segundo plano se arranca su
+reemplazo. El coste de crear el proceso queda fuera del request.
+
+- Todo es asíncrono (asyncio subprocess, o pipes en hilos si el event
+  loop no soporta subprocesos): no bloquea el event loop
+- Cada job tiene su timeout; al vencer se mata el proceso
+- Los procesos que mueren en espera se descartan y se reemplazan
+"""
+import asyncio
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+from shared.utils.ffmpeg import resolve_ffmpeg, spawn_ffmpeg, FFMPEG_MISSING
+
+logger = get_logger()
+
+
+class DecoderError(Exception):
+    """FFmpeg no pudo decodificar el audio (o no está disponible)"""
+
+
+class FFmpegDecoderPool:
+    """Procesos FFmpeg precalentados con envío asíncrono de jobs"""
+
+    def __init__(self, size: int = 2, timeout: float = 10.0, sample_rate: int = 16000):
+        self.size = size
+        self.timeout = timeout
+        self.sample_rate = sample_rate
+
+        self.ffmpeg_path: Optional[str] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._refills = set()
+
+        self.metrics = {
+            "decoded": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "crashed": 0,
+            "spawned": 0,
+            "cold_spawns": 0,
+        }
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "size": self.size,
+            "ffmpeg": self.ffmpeg_path,
+        }
+
+    def _args(self, source: str) -> list:
+        return [
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+            '-i', source,
+            '-f', 'f32le', '-acodec', 'pcm_f32le',
+            '-ac', '1',                     # Mono
+            '-ar', str(self.sample_rate),   # Sample rate 16kHz
+            'pipe:1'
+        ]
+
+    async def _spawn(self, source: str = 'pipe:0') -> asyncio.subprocess.Process:
+        process = await spawn_ffmpeg(self._args(source), stdin_pipe=source == 'pipe:0')
+        self.metrics["spawned"] += 1
+        return process
+
+    async def start(self):
+        """Resuelve FFmpeg y arranca los procesos del pool"""
+        self.ffmpeg_path = resolve_ffmpeg()
+        if self.ffmpeg_path is None:
+            logger.error("FFmpeg no encontrado: no se podrá decodificar audio comprimido")
+            return
+        logger.info("Usando FFmpeg: {} (pool de {} procesos)", self.ffmpeg_path, self.size)
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._schedule_refill()
+
+    async def stop(self):
+        for task in list(self._refills):
+            task.cancel()
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            await self._kill(self._idle.get_nowait())
+        self._idle = None
+
+    def _schedule_refill(self):
+        task = asyncio.create_task(self._refill())
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+
+    async def _refill(self):
+        try:
+            process = await self._spawn()
+        except OSError as e:
+            logger.error(f"No se pudo arrancar FFmpeg: {str(e)}")
+            return
+        if self._idle is None:
+            await self._kill(process)
+            return
+        await self._idle.put(process)
+
+    async def _acquire(self) -> asyncio.subprocess.Process:
+        """Toma un proceso listo (y encarga su reemplazo) o arranca uno en frío"""
+        while not self._idle.empty():
+            process = self._idle.get_nowait()
+            self._schedule_refill()
+            if process.returncode is None:
+                return process
+            self.metrics["crashed"] += 1
+            logger.warning(f"Proceso FFmpeg en espera terminó (código {process.returncode}), reemplazado")
+        # Todos ocupados: no se espera al reemplazo
+        self.metrics["cold_spawns"] += 1
+        return await self._spawn()
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    async def _run(self, process: asyncio.subprocess.Process,
+                   chunks: Optional[AsyncIterator[bytes]]) -> np.ndarray:
+        async def feed():
+            if process.stdin is None:
+                return
+            try:
+                async for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # FFmpeg terminó antes de leerlo todo: el error sale por stderr
+                pass
+            finally:
+                process.stdin.close()
+
+        _, stdout, stderr = await asyncio.gather(feed(), process.stdout.read(), process.stderr.read())
+        returncode = await process.wait()
+        if returncode != 0:
+            raise DecoderError(stderr.decode(errors="replace").strip()[-500:] or f"código {returncode}")
+        return np.frombuffer(stdout, dtype=np.float32)
+
+    async def _decode(self, process_factory, chunks, timeout: Optional[float]) -> np.ndarray:
+        if self.ffmpeg_path is None:
+            raise DecoderError(FFMPEG_MISSING)
+        timeout = timeout or self.timeout
+        process = await process_factory()
+        try:
+            audio = await asyncio.wait_for(self._run(process, chunks), timeout)
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise DecoderError(f"FFmpeg no terminó en {timeout}s")
+        except DecoderError:
+            self.metrics["failed"] += 1
+            raise
+        finally:
+            await self._kill(process)
+        self.metrics["decoded"] += 1
+        return audio
+
+    async def decode(self, chunks: AsyncIterator[bytes], timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Decodifica un stream de audio enviado por bloques
+
+        Args:
+            chunks: Bloques del archivo (p. ej. iter_upload)
+            timeout: Tiempo máximo del job (default: el del pool)
+
+        Returns:
+            Señal mono float32 a sample_rate
+        """
+        return await self._decode(self._acquire, chunks, timeout)
+
+    async def decode_file(self, path: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Decodifica un archivo en disco (contenedores que requieren seek, como MP4)"""
+        return await self._decode(lambda: self._spawn(path), None, timeout)
+
+
+_pool: Optional[FFmpegDecoderPool] = None
+
+
+def get_decoder_pool() -> FFmpegDecoderPool:
+    """Pool compartido del proceso, configurado desde settings"""
+    global _pool
+    if _pool is None:
+        settings = get_settings()
+        _pool = FFmpegDecoderPool(size=settings.ffmpeg_pool_size, timeout=settings.ffmpeg_timeout)
+        register_stats("ffmpeg", _pool.stats)
+    return _pool
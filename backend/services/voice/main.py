@@ -1,32 +1,57 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import pipeline
-import librosa
+from fastapi.responses import ORJSONResponse
+from typing import AsyncIterator
 import numpy as np
-import io
+import asyncio
 import time
 import sys
 import os
-import soundfile as sf
 import tempfile
-from pathlib import Path
-import subprocess
-import shutil
 
 # Agregar el directorio padre al path para imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from shared.schemas import VoiceAnalysisResponse, HealthResponse
-from shared.utils import get_logger
+from shared.schemas import VoiceAnalysisResponse, HealthResponse, SharedPayload, canonical_label
+from shared.config import get_settings
+from shared.utils import get_logger, collect_stats, sampled, RequestIdMiddleware
+from shared.database import start_persistence, stop_persistence, record_result
+from shared.serialization import negotiated_response
+from shared.admission import AdmissionMiddleware, get_admission_controller
+from shared.prefork import run_prefork
+from shared.uploads import (
+    CHUNK_SIZE, BodySizeLimitMiddleware, iter_upload, max_body_bytes, max_video_body_bytes, max_video_bytes,
+    sniff_format
+)
+from shared.model_registry import (
+    ModelUnavailable, create_models_router, get_model_registry, health_status,
+    hf_pipeline_loader, model_unavailable_handler
+)
+from shared.startup_profiler import startup_profiler
+from shared.admin import log_admin_status
+from shared.profiling import ProfilingMiddleware, create_profiling_router
+from shared.transport import BufferReader, open_shared_payload
+from services.voice import audio_io
+from services.voice.ffmpeg_pool import DecoderError, get_decoder_pool
 
 logger = get_logger()
+settings = get_settings()
 
 app = FastAPI(
     title="Voice Emotion Analysis Service",
     description="Microservicio para análisis de emociones en voz usando Wav2Vec2",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Control de admisión (concurrencia, cola acotada, prioridades).
+# Se registra antes que CORS para que las respuestas 429/503 lleven sus headers
+app.add_middleware(AdmissionMiddleware, controller=get_admission_controller())
+
+# Rechazo temprano (413) de cuerpos que superan max_file_size_mb; el límite por
+# archivo lo aplica iter_upload, que admite max_video_size_mb para videos
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=max(max_body_bytes(), max_video_body_bytes()))
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -36,43 +61,235 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Cargar modelo (se carga una vez al iniciar el servicio)
-logger.info("Cargando modelo de reconocimiento de emociones en voz...")
-emotion_classifier = None
+# Perfilado de CPU de los requests con X-Profile (dentro de RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
+# X-Request-ID en logs y respuestas (más externo para cubrir también los rechazos)
+app.add_middleware(RequestIdMiddleware)
+
+# Administración de modelos (/models) y 503 si el modelo no se puede cargar
+app.include_router(create_models_router())
+app.add_exception_handler(ModelUnavailable, model_unavailable_handler)
+
+# Perfilado de CPU bajo demanda (/profile, requiere X-Admin-Key)
+app.include_router(create_profiling_router())
+
+# Modelo pre-entrenado para reconocimiento de emociones en voz (se carga al iniciar)
+models = get_model_registry()
+models.register(
+    "voice",
+    "ehcalabres/wav2vec2-lg-xlsr-en-speech-emotion-recognition",
+    hf_pipeline_loader("audio-classification"),
+    preload=True,
+    warmup=lambda classifier: classifier(np.zeros(16000, dtype=np.float32), sampling_rate=16000)
+)
+
+# Decodificadores FFmpeg precalentados para audio comprimido
+decoder_pool = get_decoder_pool()
+
+# El audio más largo (p. ej. la pista de un video) se clasifica por ventanas:
+# la atención de Wav2Vec2 crece con el cuadrado de la duración
+MAX_WINDOW_SECONDS = 30
+# Una última ventana más corta se une a la anterior (el extractor convolucional
+# de Wav2Vec2 falla con entradas de menos de ~400 muestras)
+MIN_WINDOW_SECONDS = 1
+
+
+def audio_windows(length: int, sample_rate: int) -> list:
+    """
+    Límites (inicio, fin) de las ventanas en que se clasifica un audio largo
+
+    Args:
+        length: Muestras del audio
+        sample_rate: Frecuencia de muestreo
+
+    Returns:
+        Ventanas de MAX_WINDOW_SECONDS; la última se une a la anterior si dura
+        menos de MIN_WINDOW_SECONDS
+    """
+    window = MAX_WINDOW_SECONDS * sample_rate
+    bounds = [(start, min(start + window, length)) for start in range(0, length, window)]
+    if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < MIN_WINDOW_SECONDS * sample_rate:
+        bounds.pop()
+        bounds[-1] = (bounds[-1][0], length)
+    return bounds
 
 
 def load_model():
-    global emotion_classifier
-    try:
-        # Modelo pre-entrenado para reconocimiento de emociones en voz
-        emotion_classifier = pipeline(
-            "audio-classification",
-            model="ehcalabres/wav2vec2-lg-xlsr-en-speech-emotion-recognition"
-        )
-        logger.info("Modelo de voz cargado exitosamente")
-    except Exception as e:
-        logger.error(f"Error al cargar modelo: {str(e)}")
-        emotion_classifier = None
+    """Carga los modelos de arranque (en el padre si hay fork de workers)"""
+    models.preload()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Cargar modelo al iniciar"""
-    load_model()
+    """
+    Cargar el modelo en segundo plano (ya cargado si el worker viene de un fork)
+
+    /health responde "starting" hasta que el modelo está listo.
+    """
+    startup_profiler.mark("listening")
+    log_admin_status()
+    models.preload_async()
+    models.start()
+    await decoder_pool.start()
+    start_persistence()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Volcar resultados pendientes y cerrar los procesos de FFmpeg"""
+    models.stop()
+    await decoder_pool.stop()
+    stop_persistence()
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    model_status = "loaded" if emotion_classifier is not None else "not_loaded"
     return HealthResponse(
-        status="healthy" if emotion_classifier else "degraded",
-        service=f"voice-analysis (model: {model_status})"
+        status=health_status(models),
+        service=f"voice-analysis (model: {models.status('voice')})"
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """Métricas internas del servicio"""
+    return collect_stats()
+
+
+async def _single_chunk(contents: bytes) -> AsyncIterator[bytes]:
+    yield contents
+
+
+async def decode_audio(chunks: AsyncIterator[bytes], timeout: float = None) -> tuple:
+    """
+    Decodifica un archivo de audio como señal mono float32 a 16 kHz
+
+    WAV/FLAC/OGG se leen en memoria con soundfile; los formatos comprimidos
+    (WebM, MP3...) se envían por bloques al pool de FFmpeg, y MP4 (necesita
+    seek) pasa por un archivo temporal.
+
+    Args:
+        chunks: Bloques del archivo (el primero identifica el formato)
+        timeout: Tiempo máximo de FFmpeg (default: FFMPEG_TIMEOUT; la pista de
+            audio de un video usa VIDEO_TIMEOUT)
+
+    Returns:
+        (audio, sample_rate)
+    """
+    first = await chunks.__anext__()
+    audio_format = sniff_format(first, "audio")
+    
+    async def all_chunks():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    
+    try:
+        if audio_format in audio_io.SOUNDFILE_FORMATS:
+            contents = b"".join([chunk async for chunk in all_chunks()])
+            return await asyncio.to_thread(audio_io.load_audio_bytes, contents)
+        
+        if audio_format == "mp4":
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_input:
+                async for chunk in all_chunks():
+                    temp_input.write(chunk)
+            try:
+                audio = await decoder_pool.decode_file(temp_input.name, timeout)
+            finally:
+                os.unlink(temp_input.name)
+        else:
+            audio = await decoder_pool.decode(all_chunks(), timeout)
+    except DecoderError as e:
+        logger.error(f"Error en FFmpeg: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"No se pudo procesar el archivo de audio: {str(e)}"
+        )
+    
+    return audio, decoder_pool.sample_rate
+
+
+async def decode_audio_bytes(contents: bytes, timeout: float = None) -> tuple:
+    """decode_audio sobre los bytes completos (gateway de fusión en modo monolito)"""
+    return await decode_audio(_single_chunk(contents), timeout)
+
+
+async def _buffer_chunks(buffer: memoryview) -> AsyncIterator[memoryview]:
+    for start in range(0, len(buffer), CHUNK_SIZE):
+        yield buffer[start:start + CHUNK_SIZE]
+
+
+async def decode_audio_buffer(buffer: memoryview, timeout: float = None) -> tuple:
+    """decode_audio sobre un segmento de memoria compartida, sin copiarlo"""
+    if sniff_format(buffer[:64], "audio") in audio_io.SOUNDFILE_FORMATS:
+        return await asyncio.to_thread(audio_io.load_audio, BufferReader(buffer))
+    return await decode_audio(_buffer_chunks(buffer), timeout)
+
+
+def analyze_audio_signal(audio: np.ndarray, sample_rate: int,
+                         start_time: float = None) -> VoiceAnalysisResponse:
+    """
+    Ejecuta el análisis de voz sobre una señal ya decodificada
+
+    Args:
+        audio: Señal mono float32
+        sample_rate: Frecuencia de muestreo (16 kHz)
+        start_time: Inicio del request (para processing_time)
+
+    Returns:
+        Análisis de emociones en voz con confianza
+    """
+    start_time = start_time or time.time()
+    duration = len(audio) / sample_rate
+    
+    logger.debug("Audio cargado: {:.2f}s, {}Hz", duration, sample_rate)
+    
+    # Analizar con el modelo (se carga aquí si fue descargado por inactividad)
+    windows = audio_windows(len(audio), sample_rate)
+    with models.use("voice") as emotion_classifier:
+        if len(windows) == 1:
+            predictions = emotion_classifier(audio, sampling_rate=sample_rate)
+        else:
+            segments = [audio[start:end] for start, end in windows]
+            segment_predictions = emotion_classifier(
+                [{"raw": segment, "sampling_rate": sample_rate} for segment in segments]
+            )
+            # Media de las ventanas ponderada por su duración
+            predictions = [
+                {"label": pred["label"], "score": pred["score"] * len(segment) / len(audio)}
+                for segment, preds in zip(segments, segment_predictions)
+                for pred in preds
+            ]
+    
+    # Procesar predicciones (mapeo al índice canónico: calm -> neutral, fearful -> fear, ...)
+    all_emotions = {}
+    for pred in predictions:
+        mapped_emotion = canonical_label(pred['label'])
+        all_emotions[mapped_emotion] = all_emotions.get(mapped_emotion, 0.0) + pred['score']
+    
+    # Emoción dominante
+    dominant_emotion = max(all_emotions, key=all_emotions.get)
+    confidence = all_emotions[dominant_emotion]
+    
+    processing_time = time.time() - start_time
+    
+    if sampled():
+        logger.info("Emoción detectada: {} ({:.2f})", dominant_emotion, confidence)
+    
+    return VoiceAnalysisResponse(
+        emotion=dominant_emotion,
+        confidence=confidence,
+        all_emotions=all_emotions,
+        processing_time=processing_time,
+        audio_duration=duration,
+        sample_rate=sample_rate
     )
 
 
 @app.post("/analyze/voice", response_model=VoiceAnalysisResponse)
-async def analyze_voice(file: UploadFile = File(...)):
+async def analyze_voice(request: Request, file: UploadFile = File(...)):
     """
     Analiza emociones en un archivo de audio
     
@@ -84,146 +301,65 @@ async def analyze_voice(file: UploadFile = File(...)):
     """
     start_time = time.time()
     
-    if emotion_classifier is None:
-        raise HTTPException(status_code=503, detail="Modelo no disponible")
-    
     try:
         # Validar tipo de archivo
-        valid_types = ['audio/', 'video/webm']  # webm puede venir como video/webm
+        # webm puede venir como video/webm; de un video (gateway /analyze/video) se usa la pista de audio
+        valid_types = ['audio/', 'video/']
         if not any(file.content_type.startswith(t) for t in valid_types):
             raise HTTPException(status_code=400, detail="El archivo debe ser un audio válido")
         
-        # Leer audio
-        contents = await file.read()
+        # Decodificar por bloques: límite de tamaño y magic bytes desde el primer
+        # bloque; el audio comprimido va directo al pool de FFmpeg por su stdin
+        # La pista de audio de un video admite el tamaño máximo de video
+        is_video = file.content_type.startswith('video/')
+        max_bytes = max_video_bytes() if is_video else None
+        timeout = settings.video_timeout if is_video else None
+        audio, sample_rate = await decode_audio(iter_upload(file, max_bytes, kind="audio"), timeout)
+        logger.debug("Procesando audio: {}, tipo: {}", file.filename, file.content_type)
         
-        logger.info(f"Procesando audio: {file.filename}, tipo: {file.content_type}")
-        
-        # Para formatos que requieren FFmpeg (webm, mp3, etc), guardar temporalmente
-        temp_file = None
-        try:
-            # Determinar extensión del archivo
-            file_ext = Path(file.filename).suffix if file.filename else '.webm'
-            if not file_ext:
-                file_ext = '.webm' if 'webm' in file.content_type else '.wav'
-            
-            # Crear archivo temporal para el audio de entrada
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_input:
-                temp_input.write(contents)
-                temp_input_path = temp_input.name
-            
-            logger.info(f"Archivo temporal de entrada creado: {temp_input_path}")
-            
-            # Si es WebM, convertir a WAV usando FFmpeg directamente
-            if 'webm' in file.content_type or file_ext == '.webm':
-                # Crear archivo WAV temporal
-                temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-                temp_wav_path = temp_wav.name
-                temp_wav.close()
-                
-                logger.info(f"Convirtiendo WebM a WAV: {temp_wav_path}")
-                
-                # Buscar FFmpeg en el PATH
-                ffmpeg_path = shutil.which('ffmpeg')
-                if not ffmpeg_path:
-                    # Intentar rutas comunes de instalación
-                    possible_paths = [
-                        r'C:\ProgramData\chocolatey\bin\ffmpeg.exe',
-                        r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
-                        r'C:\ffmpeg\bin\ffmpeg.exe',
-                        'ffmpeg'  # Intentar sin ruta como último recurso
-                    ]
-                    for path in possible_paths:
-                        if os.path.exists(path) or path == 'ffmpeg':
-                            ffmpeg_path = path
-                            break
-                
-                logger.info(f"Usando FFmpeg: {ffmpeg_path}")
-                
-                # Convertir con FFmpeg
-                result = subprocess.run([
-                    ffmpeg_path, '-i', temp_input_path,
-                    '-ar', '16000',  # Sample rate 16kHz
-                    '-ac', '1',      # Mono
-                    '-y',            # Sobrescribir
-                    temp_wav_path
-                ], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-                
-                if result.returncode != 0:
-                    logger.error(f"Error en FFmpeg: {result.stderr}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"FFmpeg no está instalado o no se puede ejecutar. Por favor instala FFmpeg: choco install ffmpeg"
-                    )
-                
-                temp_path = temp_wav_path
-            else:
-                temp_path = temp_input_path
-            
-            # Cargar audio con librosa desde el archivo WAV
-            audio, sample_rate = librosa.load(temp_path, sr=16000)
-            duration = len(audio) / sample_rate
-            
-            logger.info(f"Audio cargado: {duration:.2f}s, {sample_rate}Hz")
-            
-        except Exception as e:
-            logger.error(f"Error al cargar audio: {str(e)}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"No se pudo procesar el archivo de audio: {str(e)}"
-            )
-        finally:
-            # Limpiar archivos temporales
-            try:
-                if 'temp_input_path' in locals() and os.path.exists(temp_input_path):
-                    os.unlink(temp_input_path)
-                if 'temp_wav_path' in locals() and os.path.exists(temp_wav_path):
-                    os.unlink(temp_wav_path)
-            except Exception as cleanup_error:
-                logger.warning(f"Error al limpiar archivos temporales: {cleanup_error}")
+        # Inferencia (y recarga del modelo si fue descargado) en un hilo: no bloquea el event loop
+        result = await asyncio.to_thread(analyze_audio_signal, audio, sample_rate, start_time)
+        record_result("voice", result)
+        return negotiated_response(request, result)
         
-        logger.info(f"Audio cargado: {duration:.2f}s, {sample_rate}Hz")
-        
-        # Analizar con el modelo
-        predictions = emotion_classifier(audio, sampling_rate=sample_rate)
-        
-        # Mapeo de emociones del modelo a nuestras categorías
-        emotion_mapping = {
-            'angry': 'angry',
-            'disgust': 'disgust',
-            'fear': 'fear',
-            'happy': 'happy',
-            'neutral': 'neutral',
-            'sad': 'sad',
-            'surprise': 'surprise'
-        }
-        
-        # Procesar predicciones
-        all_emotions = {}
-        for pred in predictions:
-            label = pred['label'].lower()
-            score = pred['score']
-            
-            # Mapear emoción
-            mapped_emotion = emotion_mapping.get(label, label)
-            all_emotions[mapped_emotion] = score
-        
-        # Emoción dominante
-        dominant_emotion = max(all_emotions, key=all_emotions.get)
-        confidence = all_emotions[dominant_emotion]
-        
-        processing_time = time.time() - start_time
-        
-        logger.info(f"Emoción detectada: {dominant_emotion} ({confidence:.2f})")
-        
-        return VoiceAnalysisResponse(
-            emotion=dominant_emotion,
-            confidence=confidence,
-            all_emotions=all_emotions,
-            processing_time=processing_time,
-            audio_duration=duration,
-            sample_rate=sample_rate
+    except (HTTPException, ModelUnavailable):
+        raise
+    except Exception as e:
+        logger.error(f"Error al analizar audio: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al procesar el audio: {str(e)}"
         )
+
+
+@app.post("/analyze/voice/shm", response_model=VoiceAnalysisResponse)
+async def analyze_voice_shared(request: Request, payload: SharedPayload):
+    """
+    Analiza un audio pasado por memoria compartida (gateway en el mismo host)
+    
+    Args:
+        payload: Segmento con el archivo de audio
+    
+    Returns:
+        Análisis de emociones en voz con confianza
+    """
+    start_time = time.time()
+    
+    try:
+        content_type = payload.content_type or ""
+        is_video = content_type.startswith('video/')
+        max_bytes = max_video_bytes() if is_video else None
+        timeout = settings.video_timeout if is_video else None
+        with open_shared_payload(payload, kind="audio", max_bytes=max_bytes) as contents:
+            audio, sample_rate = await decode_audio_buffer(contents, timeout)
+        
+        # Inferencia (y recarga del modelo si fue descargado) en un hilo: no bloquea el event loop
+        result = await asyncio.to_thread(analyze_audio_signal, audio, sample_rate, start_time)
+        record_result("voice", result)
+        return negotiated_response(request, result)
         
+    except (HTTPException, ModelUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error al analizar audio: {str(e)}")
         raise HTTPException(
@@ -233,5 +369,5 @@ async def analyze_voice(file: UploadFile = File(...)):
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    # Con WORKERS > 1 los modelos se cargan una vez y se comparten entre workers
+    run_prefork(app, load_model, port=8002, uds=settings.voice_service_socket)
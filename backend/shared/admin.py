@@ -0,0 +1,54 @@
+"""
+Autenticación de los endpoints de administración
+
+Los endpoints de operación (modelos, perfilado...) exigen el header
+X-Admin-Key con el valor de settings.secret_key. Mientras SECRET_KEY no
+esté configurada (vacía o con el valor por defecto de config.py, que es
+público) se rechaza toda petición de administración con 503.
+"""
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from shared.config import Settings, get_settings
+from shared.utils import get_logger
+
+logger = get_logger()
+
+ADMIN_KEY_HEADER = "X-Admin-Key"
+
+# Valor de ejemplo de SECRET_KEY: no sirve como clave
+DEFAULT_SECRET_KEY = Settings.model_fields["secret_key"].default
+
+
+def admin_enabled() -> bool:
+    """True si hay una SECRET_KEY propia configurada"""
+    secret_key = get_settings().secret_key
+    return bool(secret_key) and secret_key != DEFAULT_SECRET_KEY
+
+
+def is_admin_key(key: Optional[str]) -> bool:
+    """True si key es la clave de administración (siempre False sin SECRET_KEY propia)"""
+    if not key or not admin_enabled():
+        return False
+    return hmac.compare_digest(key.encode(), get_settings().secret_key.encode())
+
+
+def log_admin_status():
+    """Avisa al arrancar si la administración está deshabilitada"""
+    if not admin_enabled():
+        logger.warning(
+            "SECRET_KEY no configurada (o con el valor por defecto): "
+            "los endpoints de administración (/models, /profile...) responden 503"
+        )
+
+
+async def require_admin(x_admin_key: str = Header(None)):
+    """Dependencia FastAPI: 503 sin SECRET_KEY propia, 401 si falta el header, 403 si no coincide"""
+    if not admin_enabled():
+        raise HTTPException(status_code=503, detail="Administración deshabilitada: configura SECRET_KEY")
+    if not x_admin_key:
+        raise HTTPException(status_code=401, detail=f"Falta el header {ADMIN_KEY_HEADER}")
+    if not is_admin_key(x_admin_key):
+        raise HTTPException(status_code=403, detail="Clave de administración inválida")
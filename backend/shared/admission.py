@@ -0,0 +1,220 @@
+"""
+Control de admisión y descarte de carga
+
+Cada servicio limita cuántos análisis ejecuta a la vez y cuántos pueden
+esperar turno. Cuando la cola está llena se responde 429 de inmediato con
+Retry-After; las peticiones cuyo plazo (X-Request-Deadline) ya venció se
+descartan con 503 en lugar de ocupar el modelo. Las peticiones en tiempo
+real (X-Priority: realtime) se atienden antes que las cargas masivas.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi.responses import ORJSONResponse
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+PRIORITY_REALTIME = 0
+PRIORITY_BULK = 1
+
+PRIORITY_HEADER = "X-Priority"
+DEADLINE_HEADER = "X-Request-Deadline"  # Epoch en segundos
+
+PRIORITIES = {"realtime": PRIORITY_REALTIME, "bulk": PRIORITY_BULK}
+
+
+class AdmissionRejected(Exception):
+    """La petición no fue admitida (cola llena, plazo vencido o espera agotada)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Semáforo con cola acotada, prioridades y plazos"""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 retry_after: int = 1):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.active = 0
+        self._waiters = []  # heap de [prioridad, secuencia, future, plazo]
+        self._sequence = itertools.count()
+
+        self.metrics = {
+            "admitted": 0,
+            "rejected_full": 0,
+            "expired": 0,
+            "timed_out": 0,
+            "preempted": 0,
+        }
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    def _reject(self, status_code: int, detail: str, metric: str) -> AdmissionRejected:
+        self.metrics[metric] += 1
+        return AdmissionRejected(status_code, detail, self.retry_after)
+
+    async def acquire(self, priority: int = PRIORITY_BULK, deadline: Optional[float] = None):
+        """Espera turno o lanza AdmissionRejected"""
+        now = time.time()
+        if deadline is not None and deadline <= now:
+            raise self._reject(503, "El plazo de la petición ya venció", "expired")
+
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.metrics["admitted"] += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            # Una petición prioritaria desplaza a la última en espera de menor prioridad
+            worst = max(self._waiters, key=lambda entry: (entry[0], entry[1]))
+            if worst[0] <= priority:
+                raise self._reject(429, "Servicio saturado, reintente más tarde", "rejected_full")
+            self._remove(worst)
+            worst[2].set_exception(self._reject(503, "Desplazada por una petición prioritaria", "preempted"))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future, deadline]
+        heapq.heappush(self._waiters, entry)
+
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - now)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._remove(entry)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # El turno llegó justo al vencer la espera: devolverlo
+                self.release()
+            raise self._reject(503, "Tiempo de espera en cola agotado", "timed_out")
+        except asyncio.CancelledError:
+            # El cliente se fue mientras esperaba
+            self._remove(entry)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+
+        self.metrics["admitted"] += 1
+
+    def release(self):
+        """Libera un turno, cediéndolo al siguiente en espera si lo hay"""
+        while self._waiters:
+            priority, _, future, deadline = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            if deadline is not None and deadline <= time.time():
+                future.set_exception(self._reject(503, "El plazo de la petición ya venció", "expired"))
+                continue
+            # El turno pasa directamente al siguiente (active no cambia)
+            future.set_result(None)
+            return
+        self.active -= 1
+
+    def _remove(self, entry: list):
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def admit(self, priority: int = PRIORITY_BULK, deadline: Optional[float] = None):
+        await self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def parse_priority(value: Optional[str]) -> int:
+    return PRIORITIES.get((value or "").lower(), PRIORITY_BULK)
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def request_headers(priority: str = "bulk", timeout: float = None) -> dict:
+    """Headers de prioridad y plazo para las llamadas del gateway a los servicios"""
+    headers = {PRIORITY_HEADER: priority}
+    if timeout is not None:
+        headers[DEADLINE_HEADER] = f"{time.time() + timeout:.3f}"
+    return headers
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI que aplica el control de admisión a las rutas de análisis"""
+
+    def __init__(self, app, controller: AdmissionController, path_prefix: str = "/analyze"):
+        self.app = app
+        self.controller = controller
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        priority = parse_priority(headers.get(PRIORITY_HEADER.lower().encode(), b"").decode())
+        deadline = parse_deadline(headers.get(DEADLINE_HEADER.lower().encode(), b"").decode())
+
+        try:
+            await self.controller.acquire(priority, deadline)
+        except AdmissionRejected as e:
+            response = ORJSONResponse(
+                {"detail": e.detail},
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller(max_concurrency: int = None) -> AdmissionController:
+    """Controlador compartido del proceso, configurado desde settings"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            max_concurrency=max_concurrency or settings.admission_max_concurrency,
+            max_queue=settings.admission_max_queue,
+            queue_timeout=settings.admission_queue_timeout,
+            retry_after=settings.admission_retry_after,
+        )
+        register_stats("admission", _controller.stats)
+    return _controller
@@ -0,0 +1,12 @@
+from .models import Base, AnalysisResult
+from .writer import ResultWriter, get_result_writer, start_persistence, stop_persistence, record_result
+
+__all__ = [
+    "Base",
+    "AnalysisResult",
+    "ResultWriter",
+    "get_result_writer",
+    "start_persistence",
+    "stop_persistence",
+    "record_result",
+]
@@ -0,0 +1,25 @@
+"""
+Modelos SQLAlchemy
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Integer, JSON, String
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+
+class AnalysisResult(Base):
+    """Resultado de un análisis (una modalidad o la fusión multimodal)"""
+
+    __tablename__ = "analysis_results"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    service = Column(String(32), nullable=False, index=True)
+    session_id = Column(String(64), nullable=True, index=True)
+    emotion = Column(String(32), nullable=False)
+    confidence = Column(Float, nullable=False)
+    all_emotions = Column(JSON, nullable=False)
+    processing_time = Column(Float, nullable=True)
+    details = Column(JSON, nullable=True)
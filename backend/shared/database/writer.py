@@ -0,0 +1,196 @@
+"""
+Persistencia asíncrona (write-behind) de resultados de análisis
+
+Los servicios encolan resultados en una cola en memoria acotada y un hilo
+en segundo plano los inserta por lotes. Encolar nunca bloquea el request:
+si la cola está llena se aplica la política de descarte configurada.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy import create_engine, insert
+
+from shared.config import get_settings
+from shared.database.models import Base, AnalysisResult
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+# Campos que se guardan en columnas propias; el resto va a "details"
+_COLUMNS = {
+    "emotion", "confidence", "all_emotions", "processing_time",
+    "final_emotion", "final_confidence", "total_processing_time", "timestamp",
+}
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+
+class ResultWriter:
+    """Escritor en segundo plano con cola acotada e inserts por lotes"""
+
+    def __init__(self, database_url: str, queue_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0, drop_policy: str = DROP_OLDEST):
+        self.database_url = database_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._engine = None
+
+        self.metrics = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "failed": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Crea las tablas si no existen y arranca el hilo escritor"""
+        if self.running:
+            return
+        self._engine = create_engine(self.database_url, pool_pre_ping=True)
+        Base.metadata.create_all(self._engine)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Persistencia de resultados activa ({self.drop_policy}, lote={self.batch_size})")
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el hilo tras volcar lo que quede en la cola"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._engine.dispose()
+
+    def enqueue(self, service: str, result, session_id: str = None):
+        """
+        Encola un resultado sin bloquear
+
+        Args:
+            service: Servicio que produjo el resultado (facial, voice, text, fusion)
+            result: Modelo Pydantic o dict con el resultado
+            session_id: Sesión WebSocket asociada (opcional)
+        """
+        item = (datetime.utcnow(), service, session_id, result)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.metrics["dropped"] += 1
+            if self.drop_policy != DROP_OLDEST:
+                return
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(item)
+            except (queue.Empty, queue.Full):
+                return
+        self.metrics["enqueued"] += 1
+
+    def stats(self) -> dict:
+        return {**self.metrics, "queue_size": self._queue.qsize(), "running": self.running}
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+        # Vaciar lo pendiente al detener
+        while not self._queue.empty():
+            self._flush(self._collect(block=False))
+
+    def _collect(self, block: bool = True) -> list:
+        """Espera hasta flush_interval o hasta completar un lote"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if block and remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list):
+        start = time.perf_counter()
+        try:
+            rows = [_to_row(*item) for item in batch]
+            with self._engine.begin() as conn:
+                conn.execute(insert(AnalysisResult), rows)
+            self.metrics["written"] += len(rows)
+            self.metrics["batches"] += 1
+        except Exception as e:
+            self.metrics["failed"] += len(batch)
+            logger.error(f"Error al persistir lote de {len(batch)} resultados: {str(e)}")
+        self.metrics["last_flush_ms"] = (time.perf_counter() - start) * 1000
+
+
+def _to_row(created_at: datetime, service: str, session_id: Optional[str], result) -> dict:
+    """Convierte un resultado a fila (se ejecuta en el hilo escritor)"""
+    if isinstance(result, BaseModel):
+        result = result.model_dump(mode="json")
+    return {
+        "created_at": created_at,
+        "service": service,
+        "session_id": session_id,
+        "emotion": result.get("emotion") or result.get("final_emotion"),
+        "confidence": result.get("confidence", result.get("final_confidence", 0.0)),
+        "all_emotions": result.get("all_emotions", {}),
+        "processing_time": result.get("processing_time", result.get("total_processing_time")),
+        "details": {k: v for k, v in result.items() if k not in _COLUMNS} or None,
+    }
+
+
+_writer: Optional[ResultWriter] = None
+
+
+def get_result_writer() -> ResultWriter:
+    """Writer compartido del proceso, configurado desde settings"""
+    global _writer
+    if _writer is None:
+        _writer = ResultWriter(
+            settings.database_url,
+            queue_size=settings.persistence_queue_size,
+            batch_size=settings.persistence_batch_size,
+            flush_interval=settings.persistence_flush_interval,
+            drop_policy=settings.persistence_drop_policy,
+        )
+        register_stats("persistence", _writer.stats)
+    return _writer
+
+
+def start_persistence():
+    """Arranca el writer si la persistencia está habilitada"""
+    if settings.persistence_enabled:
+        try:
+            get_result_writer().start()
+        except Exception as e:
+            logger.error(f"No se pudo iniciar la persistencia: {str(e)}")
+
+
+def stop_persistence():
+    if _writer is not None:
+        _writer.stop()
+
+
+def record_result(service: str, result, session_id: str = None):
+    """Encola un resultado para persistencia (no-op si está deshabilitada)"""
+    if _writer is not None and _writer.running:
+        _writer.enqueue(service, result, session_id)
@@ -0,0 +1,49 @@
+"""
+Representación vectorial de distribuciones de emociones
+
+Cada distribución se representa como un vector float32 de longitud
+len(EMOTION_LABELS), indexado según EMOTION_INDEX.
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+
+from shared.schemas import EMOTION_LABELS, EMOTION_INDEX, canonical_label
+
+N_EMOTIONS = len(EMOTION_LABELS)
+
+
+def to_vector(all_emotions: Dict[str, float], out: np.ndarray = None) -> np.ndarray:
+    """
+    Convierte un dict {emoción: score} a un vector canónico float32
+
+    Las etiquetas se normalizan con canonical_label; los scores de etiquetas
+    que mapean a la misma emoción se acumulan.
+    """
+    vector = np.zeros(N_EMOTIONS, dtype=np.float32) if out is None else out
+    for label, score in all_emotions.items():
+        index = EMOTION_INDEX.get(label)
+        if index is None:
+            index = EMOTION_INDEX[canonical_label(label)]
+        vector[index] += score
+    return vector
+
+
+def to_matrix(distributions: Iterable[Dict[str, float]]) -> np.ndarray:
+    """Convierte varias distribuciones a una matriz (N, N_EMOTIONS)"""
+    distributions = list(distributions)
+    matrix = np.zeros((len(distributions), N_EMOTIONS), dtype=np.float32)
+    for row, all_emotions in zip(matrix, distributions):
+        to_vector(all_emotions, out=row)
+    return matrix
+
+
+def from_vector(vector: np.ndarray) -> Dict[str, float]:
+    """Convierte un vector canónico a dict {emoción: score}"""
+    return dict(zip(EMOTION_LABELS, vector.tolist()))
+
+
+def dominant(vector: np.ndarray) -> tuple:
+    """Devuelve (emoción dominante, score) de un vector canónico"""
+    index = int(np.argmax(vector))
+    return EMOTION_LABELS[index], float(vector[index])
@@ -0,0 +1,397 @@
+"""
+Registro de modelos con carga bajo demanda y descarga por inactividad
+
+Cada servicio registra sus modelos (id, backend, versión y función de
+carga) en lugar de cargarlos al importar. Un modelo se carga desde
+model_cache_dir la primera vez que se usa; el registro lleva la cuenta de
+su memoria y de su último uso, descarga los menos usados cuando se supera
+model_memory_budget_mb y los que llevan más de model_idle_ttl segundos sin
+usarse. reload() carga otra versión y la intercambia sin reiniciar: los
+requests en curso terminan con la versión anterior.
+
+Los tiempos de import, carga y warmup quedan en el perfil de arranque
+(shared.startup_profiler).
+
+Uso:
+    models = get_model_registry()
+    models.register("facial", "dima806/facial_emotions_image_detection",
+                    hf_pipeline_loader("image-classification"), preload=True)
+
+    with models.use("facial") as classifier:
+        predictions = classifier(image)
+"""
+import asyncio
+import gc
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+
+from shared.admin import require_admin
+from shared.config import get_settings
+from shared.startup_profiler import startup_profiler, timed_import
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+NOT_LOADED = "not_loaded"
+LOADED = "loaded"
+ERROR = "error"
+
+
+class ModelUnavailable(Exception):
+    """El modelo no está registrado o no se pudo cargar"""
+
+
+def estimate_memory_mb(model: Any) -> float:
+    """Memoria de parámetros y buffers (torch) del modelo o de un pipeline de transformers"""
+    module = getattr(model, "model", model)
+    try:
+        tensors = itertools.chain(module.parameters(), module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors) / (1024 * 1024)
+    except (AttributeError, TypeError):
+        return 0.0
+
+
+def hf_pipeline_loader(task: str, **kwargs) -> Callable[[str, Optional[str]], Any]:
+    """
+    Función de carga para pipelines de transformers
+
+    La versión es la revisión del repositorio (rama, tag o commit); los
+    pesos se descargan y cachean en model_cache_dir.
+    """
+    def load(model_id: str, version: Optional[str] = None):
+        # transformers (y torch) solo se importan en el camino de carga de modelos
+        pipeline = timed_import("transformers").pipeline
+        return pipeline(
+            task,
+            model=model_id,
+            revision=version,
+            model_kwargs={"cache_dir": settings.model_cache_dir},
+            **kwargs
+        )
+    return load
+
+
+class ModelEntry:
+    """Un modelo registrado y su estado"""
+
+    def __init__(self, name: str, model_id: str, loader: Callable, backend: str,
+                 version: Optional[str], preload: bool, warmup: Optional[Callable] = None):
+        self.name = name
+        self.model_id = model_id
+        self.loader = loader
+        self.warmup = warmup
+        self.backend = backend
+        self.version = version
+        self.preload = preload
+
+        self.model = None
+        self.loaded_version: Optional[str] = None
+        self.memory_mb = 0.0
+        self.last_memory_mb = 0.0  # Estimación para hacer sitio antes de recargar
+        self.loaded_at = 0.0
+        self.last_used = 0.0
+        self.in_use = 0
+        self.loads = 0
+        self.evictions = 0
+        self.last_error: Optional[str] = None
+        self.load_lock = threading.Lock()
+
+    @property
+    def status(self) -> str:
+        if self.model is not None:
+            return LOADED
+        return ERROR if self.last_error else NOT_LOADED
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "model_id": self.model_id,
+            "backend": self.backend,
+            "version": self.loaded_version or self.version,
+            "status": self.status,
+            "memory_mb": round(self.memory_mb, 1),
+            "idle_seconds": round(now - self.last_used, 1) if self.model is not None else None,
+            "in_use": self.in_use,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "error": self.last_error,
+        }
+
+
+class ModelRegistry:
+    """Modelos del proceso con carga perezosa, presupuesto de memoria y TTL de inactividad"""
+
+    def __init__(self, memory_budget_mb: float = 0, idle_ttl: float = 0):
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_ttl = idle_ttl
+
+        self._entries: Dict[str, ModelEntry] = {}
+        self._lock = threading.RLock()
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.ready = threading.Event()  # Modelos de arranque cargados
+
+    def register(self, name: str, model_id: str, loader: Callable[[str, Optional[str]], Any],
+                 backend: str = "transformers", version: Optional[str] = None,
+                 preload: bool = False, warmup: Optional[Callable[[Any], None]] = None):
+        """
+        Registra un modelo (no lo carga)
+
+        Args:
+            name: Id del modelo dentro del servicio
+            model_id: Identificador para el loader (p. ej. repositorio de Hugging Face)
+            loader: Función (model_id, version) -> modelo
+            backend: Backend de inferencia (informativo)
+            version: Versión inicial (None: la por defecto)
+            preload: Cargar en preload() (arranque o proceso padre antes del fork)
+            warmup: Inferencia de prueba tras cargar (model_warmup), para no pagar
+                la primera inicialización en un request
+        """
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = ModelEntry(name, model_id, loader, backend, version, preload, warmup)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def _entry(self, name: str) -> ModelEntry:
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ModelUnavailable(f"Modelo no registrado: {name}")
+        return entry
+
+    def status(self, name: str) -> str:
+        return self._entry(name).status
+
+    def healthy(self) -> bool:
+        """False si algún modelo falló al cargar (los no cargados aún no cuentan)"""
+        return all(entry.status != ERROR for entry in self._entries.values())
+
+    def _load(self, entry: ModelEntry, version: Optional[str]):
+        """Carga una versión del modelo sin tocar la que está en uso"""
+        self._make_room(entry.last_memory_mb, keep=entry)
+        logger.info("Cargando modelo {} ({}, versión {})...", entry.name, entry.model_id, version or "default")
+        start = time.perf_counter()
+        try:
+            with startup_profiler.phase(entry.name, "model_load"):
+                model = entry.loader(entry.model_id, version)
+        except Exception as e:
+            entry.last_error = str(e)
+            logger.error(f"Error al cargar modelo {entry.name}: {str(e)}")
+            raise ModelUnavailable(f"No se pudo cargar el modelo {entry.name}") from e
+
+        memory_mb = estimate_memory_mb(model)
+        logger.info("Modelo {} cargado en {:.1f}s ({:.0f} MB)", entry.name, time.perf_counter() - start, memory_mb)
+
+        if entry.warmup is not None and settings.model_warmup:
+            try:
+                with startup_profiler.phase(entry.name, "warmup"):
+                    entry.warmup(model)
+            except Exception as e:
+                logger.warning(f"Warmup de {entry.name} fallido: {str(e)}")
+        return model, memory_mb
+
+    def _install(self, entry: ModelEntry, model: Any, version: Optional[str], memory_mb: float):
+        with self._lock:
+            entry.model = model
+            entry.loaded_version = version
+            entry.version = version
+            entry.memory_mb = memory_mb
+            entry.last_memory_mb = memory_mb
+            entry.loaded_at = entry.last_used = time.monotonic()
+            entry.loads += 1
+            entry.last_error = None
+        self._make_room(0, keep=entry)
+
+    def get(self, name: str) -> Any:
+        """Devuelve el modelo, cargándolo si hace falta"""
+        entry = self._entry(name)
+        model = entry.model
+        if model is None:
+            # Un solo hilo carga; el resto espera y reutiliza el resultado
+            with entry.load_lock:
+                model = entry.model
+                if model is None:
+                    model, memory_mb = self._load(entry, entry.version)
+                    self._install(entry, model, entry.version, memory_mb)
+        entry.last_used = time.monotonic()
+        return model
+
+    @contextmanager
+    def use(self, name: str):
+        """Presta el modelo durante la inferencia: no se descarga mientras esté en uso"""
+        entry = self._entry(name)
+        with self._lock:
+            entry.in_use += 1
+        try:
+            yield self.get(name)
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def preload(self):
+        """Carga los modelos marcados con preload (los fallos quedan en el estado del modelo)"""
+        for entry in list(self._entries.values()):
+            if entry.preload or entry.name in settings.model_preload:
+                try:
+                    self.get(entry.name)
+                except ModelUnavailable:
+                    pass
+        self.ready.set()
+        startup_profiler.mark_ready()
+
+    def preload_async(self):
+        """
+        preload() en un hilo: el servidor acepta conexiones (/health) mientras carga
+
+        Si el worker viene de un fork los modelos ya están cargados y no se hace nada.
+        """
+        if self.ready.is_set():
+            startup_profiler.mark_ready()
+            return
+        threading.Thread(target=self.preload, name="model-preload", daemon=True).start()
+
+    def reload(self, name: str, version: Optional[str] = None):
+        """
+        Carga otra versión del modelo y la intercambia en caliente
+
+        La versión nueva se carga junto a la actual; si falla, la actual sigue en servicio.
+        """
+        entry = self._entry(name)
+        version = version if version is not None else entry.version
+        with entry.load_lock:
+            model, memory_mb = self._load(entry, version)
+            previous = entry.loaded_version
+            self._install(entry, model, version, memory_mb)
+        logger.info("Modelo {} actualizado: {} -> {}", name, previous or "default", version or "default")
+        gc.collect()
+
+    def evict(self, name: str) -> bool:
+        """Descarga el modelo si no está en uso; se volverá a cargar en el próximo uso"""
+        entry = self._entry(name)
+        with self._lock:
+            if entry.model is None or entry.in_use:
+                return False
+            entry.model = None
+            entry.memory_mb = 0.0
+            entry.evictions += 1
+        logger.info("Modelo {} descargado", name)
+        gc.collect()
+        return True
+
+    def _make_room(self, needed_mb: float, keep: ModelEntry = None):
+        """Descarga los modelos usados hace más tiempo hasta que needed_mb quepa en el presupuesto"""
+        if not self.memory_budget_mb:
+            return
+        while True:
+            with self._lock:
+                used = sum(entry.memory_mb for entry in self._entries.values())
+                if used + needed_mb <= self.memory_budget_mb:
+                    return
+                candidates = [
+                    entry for entry in self._entries.values()
+                    if entry is not keep and entry.model is not None and not entry.in_use
+                ]
+                if not candidates:
+                    return
+                victim = min(candidates, key=lambda entry: entry.last_used)
+            logger.info("Presupuesto de memoria superado ({:.0f}/{} MB)", used + needed_mb, self.memory_budget_mb)
+            self.evict(victim.name)
+
+    def evict_idle(self):
+        """Descarga los modelos sin uso durante más de idle_ttl segundos"""
+        if not self.idle_ttl:
+            return
+        now = time.monotonic()
+        for entry in list(self._entries.values()):
+            if entry.model is not None and not entry.in_use and now - entry.last_used > self.idle_ttl:
+                self.evict(entry.name)
+
+    def _reap(self):
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while not self._stop.wait(interval):
+            self.evict_idle()
+
+    def start(self):
+        """Arranca el hilo de descarga por inactividad (en cada worker, tras el fork)"""
+        if not self.idle_ttl or (self._reaper is not None and self._reaper.is_alive()):
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap, name="model-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "memory_mb": round(sum(entry.memory_mb for entry in self._entries.values()), 1),
+            "memory_budget_mb": self.memory_budget_mb,
+            "idle_ttl": self.idle_ttl,
+            "models": {name: entry.stats() for name, entry in self._entries.items()},
+        }
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """Registro compartido del proceso (en modo monolito lo comparten los tres servicios)"""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry(
+            memory_budget_mb=settings.model_memory_budget_mb,
+            idle_ttl=settings.model_idle_ttl,
+        )
+        register_stats("models", _registry.stats)
+    return _registry
+
+
+def health_status(registry: ModelRegistry) -> str:
+    """Estado para /health: "starting" mientras se cargan los modelos de arranque"""
+    if not registry.ready.is_set():
+        return "starting"
+    return "healthy" if registry.healthy() else "degraded"
+
+
+async def model_unavailable_handler(request: Request, exc: ModelUnavailable):
+    """Exception handler: un modelo que no se puede cargar responde 503"""
+    return ORJSONResponse({"detail": str(exc)}, status_code=503)
+
+
+def create_models_router() -> APIRouter:
+    """Endpoints de administración de modelos (requieren X-Admin-Key)"""
+    router = APIRouter(prefix="/models", tags=["models"], dependencies=[Depends(require_admin)])
+
+    @router.get("")
+    async def list_models():
+        return get_model_registry().stats()
+
+    @router.post("/{name}/reload")
+    async def reload_model(name: str, version: Optional[str] = None):
+        registry = get_model_registry()
+        try:
+            # La carga es bloqueante: se hace en un hilo mientras se sigue sirviendo
+            await asyncio.to_thread(registry.reload, name, version)
+        except ModelUnavailable as e:
+            raise HTTPException(status_code=500 if name in registry else 404, detail=str(e))
+        return registry.stats()["models"][name]
+
+    @router.post("/{name}/evict")
+    async def evict_model(name: str):
+        registry = get_model_registry()
+        try:
+            evicted = registry.evict(name)
+        except ModelUnavailable as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {"evicted": evicted, **registry.stats()["models"][name]}
+
+    return router
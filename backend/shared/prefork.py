@@ -0,0 +1,196 @@
+"""
+Servidor preload-then-fork
+
+Carga los modelos una sola vez en el proceso padre y después hace fork de
+N workers uvicorn que comparten el socket de escucha. Las páginas de los
+pesos se comparten copy-on-write entre los workers: cada uno solo paga en
+memoria lo que modifica. gc.freeze() evita que el recolector toque (y por
+tanto copie) los objetos creados antes del fork.
+
+Uso (desde el directorio del servicio):
+    python main.py            # WORKERS=1: un solo proceso
+    WORKERS=4 python main.py  # padre con modelos + 4 workers
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable
+
+import uvicorn
+
+from shared.config import get_settings
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+# Un worker que muere antes de estos segundos se recrea tras esperarlos
+RESPAWN_MIN_UPTIME = 1.0
+
+
+def memory_usage() -> dict:
+    """
+    Memoria del proceso actual en MB
+
+    uss: memoria privada (lo que se liberaría si el proceso terminara)
+    pss: memoria proporcional (las páginas compartidas se reparten entre procesos)
+    rss: memoria residente total (cuenta las páginas compartidas en cada proceso)
+    """
+    usage = {"pid": os.getpid()}
+    try:
+        with open(f"/proc/{os.getpid()}/smaps_rollup") as f:
+            fields = dict(
+                line.split(":", 1) for line in f
+                if line.rstrip().endswith("kB")
+            )
+    except OSError:
+        return usage
+
+    def mb(*keys):
+        return round(sum(int(fields.get(k, "0 kB").split()[0]) for k in keys) / 1024, 1)
+
+    usage.update({
+        "uss_mb": mb("Private_Clean", "Private_Dirty"),
+        "pss_mb": mb("Pss"),
+        "rss_mb": mb("Rss"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+    })
+    return usage
+
+
+register_stats("memory", memory_usage)
+
+
+def _limit_threads(workers: int):
+    """Reparte los hilos de inferencia entre workers para no sobresuscribir la CPU"""
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except ImportError:
+        pass
+
+
+def _bind_unix(path: str) -> socket.socket:
+    """Socket Unix de escucha (se reemplaza el archivo que dejara una ejecución anterior)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o660)
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_prefork(app, preload: Callable[[], None], port: int, host: str = "0.0.0.0",
+                workers: int = None, uds: str = None):
+    """
+    Carga los modelos y sirve la app con N workers creados por fork
+
+    Args:
+        app: Aplicación FastAPI
+        preload: Función que carga los modelos en el proceso padre
+        port: Puerto de escucha
+        host: Interfaz de escucha
+        workers: Número de workers (default: settings.workers)
+        uds: Socket Unix en el que escuchar además de TCP (servicios en el mismo host)
+    """
+    workers = workers or settings.workers
+    if workers <= 1 or not hasattr(os, "fork"):
+        if not uds:
+            uvicorn.run(app, host=host, port=port)
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        logger.info("Escuchando en {}:{} y en {}", host, port, uds)
+        try:
+            uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock, _bind_unix(uds)])
+        finally:
+            if os.path.exists(uds):
+                os.unlink(uds)
+        return
+
+    logger.info("Precargando modelos en el proceso padre (pid {})...", os.getpid())
+    preload()
+
+    # Todo lo creado hasta aquí queda fuera del GC: no se tocan sus páginas tras el fork
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    sockets = [sock]
+    if uds:
+        sockets.append(_bind_unix(uds))
+
+    def spawn(index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            # Los workers recreados heredarían el manejador del padre
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            _limit_threads(workers)
+            config = uvicorn.Config(app, log_config=None)
+            server = uvicorn.Server(config)
+            logger.info("Worker {} iniciado (pid {})", index, os.getpid())
+            server.run(sockets=sockets)
+            os._exit(0)
+        return pid
+
+    # pid -> (índice del worker, instante de arranque)
+    children = {}
+    for index in range(workers):
+        children[spawn(index)] = (index, time.monotonic())
+
+    logger.info("{} workers sirviendo en {}:{}{}", workers, host, port, f" y en {uds}" if uds else "")
+
+    stopping = False
+
+    def terminate(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in list(children):
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    # Un worker que muere (OOM, segfault en una librería nativa...) se reemplaza
+    # por otro creado desde el padre, que sigue teniendo los modelos cargados
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        logger.warning(
+            "Worker {} (pid {}) terminó inesperadamente (código {}); se reemplaza",
+            index, pid, os.waitstatus_to_exitcode(status),
+        )
+        if time.monotonic() - started < RESPAWN_MIN_UPTIME:
+            # Un worker que cae nada más arrancar no se recrea en bucle cerrado
+            time.sleep(RESPAWN_MIN_UPTIME)
+        if not stopping:
+            children[spawn(index)] = (index, time.monotonic())
+
+    for listener in sockets:
+        listener.close()
+    if uds and os.path.exists(uds):
+        # Sin socket el gateway vuelve a TCP
+        os.unlink(uds)
+    sys.exit(0)
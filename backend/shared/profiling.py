@@ -0,0 +1,412 @@
+"""
+Perfilado de CPU bajo demanda de un servicio en marcha
+
+Un hilo muestrea cada profiling_interval_ms las pilas de todos los hilos
+del proceso (sys._current_frames) y cuenta cuántas veces aparece cada pila
+completa (formato "collapsed", listo para flamegraph.pl o speedscope) y
+cada función como hoja (tiempo propio). Las muestras de hilos en espera
+(event loop de asyncio o uvloop sin eventos, workers de to_thread sin
+tarea, colas vacías) y las del escritor de loguru se descartan, así que
+solo cuenta el tiempo de CPU de Python.
+
+El hilo solo existe mientras hay algo que perfilar: sin perfilado activo
+el único coste es que ProfilingMiddleware mire dos headers por request.
+
+Dos modos (endpoints con X-Admin-Key):
+- Sesión: POST /profile?seconds=10 o ?requests=50 perfila el proceso
+  durante N segundos o hasta completar N requests a /analyze y devuelve
+  el resultado
+- Request: un request con "X-Profile: 1" y X-Admin-Key se perfila de
+  principio a fin (decodificación, inferencia en su hilo y serialización
+  en una misma traza) y el resultado se guarda con su X-Request-ID en
+  profiling_dir, para GET /profile/requests/{request_id}. El gateway
+  propaga el perfilado a los servicios que llama, que guardan el suyo
+  con el mismo request ID: no les reenvía la clave, sino un token
+  HMAC del request ID (X-Profile) que cada servicio comprueba con su
+  propia SECRET_KEY
+
+Las muestras son del proceso entero: si hay otros requests en curso a la
+vez, sus pilas también aparecen (conviene perfilar una réplica con poco
+tráfico). Con WORKERS>1 cada worker tiene su propio perfilador y una
+sesión perfila solo al worker que recibió el POST.
+"""
+import asyncio
+import hashlib
+import hmac
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from shared.admin import ADMIN_KEY_HEADER, admin_enabled, is_admin_key, require_admin
+from shared.config import get_settings
+from shared.utils import get_logger, get_request_id, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+PROFILE_HEADER = "X-Profile"
+
+# Hojas de pila (final de la ruta del módulo, función) de un hilo que está
+# esperando, no ejecutando Python
+IDLE_LEAVES = {
+    ("/selectors.py", "select"),                # Event loop de asyncio sin eventos
+    ("/asyncio/runners.py", "run"),             # uvloop: el loop en C no tiene frames Python
+    ("/uvloop/__init__.py", "run"),
+    ("/threading.py", "wait"),
+    ("/threading.py", "_wait_for_tstate_lock"),
+    ("/queue.py", "get"),
+    ("/concurrent/futures/thread.py", "_worker"),   # Worker de to_thread esperando tarea
+    ("/socket.py", "accept"),
+}
+
+# Hilos que no se muestrean (por prefijo de nombre): el escritor de loguru con
+# LOG_ENQUEUE=True pasa casi todo el tiempo esperando en su pipe
+IGNORED_THREADS = ("loguru-writer", "sampling-profiler")
+
+# Caracteres permitidos del request ID en el nombre del archivo del perfil
+UNSAFE_ID_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+# Prefijo que se quita de las rutas en las etiquetas de las pilas
+MODULE_PREFIX = re.compile(r"^.*/(?:site-packages|dist-packages|lib/python3\.\d+|backend)/")
+
+profiled_request_var: ContextVar[bool] = ContextVar("profiled_request", default=False)
+
+Stack = Tuple[str, ...]
+
+
+def _short_path(filename: str) -> str:
+    """Ruta del módulo sin el prefijo de site-packages, de la stdlib o del proyecto"""
+    return MODULE_PREFIX.sub("", filename)
+
+
+class Profile:
+    """Muestras acumuladas de un perfilado (sesión o request)"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.requests = 0
+
+    def add(self, stacks: List[Stack]):
+        self.samples += 1
+        self.stacks.update(stacks)
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def collapsed(self) -> str:
+        """Una línea "raíz;...;hoja N" por pila, de más a menos frecuente"""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 25) -> List[dict]:
+        """Funciones con más tiempo propio (como hoja), con su tiempo total (en la pila)"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                total[frame] += count
+        stack_samples = sum(self.stacks.values()) or 1
+        return [
+            {
+                "function": frame,
+                "self_samples": count,
+                "self_pct": round(100 * count / stack_samples, 1),
+                "total_pct": round(100 * total[frame] / stack_samples, 1),
+            }
+            for frame, count in own.most_common(limit)
+        ]
+
+    def result(self, top: int = 25) -> dict:
+        return {
+            "kind": self.kind,
+            "duration_s": round(self.duration, 3),
+            "interval_ms": settings.profiling_interval_ms,
+            "samples": self.samples,
+            "stack_samples": sum(self.stacks.values()),
+            "requests": self.requests,
+            "top": self.top(top),
+            "collapsed": self.collapsed(),
+        }
+
+
+class SamplingProfiler:
+    """
+    Muestreador de pilas compartido por los perfilados activos
+
+    Cada muestra se reparte a todos los Profile registrados; el hilo se
+    inicia con el primero y termina al quitar el último.
+    """
+
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self._profiles: List[Profile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # Por id(code): los objetos code iguales de módulos distintos comparan
+        # como iguales; se guarda el code para que su id no se reutilice
+        self._codes: Dict[int, Tuple[object, str, bool]] = {}
+        self.session: Optional[Profile] = None
+        self._session_requests = 0
+        self._session_done: Optional[asyncio.Event] = None
+        self.metrics = {"sessions": 0, "request_profiles": 0, "samples": 0}
+
+    @property
+    def active(self) -> bool:
+        return bool(self._profiles)
+
+    def attach(self, profile: Profile):
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def detach(self, profile: Profile):
+        profile.finished = time.perf_counter()
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _code_info(self, code) -> Tuple[object, str, bool]:
+        info = self._codes.get(id(code))
+        if info is None:
+            filename = code.co_filename.replace("\\", "/")
+            label = f"{code.co_name} ({_short_path(filename)}:{code.co_firstlineno})"
+            idle = any(filename.endswith(suffix) and code.co_name == name for suffix, name in IDLE_LEAVES)
+            info = (code, label, idle)
+            self._codes[id(code)] = info
+        return info
+
+    def _label(self, code) -> str:
+        return self._code_info(code)[1]
+
+    def _is_idle(self, code) -> bool:
+        """True si un hilo con esta hoja de pila está esperando"""
+        return self._code_info(code)[2]
+
+    def _sample(self) -> List[Stack]:
+        ignored = {
+            thread.ident for thread in threading.enumerate()
+            if thread.name.startswith(IGNORED_THREADS)
+        }
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident in ignored or self._is_idle(frame.f_code):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            stacks.append(tuple(stack))
+        return stacks
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            stacks = self._sample()
+            for profile in profiles:
+                profile.add(stacks)
+            self.metrics["samples"] += 1
+            time.sleep(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    async def run_session(self, seconds: float, requests: int = 0) -> Profile:
+        """
+        Perfila el proceso durante `seconds` o hasta completar `requests` requests
+
+        Raises:
+            HTTPException 409 si ya hay una sesión en curso
+        """
+        if self.session is not None:
+            raise HTTPException(status_code=409, detail="Ya hay una sesión de perfilado en curso")
+        profile = Profile("session")
+        self.session = profile
+        self._session_requests = requests
+        self._session_done = asyncio.Event()
+        self.metrics["sessions"] += 1
+        self.attach(profile)
+        try:
+            await asyncio.wait_for(self._session_done.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.detach(profile)
+            self.session = None
+            self._session_done = None
+        return profile
+
+    def request_finished(self):
+        """Cuenta un request completado para la sesión en curso (si la hay)"""
+        profile = self.session
+        if profile is None:
+            return
+        profile.requests += 1
+        if self._session_requests and profile.requests >= self._session_requests:
+            self._session_done.set()
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "active": len(self._profiles),
+            "session": self.session is not None,
+        }
+
+
+_profiler: Optional[SamplingProfiler] = None
+
+
+def get_profiler() -> SamplingProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(settings.profiling_interval_ms)
+        register_stats("profiler", _profiler.stats)
+    return _profiler
+
+
+def profile_token(request_id: str) -> str:
+    """Autoriza el perfilado de un único request sin revelar la clave (HMAC del request ID)"""
+    message = f"profile:{request_id}".encode()
+    return hmac.new(get_settings().secret_key.encode(), message, hashlib.sha256).hexdigest()
+
+
+def is_profile_authorized(value: str, admin_key: str, request_id: str) -> bool:
+    """X-Profile con la clave de administración, o con el token del request (propagado)"""
+    if not admin_enabled():
+        return False
+    if is_admin_key(admin_key):
+        return True
+    return hmac.compare_digest(value.encode(), profile_token(request_id).encode())
+
+
+def profile_headers() -> dict:
+    """Headers para que el servicio llamado perfile también su parte del request actual"""
+    if not profiled_request_var.get():
+        return {}
+    return {PROFILE_HEADER: profile_token(get_request_id())}
+
+
+def _profile_path(request_id: str) -> Path:
+    return Path(settings.profiling_dir) / f"{UNSAFE_ID_CHARS.sub('_', request_id)[:128]}.json"
+
+
+def _store_request_profile(request_id: str, path: str, result: dict):
+    """Guarda el perfil de un request y borra los más antiguos por encima de profiling_max_stored"""
+    directory = Path(settings.profiling_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    _profile_path(request_id).write_bytes(orjson.dumps({"request_id": request_id, "path": path, **result}))
+    stored = sorted(directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in stored[:max(0, len(stored) - settings.profiling_max_stored)]:
+        old.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI: perfila los requests marcados con X-Profile y cuenta
+    los requests de /analyze para las sesiones por número de requests
+
+    Se registra dentro de RequestIdMiddleware, que fija el request ID.
+    """
+
+    def __init__(self, app, path_prefix: str = "/analyze"):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.profiler = get_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile" and value not in (b"", b"0"):
+                headers = dict(scope["headers"])
+                admin_key = headers.get(ADMIN_KEY_HEADER.lower().encode(), b"")
+                if is_profile_authorized(
+                    value.decode(errors="replace"), admin_key.decode(errors="replace"), get_request_id()
+                ):
+                    profile = Profile("request")
+                    profile.requests = 1
+                break
+
+        if profile is None:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if scope["path"].startswith(self.path_prefix):
+                    self.profiler.request_finished()
+            return
+
+        request_id = get_request_id()
+        token = profiled_request_var.set(True)
+        self.profiler.metrics["request_profiles"] += 1
+        self.profiler.attach(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.detach(profile)
+            profiled_request_var.reset(token)
+            if scope["path"].startswith(self.path_prefix):
+                self.profiler.request_finished()
+            try:
+                await asyncio.to_thread(_store_request_profile, request_id, scope["path"], profile.result())
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el perfil del request {request_id}: {e}")
+
+
+def _respond(result: dict, format: str):
+    if format == "collapsed":
+        return PlainTextResponse(result["collapsed"] + "\n")
+    return result
+
+
+def create_profiling_router() -> APIRouter:
+    """Endpoints de perfilado de CPU (requieren X-Admin-Key)"""
+    router = APIRouter(prefix="/profile", tags=["profiling"], dependencies=[Depends(require_admin)])
+
+    @router.post("")
+    async def profile_session(
+        seconds: float = Query(10.0, gt=0),
+        requests: int = Query(0, ge=0),
+        top: int = Query(25, ge=1, le=500),
+        format: str = Query("json", pattern="^(json|collapsed)$"),
+    ):
+        # Con requests=N, seconds es el tiempo máximo de espera
+        seconds = min(seconds, settings.profiling_max_seconds)
+        profile = await get_profiler().run_session(seconds, requests)
+        logger.info(
+            f"Perfilado de {profile.duration:.1f}s: {profile.samples} muestras, {profile.requests} requests"
+        )
+        return _respond(profile.result(top), format)
+
+    @router.get("/requests/{request_id}")
+    async def request_profile(
+        request_id: str,
+        format: str = Query("json", pattern="^(json|collapsed)$"),
+    ):
+        try:
+            result = orjson.loads(await asyncio.to_thread(_profile_path(request_id).read_bytes))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"No hay perfil del request {request_id}")
+        return _respond(result, format)
+
+    return router
@@ -3,6 +3,39 @@ from typing import Dict, Optional, List
 from datetime import datetime
 
 
+# Índice canónico de emociones compartido por todos los servicios.
+# El orden define la posición de cada emoción en los vectores de distribución.
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "neutral", "sad", "surprise")
+EMOTION_INDEX = {label: i for i, label in enumerate(EMOTION_LABELS)}
+
+# Etiquetas de los modelos que no coinciden con el índice canónico
+EMOTION_ALIASES = {
+    # Sentimiento (BETO)
+    'pos': 'happy',
+    'neg': 'sad',
+    'neu': 'neutral',
+    # DistilRoBERTa
+    'joy': 'happy',
+    'anger': 'angry',
+    'sadness': 'sad',
+    # Wav2Vec2
+    'calm': 'neutral',
+    'fearful': 'fear',
+    'surprised': 'surprise',
+}
+
+# Modalidades en el orden usado por el motor de fusión
+MODALITIES = ("facial", "voice", "text")
+
+
+def canonical_label(label: str) -> str:
+    """Convierte una etiqueta de modelo a su emoción canónica (neutral si es desconocida)"""
+    label = label.lower()
+    if label in EMOTION_INDEX:
+        return label
+    return EMOTION_ALIASES.get(label, 'neutral')
+
+
 class EmotionResult(BaseModel):
     """Resultado de análisis de una modalidad"""
     emotion: str = Field(..., description="Emoción dominante detectada")
@@ -45,6 +78,32 @@ class TextAnalysisResponse(EmotionResult):
     detected_language: str = Field(..., description="Idioma detectado")
 
 
+class SharedPayload(BaseModel):
+    """Archivo pasado por memoria compartida entre servicios del mismo host"""
+    name: str = Field(..., description="Nombre del segmento de memoria compartida")
+    size: int = Field(..., ge=1, description="Bytes del archivo en el segmento")
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+
+
+class VideoFrameEmotion(BaseModel):
+    """Emociones de un frame muestreado del video"""
+    timestamp: float = Field(..., description="Instante del frame en segundos")
+    emotion: str
+    confidence: float
+    all_emotions: Dict[str, float]
+
+
+class VideoAnalysisResponse(EmotionResult):
+    """Respuesta de análisis de video: línea de tiempo por frame y distribución agregada"""
+    video_duration: Optional[float] = Field(None, description="Duración del video en segundos")
+    sample_fps: float = Field(..., description="Frames analizados por segundo de video")
+    frames_analyzed: int = Field(..., description="Frames analizados")
+    truncated: bool = Field(False, description="Si se alcanzó el máximo de frames antes del final")
+    timeline: List[VideoFrameEmotion] = Field(..., description="Emociones por frame, en orden")
+    audio_result: Optional[VoiceAnalysisResponse] = Field(None, description="Análisis de la pista de audio")
+
+
 class MultimodalAnalysisRequest(BaseModel):
     """Request para análisis multimodal"""
     # Los archivos se envían como multipart/form-data
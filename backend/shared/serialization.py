@@ -0,0 +1,76 @@
+"""
+Serialización rápida entre servicios
+
+- Respuestas JSON con orjson (ORJSONResponse) en todas las apps
+- Formato compacto opcional (MessagePack) negociado con el header Accept
+"""
+from datetime import datetime
+
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # MessagePack es opcional
+    msgpack = None
+
+from shared.config import get_settings
+
+settings = get_settings()
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(obj)}")
+
+
+class MsgPackResponse(Response):
+    """Respuesta codificada en MessagePack"""
+
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, default=_msgpack_default)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True si el cliente acepta MessagePack y la librería está disponible"""
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def negotiated_response(request: Request, model: BaseModel) -> Response:
+    """
+    Serializa un modelo según el header Accept del request
+
+    Devolver un Response directamente evita que FastAPI vuelva a validar
+    y serializar el modelo a través de response_model.
+    """
+    content = model.model_dump()
+    if wants_msgpack(request):
+        return MsgPackResponse(content)
+    return ORJSONResponse(content)
+
+
+def accept_headers() -> dict:
+    """Header Accept para requests del gateway según settings.service_wire_format"""
+    if settings.service_wire_format == "msgpack" and msgpack is not None:
+        return {"Accept": MSGPACK_MEDIA_TYPE}
+    return {"Accept": JSON_MEDIA_TYPE}
+
+
+def decode_response(content: bytes, content_type: str) -> dict:
+    """Decodifica el cuerpo de una respuesta de servicio (JSON o MessagePack)"""
+    if content_type.startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(content)
+    return orjson.loads(content)
+
+
+def dumps_text(message: dict) -> str:
+    """Serializa un mensaje WebSocket a texto JSON con orjson"""
+    return orjson.dumps(message).decode()
@@ -0,0 +1,88 @@
+"""
+Coalescencia de peticiones idénticas en curso (single-flight)
+
+Si llega una petición cuya entrada (hash) coincide con otra que se está
+procesando, no se lanza otra inferencia: espera el resultado de la que ya
+está en curso. Los contadores "executed" y "coalesced" se exponen en
+GET /stats ("singleflight").
+
+Uso:
+    flights = get_singleflight("text")
+    result = await flights.do(input_key(text, language), lambda: asyncio.to_thread(analyze, text))
+"""
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, Optional, TypeVar, Union
+
+from shared.config import get_settings
+from shared.utils import register_stats
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+
+def input_key(*parts: Union[bytes, str, None]) -> str:
+    """Hash SHA-256 de las partes de la entrada (texto, bytes, parámetros)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode() if isinstance(part, str) else (part or b"")
+        # Longitud como separador: ("ab", "c") y ("a", "bc") no colisionan
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Un cálculo en curso por clave; las peticiones repetidas se unen a él"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.metrics = {"executed": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        Ejecuta fn() o se une al cálculo en curso con la misma clave
+
+        Args:
+            key: Hash de la entrada
+            fn: Corrutina que calcula el resultado
+            timeout: Espera máxima de esta petición (el cálculo compartido sigue)
+        """
+        if not settings.singleflight_enabled:
+            return await asyncio.wait_for(fn(), timeout)
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            self.metrics["executed"] += 1
+        else:
+            self.metrics["coalesced"] += 1
+
+        # shield: si una de las peticiones se cancela, el resto sigue esperando el resultado
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Marca la excepción como recuperada aunque todas las peticiones se hayan ido
+            future.exception()
+
+    def stats(self) -> dict:
+        return {**self.metrics, "inflight": len(self._inflight)}
+
+
+_flights: Dict[str, SingleFlight] = {}
+
+
+def get_singleflight(name: str) -> SingleFlight:
+    """SingleFlight compartido del proceso para una modalidad/servicio"""
+    if name not in _flights:
+        if not _flights:
+            register_stats("singleflight", lambda: {n: f.stats() for n, f in _flights.items()})
+        _flights[name] = SingleFlight(name)
+    return _flights[name]
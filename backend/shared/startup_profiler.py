@@ -0,0 +1,113 @@
+"""
+Perfil de arranque del servicio
+
+Registra cuánto tarda cada fase del arranque (imports pesados, carga y
+warmup de modelos) por componente, además de los hitos "listening" (el
+servidor acepta conexiones) y "ready" (modelos de arranque cargados),
+medidos desde el inicio del proceso. Se expone en GET /stats ("startup")
+y se resume en el log al quedar listo.
+
+Uso:
+    with startup_profiler.phase("facial", "model_load"):
+        model = load()
+
+    transformers = timed_import("transformers")
+"""
+import importlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+
+
+def _process_start_time() -> float:
+    """Epoch de inicio del proceso (desde /proc; si no, el momento de este import)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # El nombre del proceso va entre paréntesis y puede contener espacios
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+class StartupProfiler:
+    """Tiempos de las fases de arranque por componente"""
+
+    def __init__(self):
+        self.process_start = _process_start_time()
+        self.phases = []
+        self.milestones = {}
+
+    def _offset(self) -> float:
+        return round(time.time() - self.process_start, 3)
+
+    def record(self, component: str, kind: str, seconds: float):
+        self.phases.append({
+            "component": component,
+            "phase": kind,
+            "seconds": round(seconds, 3),
+            "at": self._offset(),
+        })
+
+    @contextmanager
+    def phase(self, component: str, kind: str):
+        """Mide un bloque: kind es "import", "model_load" o "warmup" """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(component, kind, time.perf_counter() - start)
+
+    def mark(self, milestone: str):
+        """Registra un hito (solo la primera vez en cada proceso)"""
+        key = (milestone, os.getpid())
+        if key not in self.milestones:
+            self.milestones[key] = self._offset()
+
+    def mark_ready(self):
+        """Marca el servicio como listo y escribe el resumen en el log"""
+        if ("ready", os.getpid()) in self.milestones:
+            return
+        self.mark("ready")
+        summary = ", ".join(
+            f"{p['component']}.{p['phase']}={p['seconds']:.2f}s" for p in self.phases
+        )
+        logger.info(
+            "Arranque: escuchando en {:.2f}s, listo en {:.2f}s ({})",
+            self.milestones.get(("listening", os.getpid()), 0.0),
+            self.milestones[("ready", os.getpid())],
+            summary or "sin fases registradas"
+        )
+
+    def stats(self) -> dict:
+        pid = os.getpid()
+        totals = {}
+        for p in self.phases:
+            totals[p["phase"]] = round(totals.get(p["phase"], 0.0) + p["seconds"], 3)
+        return {
+            "listening_seconds": self.milestones.get(("listening", pid)),
+            "ready_seconds": self.milestones.get(("ready", pid)),
+            "totals": totals,
+            "phases": self.phases,
+        }
+
+
+startup_profiler = StartupProfiler()
+register_stats("startup", startup_profiler.stats)
+
+
+def timed_import(module_name: str, component: Optional[str] = None):
+    """Importa un módulo pesado registrando el tiempo del primer import"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with startup_profiler.phase(component or module_name, "import"):
+        return importlib.import_module(module_name)
@@ -0,0 +1,226 @@
+"""
+Transporte entre servicios en el mismo host: Unix domain sockets y memoria compartida
+
+Con FACIAL_SERVICE_SOCKET (y VOICE_/TEXT_) el servicio escucha también en
+ese socket Unix, y el gateway le envía las peticiones por él en vez de por
+TCP de loopback. Si el socket no existe (el servicio no está en este host)
+o la conexión falla, la petición va por TCP a la URL del servicio.
+
+Sobre un socket Unix ambos procesos están en el mismo host, así que las
+imágenes y audios grandes se pueden pasar por un segmento de memoria
+compartida: el gateway copia los bytes una vez al segmento y envía solo
+su nombre y tamaño (SharedPayload) a /analyze/{face,voice}/shm, donde el
+servicio los decodifica directamente del segmento, sin otra copia. Si el
+servicio no encuentra el segmento responde 409 y el gateway reenvía el
+archivo como multipart.
+"""
+import io
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from shared.config import get_settings
+from shared.schemas import SharedPayload
+from shared.uploads import max_upload_bytes, sniff_format
+from shared.utils import get_logger, register_stats
+
+logger = get_logger()
+settings = get_settings()
+
+SERVICES = ("facial", "voice", "text")
+
+# Solo se leen segmentos creados por el gateway (no cualquier segmento del host)
+SEGMENT_PREFIX = "emotions_"
+SEGMENT_NAME = re.compile(rf"^{SEGMENT_PREFIX}[0-9a-f]{{32}}$")
+
+
+class ColocatedTransport(httpx.AsyncBaseTransport):
+    """Unix domain socket si el servicio está en este host; TCP si no"""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._uds = httpx.AsyncHTTPTransport(uds=socket_path)
+        self._tcp = httpx.AsyncHTTPTransport()
+        self.metrics = {"uds": 0, "tcp": 0, "fallbacks": 0}
+
+    def colocated(self) -> bool:
+        return os.path.exists(self.socket_path)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.colocated():
+            try:
+                response = await self._uds.handle_async_request(request)
+                self.metrics["uds"] += 1
+                return response
+            except httpx.ConnectError:
+                # Socket huérfano (servicio detenido): el cuerpo aún no se envió
+                self.metrics["fallbacks"] += 1
+        self.metrics["tcp"] += 1
+        return await self._tcp.handle_async_request(request)
+
+    async def aclose(self):
+        await self._uds.aclose()
+        await self._tcp.aclose()
+
+    def stats(self) -> dict:
+        return {**self.metrics, "socket": self.socket_path, "colocated": self.colocated()}
+
+
+def _origin(url: str) -> str:
+    parsed = httpx.URL(url)
+    return f"{parsed.scheme}://{parsed.host}" + (f":{parsed.port}" if parsed.port else "")
+
+
+_transports: Dict[str, ColocatedTransport] = {}
+
+
+def service_transports() -> Dict[str, ColocatedTransport]:
+    """Transporte por origen (scheme://host:port) de cada servicio con socket configurado"""
+    if not _transports:
+        for service in SERVICES:
+            socket_path = getattr(settings, f"{service}_service_socket")
+            if socket_path:
+                url = getattr(settings, f"{service}_service_url")
+                _transports[_origin(url)] = ColocatedTransport(socket_path)
+        if _transports:
+            register_stats("transport", lambda: {origin: t.stats() for origin, t in _transports.items()})
+    return _transports
+
+
+def create_service_client(timeout: float = 30.0) -> httpx.AsyncClient:
+    """Cliente HTTP hacia los servicios, por socket Unix donde esté configurado"""
+    mounts = {origin: transport for origin, transport in service_transports().items()}
+    return httpx.AsyncClient(timeout=timeout, mounts=mounts)
+
+
+def is_colocated(url: str) -> bool:
+    """Si las peticiones a esta URL van por socket Unix (servicio en este host)"""
+    transport = service_transports().get(_origin(url))
+    return transport is not None and transport.colocated()
+
+
+def use_shared_memory(url: str, size: int) -> bool:
+    """Si conviene pasar un archivo de `size` bytes por memoria compartida a esta URL"""
+    return (
+        settings.shared_memory_enabled
+        and size > 0
+        and size >= settings.shared_memory_min_bytes
+        and is_colocated(url)
+    )
+
+
+def create_segment(data: bytes) -> shared_memory.SharedMemory:
+    """Segmento nuevo con una copia de los datos (lo libera quien lo crea, con release_segment)"""
+    segment = shared_memory.SharedMemory(
+        name=f"{SEGMENT_PREFIX}{uuid.uuid4().hex}", create=True, size=len(data)
+    )
+    segment.buf[:len(data)] = data
+    return segment
+
+
+def release_segment(segment: shared_memory.SharedMemory):
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Abre un segmento ajeno sin registrarlo en el resource_tracker de este proceso"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: el tracker lo borraría al terminar este proceso
+        from multiprocessing import resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class BufferReader(io.RawIOBase):
+    """Archivo de solo lectura sobre un buffer, sin copiarlo (para PIL, soundfile...)"""
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        chunk = self._buffer[self._position:self._position + len(target)]
+        size = len(chunk)
+        target[:size] = chunk
+        chunk.release()
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+@contextmanager
+def open_shared_payload(payload: SharedPayload, kind: Optional[str] = None,
+                        max_bytes: Optional[int] = None) -> Iterator[memoryview]:
+    """
+    Abre el archivo de un segmento creado por el gateway
+
+    Devuelve una vista del segmento, no una copia: los decodificadores la
+    leen directamente (BufferReader) y la vista solo es válida dentro del
+    bloque with. El gateway borra el segmento al recibir la respuesta.
+
+    Args:
+        payload: Nombre y tamaño del segmento
+        kind: Si se indica ("image"/"audio"), valida el formato por sus magic bytes
+        max_bytes: Límite de tamaño (default: max_file_size_mb)
+
+    Raises:
+        HTTPException 409 si el segmento no existe (el gateway reenvía por multipart),
+        413 si supera el límite de tamaño, 415 si el formato no es válido
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    if payload.size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El archivo supera el límite de {max_bytes // (1024 * 1024)} MB"
+        )
+    if not SEGMENT_NAME.match(payload.name):
+        raise HTTPException(status_code=400, detail="Nombre de segmento no válido")
+    try:
+        segment = _attach(payload.name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="Segmento de memoria compartida no encontrado")
+    view = None
+    try:
+        if payload.size > segment.size:
+            raise HTTPException(status_code=400, detail="Tamaño mayor que el segmento")
+        view = segment.buf[:payload.size]
+        if kind is not None and sniff_format(view[:64], kind) is None:
+            raise HTTPException(status_code=415, detail=f"Formato de {kind} no soportado")
+        yield view
+    finally:
+        if view is not None:
+            view.release()
+        try:
+            segment.close()
+        except BufferError:
+            # Aún hay vistas vivas (p. ej. en un traceback): se desmapea al liberarlas
+            logger.warning("Segmento {} cerrado con vistas abiertas", payload.name)
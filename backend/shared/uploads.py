@@ -0,0 +1,189 @@
+"""
+Ingesta de archivos subidos con límite de tamaño y validación temprana
+
+- BodySizeLimitMiddleware corta el request en cuanto supera el límite
+  (por Content-Length o contando los bytes a medida que llegan)
+- iter_upload lee el archivo por bloques aplicando max_file_size_mb
+- sniff_format valida el formato por los magic bytes del primer bloque
+"""
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse
+
+from shared.config import get_settings
+
+settings = get_settings()
+
+CHUNK_SIZE = 64 * 1024
+
+# Margen para cabeceras y delimitadores multipart
+MULTIPART_OVERHEAD = 64 * 1024
+
+IMAGE_SIGNATURES = [
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"BM", "bmp"),
+    (8, b"WEBP", "webp"),
+]
+
+AUDIO_SIGNATURES = [
+    (8, b"WAVE", "wav"),
+    (0, b"\x1a\x45\xdf\xa3", "webm"),
+    (0, b"OggS", "ogg"),
+    (0, b"fLaC", "flac"),
+    (0, b"ID3", "mp3"),
+    (0, b"\xff\xfb", "mp3"),
+    (0, b"\xff\xf3", "mp3"),
+    (0, b"\xff\xf2", "mp3"),
+    (4, b"ftyp", "mp4"),
+]
+
+VIDEO_SIGNATURES = [
+    (4, b"ftyp", "mp4"),                 # MP4 / MOV
+    (0, b"\x1a\x45\xdf\xa3", "webm"),    # WebM / Matroska
+    (8, b"AVI ", "avi"),
+]
+
+SIGNATURES = {"image": IMAGE_SIGNATURES, "audio": AUDIO_SIGNATURES, "video": VIDEO_SIGNATURES}
+
+
+def max_upload_bytes() -> int:
+    return settings.max_file_size_mb * 1024 * 1024
+
+
+def max_video_bytes() -> int:
+    return settings.max_video_size_mb * 1024 * 1024
+
+
+def max_body_bytes(files: int = 1) -> int:
+    """Límite del cuerpo completo de un request con `files` archivos"""
+    return files * max_upload_bytes() + MULTIPART_OVERHEAD
+
+
+def max_video_body_bytes() -> int:
+    """Límite del cuerpo de un request con un video"""
+    return max_video_bytes() + MULTIPART_OVERHEAD
+
+
+def sniff_format(head: bytes, kind: str) -> Optional[str]:
+    """Identifica el formato por sus magic bytes ("image", "audio" o "video")"""
+    for offset, signature, name in SIGNATURES[kind]:
+        if head[offset:offset + len(signature)] == signature:
+            return name
+    return None
+
+
+async def iter_upload(file: UploadFile, max_bytes: int = None, kind: str = None,
+                      chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Lee un UploadFile por bloques
+
+    Args:
+        file: Archivo subido
+        max_bytes: Límite de tamaño (default: max_file_size_mb)
+        kind: Si se indica ("image"/"audio"/"video"), valida el formato con el primer bloque
+        chunk_size: Tamaño de bloque
+
+    Raises:
+        HTTPException 413 si supera el límite, 415 si el formato no es válido
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    received = 0
+    first = True
+
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+
+        received += len(chunk)
+        if received > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"El archivo supera el límite de {max_bytes // (1024 * 1024)} MB"
+            )
+
+        if first and kind is not None:
+            if sniff_format(chunk, kind) is None:
+                raise HTTPException(status_code=415, detail=f"Formato de {kind} no soportado")
+        first = False
+
+        yield chunk
+
+    if first:
+        raise HTTPException(status_code=400, detail="El archivo está vacío")
+
+
+async def read_upload(file: UploadFile, max_bytes: int = None, kind: str = None) -> bytes:
+    """Lee un UploadFile completo aplicando el límite y la validación de formato"""
+    return b"".join([chunk async for chunk in iter_upload(file, max_bytes, kind)])
+
+
+class _PayloadTooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI que rechaza con 413 los cuerpos que superan max_bytes
+
+    Si Content-Length ya supera el límite se responde sin leer el cuerpo;
+    si no (o con chunked encoding) se cuentan los bytes a medida que llegan
+    y se corta la lectura en cuanto se excede. path_limits fija otro límite
+    para rutas concretas (p. ej. videos).
+    """
+
+    def __init__(self, app, max_bytes: int, path_prefix: str = "/analyze",
+                 path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            await self._reject(scope, receive, send, max_bytes)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    exceeded = True
+                    raise _PayloadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # El parser del framework convierte el error en su propia respuesta: se descarta
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _PayloadTooLarge:
+            pass
+
+        if exceeded:
+            await self._reject(scope, receive, send, max_bytes)
+
+    async def _reject(self, scope, receive, send, max_bytes: int):
+        response = ORJSONResponse(
+            {"detail": f"El cuerpo del request supera el límite de {max_bytes // (1024 * 1024)} MB"},
+            status_code=413
+        )
+        await response(scope, receive, send)
@@ -1,3 +1,22 @@
-from .logger import get_logger
+from .logger import (
+    get_logger,
+    sampled,
+    new_request_id,
+    set_request_id,
+    get_request_id,
+    RequestIdMiddleware,
+    REQUEST_ID_HEADER,
+)
+from .stats import register_stats, collect_stats
 
-__all__ = ["get_logger"]
+__all__ = [
+    "get_logger",
+    "sampled",
+    "new_request_id",
+    "set_request_id",
+    "get_request_id",
+    "RequestIdMiddleware",
+    "REQUEST_ID_HEADER",
+    "register_stats",
+    "collect_stats",
+]
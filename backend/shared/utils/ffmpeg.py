@@ -0,0 +1,133 @@
+"""
+Localización y arranque de FFmpeg
+
+El ejecutable se resuelve una sola vez por proceso: PATH y, en Windows, las
+rutas de instalación habituales.
+
+spawn_ffmpeg arranca el proceso con asyncio; si el event loop no soporta
+subprocesos (SelectorEventLoop en Windows, el que usa `uvicorn --reload`)
+lo arranca con subprocess.Popen y sus pipes se leen y escriben en hilos,
+con la misma interfaz que asyncio.subprocess.Process.
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+from functools import lru_cache
+from typing import List, Optional
+
+# Rutas comunes de instalación en Windows
+WINDOWS_FFMPEG_PATHS = [
+    r'C:\ProgramData\chocolatey\bin\ffmpeg.exe',
+    r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
+    r'C:\ffmpeg\bin\ffmpeg.exe',
+]
+
+FFMPEG_MISSING = "FFmpeg no está instalado o no se puede ejecutar. Por favor instala FFmpeg: choco install ffmpeg"
+
+
+@lru_cache()
+def resolve_ffmpeg() -> Optional[str]:
+    """Ruta de FFmpeg, o None si no está instalado"""
+    path = shutil.which('ffmpeg')
+    if path:
+        return path
+    for candidate in WINDOWS_FFMPEG_PATHS:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+# Sin ventana de consola por proceso en Windows
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+
+
+class _ThreadedReader:
+    """Pipe de lectura con la interfaz de asyncio.StreamReader (read/readexactly)"""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    async def read(self) -> bytes:
+        return await asyncio.to_thread(self._pipe.read)
+
+    async def readexactly(self, n: int) -> bytes:
+        data = await asyncio.to_thread(self._pipe.read, n)
+        if len(data) < n:
+            raise asyncio.IncompleteReadError(data, n)
+        return data
+
+
+class _ThreadedWriter:
+    """Pipe de escritura con la interfaz de asyncio.StreamWriter (write/drain/close)"""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self._buffer = bytearray()
+
+    def write(self, data: bytes):
+        self._buffer += data
+
+    async def drain(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        try:
+            await asyncio.to_thread(self._write, data)
+        except OSError as e:
+            # Windows: EINVAL al escribir en un pipe cuyo lector ya terminó
+            raise BrokenPipeError(str(e)) from e
+
+    def _write(self, data: bytes):
+        self._pipe.write(data)
+        self._pipe.flush()
+
+    def close(self):
+        try:
+            self._pipe.close()
+        except OSError:
+            pass
+
+
+class ThreadedProcess:
+    """subprocess.Popen con la interfaz de asyncio.subprocess.Process"""
+
+    def __init__(self, popen: subprocess.Popen):
+        self._popen = popen
+        self.stdin = _ThreadedWriter(popen.stdin) if popen.stdin is not None else None
+        self.stdout = _ThreadedReader(popen.stdout)
+        self.stderr = _ThreadedReader(popen.stderr)
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._popen.poll()
+
+    async def wait(self) -> int:
+        return await asyncio.to_thread(self._popen.wait)
+
+    def kill(self):
+        self._popen.kill()
+
+
+async def spawn_ffmpeg(args: List[str], stdin_pipe: bool = False):
+    """
+    Arranca FFmpeg con stdout y stderr por pipe
+
+    Args:
+        args: Línea de comandos completa (ejecutable incluido)
+        stdin_pipe: Si la entrada llega por stdin (si no, DEVNULL)
+
+    Returns:
+        asyncio.subprocess.Process, o ThreadedProcess si el event loop no
+        soporta subprocesos
+    """
+    stdin = subprocess.PIPE if stdin_pipe else subprocess.DEVNULL
+    try:
+        return await asyncio.create_subprocess_exec(
+            *args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            creationflags=CREATION_FLAGS
+        )
+    except NotImplementedError:
+        popen = await asyncio.to_thread(
+            subprocess.Popen, args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            creationflags=CREATION_FLAGS
+        )
+        return ThreadedProcess(popen)
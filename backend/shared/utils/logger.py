@@ -1,22 +1,159 @@
+"""
+Logging estructurado y no bloqueante
+
+- Sinks con cola en segundo plano (enqueue) para no escribir en el request
+- Salida JSON opcional (log_json)
+- Muestreo y límite de mensajes por ruta para tráfico de alta frecuencia
+- Correlación con X-Request-ID en todos los mensajes (extra.request_id)
+
+Para que el formateo sea perezoso, usar argumentos en lugar de f-strings:
+    logger.info("Emoción detectada: {} ({:.2f})", emotion, confidence)
+"""
+from contextvars import ContextVar
 from loguru import logger
 import sys
+import time
+import uuid
 
-# Configurar logger
-logger.remove()
-logger.add(
-    sys.stdout,
-    colorize=True,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
-    level="INFO"
-)
+from shared.config import get_settings
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+log_route_var: ContextVar[str] = ContextVar("log_route", default="default")
 
-logger.add(
-    "logs/app_{time}.log",
-    rotation="500 MB",
-    retention="10 days",
-    compression="zip",
-    level="DEBUG"
+STDOUT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<magenta>{extra[request_id]}</magenta> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>"
 )
 
+
+def _add_request_id(record):
+    record["extra"].setdefault("request_id", request_id_var.get())
+
+
+def configure_logging():
+    """Configura los sinks según settings (se llama al importar el módulo)"""
+    settings = get_settings()
+
+    logger.remove()
+    logger.configure(patcher=_add_request_id)
+
+    logger.add(
+        sys.stdout,
+        colorize=not settings.log_json,
+        serialize=settings.log_json,
+        format=STDOUT_FORMAT,
+        level=settings.log_level,
+        enqueue=settings.log_enqueue
+    )
+
+    if settings.log_file_enabled:
+        logger.add(
+            "logs/app_{time}.log",
+            rotation="500 MB",
+            retention="10 days",
+            compression="zip",
+            serialize=settings.log_json,
+            level=settings.log_file_level,
+            enqueue=settings.log_enqueue
+        )
+
+
+class LogSampler:
+    """Deja pasar 1 de cada N mensajes y como máximo max_per_second por segundo"""
+
+    def __init__(self, rate: float, max_per_second: int):
+        self.every = max(1, round(1.0 / rate)) if rate > 0 else 0
+        self.max_per_second = max_per_second
+        self.count = 0
+        self.window_start = 0.0
+        self.window_count = 0
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        self.count += 1
+        if self.every == 0 or self.count % self.every:
+            self.suppressed += 1
+            return False
+
+        now = time.monotonic()
+        if now - self.window_start >= 1.0:
+            self.window_start = now
+            self.window_count = 0
+        self.window_count += 1
+        if self.max_per_second and self.window_count > self.max_per_second:
+            self.suppressed += 1
+            return False
+        return True
+
+
+_samplers = {}
+
+
+def sampled(route: str = None) -> bool:
+    """
+    True si se debe registrar este mensaje de la ruta dada
+
+    Sin argumento usa la ruta del request actual (fijada por RequestIdMiddleware,
+    "realtime" para tráfico con X-Priority: realtime).
+    """
+    route = route or log_route_var.get()
+    sampler = _samplers.get(route)
+    if sampler is None:
+        settings = get_settings()
+        sampler = LogSampler(
+            settings.log_sample_rates.get(route, 1.0),
+            settings.log_rate_limit_per_second
+        )
+        _samplers[route] = sampler
+    return sampler.allow()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def set_request_id(request_id: str, route: str = None):
+    """Fija el request ID (y opcionalmente la ruta de muestreo) del contexto actual"""
+    request_id_var.set(request_id)
+    if route is not None:
+        log_route_var.set(route)
+
+
+def get_request_id() -> str:
+    return request_id_var.get()
+
+
+class RequestIdMiddleware:
+    """Middleware ASGI: propaga X-Request-ID y fija la ruta de muestreo de logs"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode() or new_request_id()
+        priority = headers.get(b"x-priority", b"").decode()
+        set_request_id(request_id, "realtime" if priority == "realtime" else scope["path"])
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_request_id)
+
+
+configure_logging()
+
+
 def get_logger():
     return logger
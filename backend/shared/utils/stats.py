@@ -0,0 +1,19 @@
+"""
+Registro de métricas internas expuestas en GET /stats
+
+Cada subsistema registra una función que devuelve un dict con sus
+contadores; el endpoint /stats de cada servicio agrega todas.
+"""
+from typing import Callable, Dict
+
+_providers: Dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, provider: Callable[[], dict]):
+    """Registra (o reemplaza) un proveedor de métricas"""
+    _providers[name] = provider
+
+
+def collect_stats() -> dict:
+    """Devuelve las métricas de todos los proveedores registrados"""
+    return {name: provider() for name, provider in _providers.items()}
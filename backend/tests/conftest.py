@@ -0,0 +1,12 @@
+"""
+Configuración común de los tests
+
+Los módulos del gateway se importan como en el servicio (por nombre, desde
+services/fusion), y los compartidos desde la raíz del backend.
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "services", "fusion"))
@@ -0,0 +1,48 @@
+"""Tests de la autenticación de los endpoints de administración"""
+import httpx
+import pytest
+from fastapi import Depends, FastAPI
+
+from shared import admin
+from shared.admin import DEFAULT_SECRET_KEY, is_admin_key, require_admin
+
+app = FastAPI()
+
+
+@app.get("/admin", dependencies=[Depends(require_admin)])
+async def admin_endpoint():
+    return {"ok": True}
+
+
+async def status(headers: dict = None) -> int:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://service") as client:
+        return (await client.get("/admin", headers=headers)).status_code
+
+
+@pytest.fixture
+def secret_key(monkeypatch):
+    def configure(value: str):
+        monkeypatch.setattr(admin.get_settings(), "secret_key", value)
+    return configure
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("value", ["", DEFAULT_SECRET_KEY])
+async def test_disabled_without_own_key(secret_key, value):
+    secret_key(value)
+    assert await status({"X-Admin-Key": value or "x"}) == 503
+    assert not is_admin_key(value)
+
+
+@pytest.mark.asyncio
+async def test_missing_and_wrong_key(secret_key):
+    secret_key("s3cret")
+    assert await status() == 401
+    assert await status({"X-Admin-Key": "nope"}) == 403
+
+
+@pytest.mark.asyncio
+async def test_valid_key(secret_key):
+    secret_key("s3cret")
+    assert await status({"X-Admin-Key": "s3cret"}) == 200
+    assert is_admin_key("s3cret")
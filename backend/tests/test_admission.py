@@ -0,0 +1,131 @@
+"""Tests del control de admisión: prioridades, cola acotada y plazos"""
+import asyncio
+import time
+
+import pytest
+
+from shared.admission import PRIORITY_BULK, PRIORITY_REALTIME, AdmissionController, AdmissionRejected
+
+
+async def queued(controller: AdmissionController, priority: int, deadline: float = None, order: list = None,
+                 name: str = None):
+    """Espera turno, anota el orden de admisión y devuelve el turno"""
+    await controller.acquire(priority, deadline)
+    if order is not None:
+        order.append(name)
+    controller.release()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_realtime_is_served_before_bulk():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+    await controller.acquire()
+    order = []
+    tasks = [
+        asyncio.create_task(queued(controller, PRIORITY_BULK, order=order, name="bulk-1")),
+        asyncio.create_task(queued(controller, PRIORITY_BULK, order=order, name="bulk-2")),
+        asyncio.create_task(queued(controller, PRIORITY_REALTIME, order=order, name="realtime")),
+    ]
+    await settle()
+    assert controller.stats()["queued"] == 3
+
+    controller.release()
+    await asyncio.gather(*tasks)
+    # Prioridad primero; a igual prioridad, orden de llegada
+    assert order == ["realtime", "bulk-1", "bulk-2"]
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_bulk_and_preempts_for_realtime():
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+    await controller.acquire()
+    waiting = asyncio.create_task(controller.acquire(PRIORITY_BULK))
+    await settle()
+
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire(PRIORITY_BULK)
+    assert error.value.status_code == 429
+
+    # La petición en tiempo real desplaza a la masiva que esperaba
+    realtime = asyncio.create_task(controller.acquire(PRIORITY_REALTIME))
+    await settle()
+    with pytest.raises(AdmissionRejected) as error:
+        await waiting
+    assert error.value.status_code == 503
+
+    controller.release()
+    await realtime
+    controller.release()
+    assert controller.active == 0
+    assert controller.metrics["rejected_full"] == 1
+    assert controller.metrics["preempted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_deadline_is_rejected_without_waiting():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire(deadline=time.time() - 1)
+    assert error.value.status_code == 503
+    assert controller.active == 0
+    assert controller.metrics["expired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_the_queue_wait():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+    await controller.acquire()
+
+    start = time.perf_counter()
+    with pytest.raises(AdmissionRejected) as error:
+        await controller.acquire(deadline=time.time() + 0.05)
+    assert error.value.status_code == 503
+    assert time.perf_counter() - start < 1
+    assert controller.stats()["queued"] == 0
+
+    # El turno no se pierde: sigue libre para la siguiente petición
+    controller.release()
+    assert controller.active == 0
+    await controller.acquire()
+    assert controller.active == 1
+
+
+@pytest.mark.asyncio
+async def test_waiter_whose_deadline_passed_in_queue_is_skipped():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+    await controller.acquire()
+    expiring = asyncio.create_task(controller.acquire(PRIORITY_REALTIME, deadline=time.time() + 0.3))
+    order = []
+    bulk = asyncio.create_task(queued(controller, PRIORITY_BULK, order=order, name="bulk"))
+    await settle()
+
+    # Se simula que el plazo venció mientras esperaba: release lo descarta
+    controller._waiters[0][3] = time.time() - 1
+    controller.release()
+    with pytest.raises(AdmissionRejected) as error:
+        await expiring
+    assert error.value.status_code == 503
+    await bulk
+    assert order == ["bulk"]
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+    await controller.acquire()
+    waiting = asyncio.create_task(controller.acquire())
+    await settle()
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert controller.stats()["queued"] == 0
+    controller.release()
+    assert controller.active == 0
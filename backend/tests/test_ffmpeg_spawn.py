@@ -0,0 +1,66 @@
+"""Tests del arranque de FFmpeg con y sin soporte de subprocesos en el event loop"""
+import asyncio
+import sys
+
+import pytest
+
+from shared.utils import ffmpeg
+from shared.utils.ffmpeg import ThreadedProcess, spawn_ffmpeg
+
+# Proceso de prueba: devuelve stdin en mayúsculas
+UPPER = [sys.executable, "-c", "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read().upper())"]
+
+
+@pytest.fixture
+def no_subprocess_loop(monkeypatch):
+    """Event loop sin subprocesos, como SelectorEventLoop en Windows"""
+    async def not_implemented(*args, **kwargs):
+        raise NotImplementedError
+
+    monkeypatch.setattr(ffmpeg.asyncio, "create_subprocess_exec", not_implemented)
+
+
+async def upper(process) -> bytes:
+    async def feed():
+        for chunk in (b"abc", b"def"):
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+        process.stdin.close()
+
+    _, stdout, _ = await asyncio.gather(feed(), process.stdout.read(), process.stderr.read())
+    assert await process.wait() == 0
+    return stdout
+
+
+@pytest.mark.asyncio
+async def test_spawn_with_asyncio_subprocess():
+    process = await spawn_ffmpeg(UPPER, stdin_pipe=True)
+    assert not isinstance(process, ThreadedProcess)
+    assert await upper(process) == b"ABCDEF"
+
+
+@pytest.mark.asyncio
+async def test_spawn_falls_back_to_threads(no_subprocess_loop):
+    process = await spawn_ffmpeg(UPPER, stdin_pipe=True)
+    assert isinstance(process, ThreadedProcess)
+    assert await upper(process) == b"ABCDEF"
+    assert process.returncode == 0
+
+
+@pytest.mark.asyncio
+async def test_threaded_readexactly(no_subprocess_loop):
+    process = await spawn_ffmpeg([sys.executable, "-c", "import sys; sys.stdout.write('12345')"])
+    assert process.stdin is None
+    assert await process.stdout.readexactly(3) == b"123"
+    with pytest.raises(asyncio.IncompleteReadError) as error:
+        await process.stdout.readexactly(3)
+    assert error.value.partial == b"45"
+    await process.wait()
+
+
+@pytest.mark.asyncio
+async def test_threaded_kill(no_subprocess_loop):
+    process = await spawn_ffmpeg([sys.executable, "-c", "import time; time.sleep(30)"])
+    assert process.returncode is None
+    process.kill()
+    assert await asyncio.wait_for(process.wait(), 5) != 0
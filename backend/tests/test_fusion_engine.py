@@ -0,0 +1,78 @@
+"""Tests del motor de fusión y sus estrategias"""
+import numpy as np
+import pytest
+
+from fusion_engine import (
+    ConfidenceWeighted, FixedWeights, FusionEngine, TemporalEMA, create_strategy
+)
+from shared.emotions import EMOTION_LABELS, from_vector
+
+
+def result(emotion: str, confidence: float) -> dict:
+    """Resultado de modalidad con toda la probabilidad en una emoción"""
+    return {"all_emotions": {emotion: 1.0}, "confidence": confidence}
+
+
+def fused_emotions(engine: FusionEngine, results: dict, key=None) -> dict:
+    return from_vector(engine.fuse_results(results, key))
+
+
+def test_confidence_weighted():
+    engine = FusionEngine(ConfidenceWeighted())
+    emotions = fused_emotions(engine, {"facial": result("happy", 0.75), "text": result("sad", 0.25)})
+    assert emotions["happy"] == pytest.approx(0.75)
+    assert emotions["sad"] == pytest.approx(0.25)
+
+
+def test_zero_confidence_falls_back_to_uniform():
+    engine = FusionEngine(ConfidenceWeighted())
+    emotions = fused_emotions(engine, {"facial": result("happy", 0.0), "voice": result("angry", 0.0)})
+    assert emotions["happy"] == pytest.approx(0.5)
+    assert emotions["angry"] == pytest.approx(0.5)
+
+
+def test_fixed_weights():
+    engine = FusionEngine(FixedWeights({"facial": 3.0, "voice": 1.0}))
+    emotions = fused_emotions(engine, {"facial": result("happy", 0.1), "voice": result("angry", 0.9)})
+    assert emotions["happy"] == pytest.approx(0.75)
+    assert emotions["angry"] == pytest.approx(0.25)
+
+
+def test_batch_matches_single_requests():
+    engine = FusionEngine(ConfidenceWeighted())
+    batch = [
+        {"facial": result("happy", 0.9)},
+        {"voice": result("sad", 0.4), "text": result("neutral", 0.6)},
+    ]
+    fused = engine.fuse_batch(batch)
+    assert fused.shape == (2, len(EMOTION_LABELS))
+    for row, results in zip(fused, batch):
+        np.testing.assert_allclose(row, engine.fuse_results(results), rtol=1e-6)
+
+
+def test_ema_smooths_per_key():
+    engine = FusionEngine(TemporalEMA(ConfidenceWeighted(), alpha=0.5))
+    fused_emotions(engine, {"facial": result("happy", 1.0)}, key="a")
+    emotions = fused_emotions(engine, {"facial": result("sad", 1.0)}, key="a")
+    assert emotions["happy"] == pytest.approx(0.5)
+    assert emotions["sad"] == pytest.approx(0.5)
+
+    # Otra clave no comparte estado
+    other = fused_emotions(engine, {"facial": result("sad", 1.0)}, key="b")
+    assert other["sad"] == pytest.approx(1.0)
+
+
+def test_ema_reset():
+    strategy = TemporalEMA(ConfidenceWeighted(), alpha=0.5)
+    engine = FusionEngine(strategy)
+    fused_emotions(engine, {"facial": result("happy", 1.0)}, key="a")
+    strategy.reset("a")
+    assert strategy.state == {}
+    emotions = fused_emotions(engine, {"facial": result("sad", 1.0)}, key="a")
+    assert emotions["sad"] == pytest.approx(1.0)
+
+
+def test_ema_without_stream_is_not_created():
+    strategy = create_strategy("ema", temporal=False)
+    assert isinstance(strategy, ConfidenceWeighted)
+    assert isinstance(create_strategy("ema"), TemporalEMA)
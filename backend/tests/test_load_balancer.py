@@ -0,0 +1,138 @@
+"""Tests del balanceo entre réplicas y del circuit breaker"""
+import asyncio
+
+import httpx
+import pytest
+
+import load_balancer
+from load_balancer import CLOSED, HALF_OPEN, LATENCY_MIN_SAMPLES, OPEN, CircuitBreaker, EndpointPool
+
+
+def slow_pool(threshold: float = 0.01) -> EndpointPool:
+    pool = EndpointPool("facial", ["http://replica-a"])
+    pool.endpoints[0].breaker.latency_threshold = threshold
+    return pool
+
+
+async def slow_send(endpoint):
+    await asyncio.sleep(0.02)
+    return endpoint.url
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_trip_breaker():
+    pool = slow_pool()
+    for _ in range(LATENCY_MIN_SAMPLES):
+        await pool.call(slow_send)
+    assert pool.endpoints[0].breaker.state != CLOSED
+
+
+@pytest.mark.asyncio
+async def test_calls_without_latency_do_not_trip_breaker():
+    pool = slow_pool()
+    for _ in range(LATENCY_MIN_SAMPLES * 2):
+        assert await pool.call(slow_send, record_latency=False) == "http://replica-a"
+    breaker = pool.endpoints[0].breaker
+    assert breaker.state == CLOSED
+    assert breaker.samples == 0
+
+
+def failing_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=30, latency_threshold=10)
+    for _ in range(3):
+        breaker.record_failure()
+    return breaker
+
+
+def expire(breaker: CircuitBreaker):
+    """Simula que pasó open_seconds desde que se abrió"""
+    breaker.opened_at -= breaker.open_seconds
+
+
+def test_consecutive_failures_trip_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=30, latency_threshold=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    # Un éxito reinicia la cuenta
+    assert breaker.state == CLOSED
+
+    breaker = failing_breaker()
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert not breaker.available()
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = failing_breaker()
+    expire(breaker)
+    assert breaker.available()
+    assert breaker.state == HALF_OPEN
+
+    breaker.on_request()
+    assert not breaker.available()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.available()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = failing_breaker()
+    expire(breaker)
+    assert breaker.available()
+    breaker.on_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+
+
+def test_cancelled_probe_reopens_breaker():
+    breaker = failing_breaker()
+    expire(breaker)
+    assert breaker.available()
+    breaker.on_request()
+    breaker.release_probe()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+
+
+@pytest.mark.asyncio
+async def test_failed_replica_is_retried_elsewhere_and_skipped(monkeypatch):
+    # Entre réplicas empatadas se elige siempre la primera (la rota)
+    monkeypatch.setattr(load_balancer.random, "choice", lambda candidates: candidates[0])
+    pool = EndpointPool("facial", ["http://replica-a", "http://replica-b"])
+    broken = pool.endpoints[0]
+    broken.breaker.failure_threshold = 1
+    calls = []
+
+    async def send(endpoint):
+        calls.append(endpoint.url)
+        if endpoint is broken:
+            raise httpx.ConnectError("connection refused")
+        return endpoint.url
+
+    assert await pool.call(send) == "http://replica-b"
+    assert calls == ["http://replica-a", "http://replica-b"]
+    assert broken.breaker.state == OPEN
+
+    # Con el breaker abierto no vuelve a recibir tráfico
+    for _ in range(5):
+        assert await pool.call(send) == "http://replica-b"
+    assert calls.count("http://replica-a") == 1
+
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_trip_breaker():
+    pool = EndpointPool("text", ["http://replica-a"])
+    breaker = pool.endpoints[0].breaker
+    breaker.failure_threshold = 1
+    request = httpx.Request("POST", "http://replica-a/analyze/text")
+
+    async def bad_request(endpoint):
+        raise httpx.HTTPStatusError("422", request=request, response=httpx.Response(422, request=request))
+
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await pool.call(bad_request)
+    assert breaker.state == CLOSED
@@ -0,0 +1,61 @@
+"""Tests de la autenticación de los observadores de sesión (/ws/observe)"""
+import asyncio
+
+import orjson
+import pytest
+
+from shared import admin
+from websocket_handler import authenticate_observer
+
+
+class FakeWebSocket:
+    def __init__(self, headers: dict = None, messages: list = ()):
+        self.headers = headers or {}
+        self._messages = list(messages)
+
+    async def receive_text(self) -> str:
+        if not self._messages:
+            await asyncio.sleep(3600)
+        return self._messages.pop(0)
+
+
+@pytest.fixture(autouse=True)
+def secret_key(monkeypatch):
+    monkeypatch.setattr(admin.get_settings(), "secret_key", "s3cret")
+
+
+@pytest.mark.asyncio
+async def test_header_key():
+    assert await authenticate_observer(FakeWebSocket({"X-Admin-Key": "s3cret"}))
+
+
+@pytest.mark.asyncio
+async def test_first_message_key():
+    message = orjson.dumps({"type": "auth", "key": "s3cret"}).decode()
+    assert await authenticate_observer(FakeWebSocket(messages=[message]))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("message", [
+    '{"type": "auth", "key": "nope"}',
+    '{"type": "auth", "key": 1}',
+    '{"type": "ping"}',
+    '[]',
+    'not json',
+])
+async def test_invalid_first_message(message):
+    assert not await authenticate_observer(FakeWebSocket(messages=[message]))
+
+
+@pytest.mark.asyncio
+async def test_auth_timeout(monkeypatch):
+    import websocket_handler
+
+    monkeypatch.setattr(websocket_handler, "OBSERVER_AUTH_TIMEOUT", 0.01)
+    assert not await authenticate_observer(FakeWebSocket())
+
+
+@pytest.mark.asyncio
+async def test_default_secret_key_is_refused(monkeypatch):
+    monkeypatch.setattr(admin.get_settings(), "secret_key", admin.DEFAULT_SECRET_KEY)
+    assert not await authenticate_observer(FakeWebSocket({"X-Admin-Key": admin.DEFAULT_SECRET_KEY}))
@@ -0,0 +1,64 @@
+"""Tests del servidor preload-then-fork"""
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from shared import prefork
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="requiere fork")
+
+
+class CrashOnceServer:
+    """Sustituye a uvicorn.Server: el primer worker muere, el resto espera"""
+
+    marker = None
+    started = None
+
+    def __init__(self, config):
+        pass
+
+    def run(self, sockets=None):
+        with open(self.started, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        try:
+            os.close(os.open(self.marker, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            time.sleep(30)
+            os._exit(0)
+        os._exit(1)
+
+
+def test_dead_worker_is_respawned(tmp_path, monkeypatch):
+    CrashOnceServer.marker = str(tmp_path / "crashed")
+    CrashOnceServer.started = str(tmp_path / "started")
+    monkeypatch.setattr(prefork.uvicorn, "Server", CrashOnceServer)
+    monkeypatch.setattr(prefork.uvicorn, "Config", lambda app, **kwargs: None)
+    monkeypatch.setattr(prefork, "RESPAWN_MIN_UPTIME", 0.0)
+    previous = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+    def stop_when_respawned():
+        # 2 workers + el que reemplaza al que murió
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if os.path.exists(CrashOnceServer.started):
+                with open(CrashOnceServer.started) as f:
+                    if len(f.read().split()) >= 3:
+                        break
+            time.sleep(0.05)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    watcher = threading.Thread(target=stop_when_respawned, daemon=True)
+    watcher.start()
+    try:
+        with pytest.raises(SystemExit):
+            prefork.run_prefork(object(), lambda: None, port=0, host="127.0.0.1", workers=2)
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    watcher.join()
+
+    with open(CrashOnceServer.started) as f:
+        assert len(f.read().split()) == 3
@@ -0,0 +1,74 @@
+"""Tests del perfilador de CPU por muestreo"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from shared import admin
+from shared.profiling import SamplingProfiler, is_profile_authorized, profile_headers, profile_token, profiled_request_var
+from shared.utils.logger import request_id_var
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def idle_code(filename: str, name: str):
+    """Código de una función `name` definida en `filename` (sin ejecutarla)"""
+    module = compile(f"def {name}():\n    pass\n", filename, "exec")
+    return next(const for const in module.co_consts if hasattr(const, "co_name"))
+
+
+def test_idle_leaves():
+    profiler = SamplingProfiler(5)
+    assert profiler._is_idle(idle_code("/usr/lib/python3.11/asyncio/runners.py", "run"))
+    assert profiler._is_idle(idle_code("/usr/lib/python3.11/selectors.py", "select"))
+    assert not profiler._is_idle(idle_code("/app/services/facial/main.py", "run"))
+
+
+@pytest.mark.asyncio
+async def test_session_counts_only_busy_threads():
+    stop = threading.Event()
+    waiting = threading.Thread(target=stop.wait, daemon=True)
+    logger_thread = threading.Thread(target=busy, args=(0.4,), name="loguru-writer-1", daemon=True)
+    waiting.start()
+    logger_thread.start()
+
+    profiler = SamplingProfiler(5)
+    work = asyncio.create_task(asyncio.to_thread(busy, 0.3))
+    profile = await profiler.run_session(0.4)
+    await work
+    stop.set()
+
+    assert profile.samples > 0
+    leaves = {stack[-1] for stack in profile.stacks}
+    assert any(leaf.startswith("busy ") for leaf in leaves)
+    # Ni el hilo en espera ni el escritor de loguru aparecen
+    assert not any("wait" in leaf for leaf in leaves)
+    assert profile.top(1)[0]["function"].startswith("busy ")
+
+
+def test_propagated_profile_carries_token_not_key(monkeypatch):
+    monkeypatch.setattr(admin.get_settings(), "secret_key", "clave-gateway")
+    request_token = request_id_var.set("abc123")
+    profiled_token = profiled_request_var.set(True)
+    try:
+        headers = profile_headers()
+    finally:
+        profiled_request_var.reset(profiled_token)
+        request_id_var.reset(request_token)
+
+    assert "clave-gateway" not in headers.values()
+    assert admin.ADMIN_KEY_HEADER not in headers
+    # El servicio llamado lo acepta con su propia clave y solo para ese request
+    assert is_profile_authorized(headers["X-Profile"], "", "abc123")
+    assert not is_profile_authorized(headers["X-Profile"], "", "otro")
+    assert not is_profile_authorized("1", "", "abc123")
+    assert is_profile_authorized("1", "clave-gateway", "abc123")
+
+    monkeypatch.setattr(admin.get_settings(), "secret_key", "otra-clave")
+    assert not is_profile_authorized(headers["X-Profile"], "", "abc123")
+    assert profile_token("abc123") != headers["X-Profile"]
@@ -0,0 +1,68 @@
+"""Tests de la fusión incremental de las sesiones en tiempo real"""
+import pytest
+
+import fusion_engine
+from fusion_engine import TemporalEMA
+from realtime_fusion import RealtimeFusionState
+
+
+async def discard(message: dict):
+    pass
+
+
+def result(emotion: str, confidence: float = 1.0) -> dict:
+    return {"all_emotions": {emotion: 1.0}, "confidence": confidence}
+
+
+@pytest.mark.asyncio
+async def test_uses_configured_strategy(monkeypatch):
+    monkeypatch.setattr(fusion_engine.settings, "fusion_strategy", "fixed")
+    monkeypatch.setattr(fusion_engine.settings, "fusion_weights", {"facial": 3.0, "voice": 1.0})
+    state = RealtimeFusionState(discard, "s1")
+    state.update("facial", result("happy", 0.1))
+    state.update("voice", result("angry", 0.9))
+    fused = state.compute()
+    assert fused["fusion_method"] == "fixed_weights+decay"
+    assert fused["all_emotions"]["happy"] == pytest.approx(0.75, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_ema_is_per_session_and_reset_on_stop(monkeypatch):
+    monkeypatch.setattr(fusion_engine.settings, "fusion_strategy", "ema")
+    monkeypatch.setattr(fusion_engine.settings, "fusion_ema_alpha", 0.5)
+    state = RealtimeFusionState(discard, "s1")
+    assert isinstance(state.strategy, TemporalEMA)
+
+    state.update("facial", result("happy"))
+    state.compute()
+    state.update("facial", result("sad"))
+    fused = state.compute()
+    assert fused["all_emotions"]["happy"] == pytest.approx(0.5, abs=0.01)
+
+    state.stop()
+    assert state.strategy.state == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("values", [
+    {"max_rate_hz": "abc"},
+    {"max_rate_hz": float("nan")},
+    {"half_life": 0},
+    {"half_life": [1]},
+    {"enabled": "yes"},
+])
+async def test_invalid_configuration_is_rejected(values):
+    state = RealtimeFusionState(discard, "s1")
+    before = (state.max_rate_hz, state.half_life, state.enabled)
+    with pytest.raises(ValueError):
+        state.configure(**values)
+    assert (state.max_rate_hz, state.half_life, state.enabled) == before
+
+
+@pytest.mark.asyncio
+async def test_valid_configuration_is_clamped():
+    state = RealtimeFusionState(discard, "s1")
+    state.configure(max_rate_hz="1000", half_life=2)
+    assert state.max_rate_hz == 30.0
+    assert state.half_life == 2.0
+    state.stop()
@@ -0,0 +1,51 @@
+"""Tests de la grabación de sesiones de /ws/realtime"""
+import gzip
+import time
+
+import orjson
+
+from session_recorder import RecordingWriter, SessionRecorder
+
+
+def read_recording(path) -> list:
+    with gzip.open(path, "rb") as f:
+        return [orjson.loads(line) for line in f]
+
+
+def test_close_with_full_queue_is_written_after_pending_messages(tmp_path):
+    writer = RecordingWriter(str(tmp_path), queue_size=2)
+    # Sin el hilo en marcha la cola se llena: apertura + un mensaje
+    recorder = SessionRecorder(writer, "sesion", "conn1")
+    recorder.record('{"type": "ping"}')
+    recorder.record('{"type": "descartado"}')
+    recorder.close()
+    assert writer.metrics["dropped"] == 1
+    assert writer.stats()["pending_closes"] == 1
+
+    writer.start()
+    writer.stop()
+
+    records = read_recording(tmp_path / recorder.key)
+    assert records[0]["session_id"] == "sesion"
+    assert records[1]["m"] == '{"type": "ping"}'
+    assert records[-1]["end"] is True
+    assert len(records) == 3
+    assert writer.stats()["open_files"] == 0
+    assert writer.stats()["pending_closes"] == 0
+
+
+def test_deferred_close_does_not_wait_for_shutdown(tmp_path):
+    writer = RecordingWriter(str(tmp_path), queue_size=1)
+    recorder = SessionRecorder(writer, "sesion", "conn2")
+    recorder.close()
+
+    writer.start()
+    try:
+        for _ in range(200):
+            if writer.stats()["pending_closes"] == 0 and not writer.stats()["open_files"]:
+                break
+            time.sleep(0.01)
+        assert writer.stats()["open_files"] == 0
+        assert read_recording(tmp_path / recorder.key)[-1]["end"] is True
+    finally:
+        writer.stop()
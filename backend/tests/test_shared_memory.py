@@ -0,0 +1,60 @@
+"""Tests de la lectura de archivos por memoria compartida"""
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from shared.schemas import SharedPayload
+from shared.transport import BufferReader, create_segment, open_shared_payload, release_segment
+
+
+def png_bytes() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 4), (200, 10, 30)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_buffer_reader_seeks_and_reads_in_place():
+    reader = BufferReader(memoryview(b"0123456789"))
+    assert reader.read(3) == b"012"
+    assert reader.seek(-2, io.SEEK_END) == 8
+    assert reader.read() == b"89"
+    reader.seek(4)
+    assert reader.read(100) == b"456789"
+    assert reader.read(1) == b""
+
+
+def test_image_decoded_from_segment():
+    data = png_bytes()
+    segment = create_segment(data)
+    try:
+        payload = SharedPayload(name=segment.name, size=len(data))
+        with open_shared_payload(payload, kind="image") as contents:
+            assert isinstance(contents, memoryview)
+            image = Image.open(BufferReader(contents))
+            image.load()
+        # La vista no sobrevive al bloque: el segmento se cierra al salir
+        with pytest.raises(ValueError):
+            contents[0]
+        assert image.size == (8, 4)
+        assert image.getpixel((0, 0)) == (200, 10, 30)
+    finally:
+        release_segment(segment)
+
+
+def test_invalid_segments_are_rejected():
+    segment = create_segment(b"no es una imagen" * 8)
+    try:
+        payload = SharedPayload(name=segment.name, size=128)
+        with pytest.raises(HTTPException) as error:
+            with open_shared_payload(payload, kind="image"):
+                pass
+        assert error.value.status_code == 415
+    finally:
+        release_segment(segment)
+
+    with pytest.raises(HTTPException) as error:
+        with open_shared_payload(SharedPayload(name=segment.name, size=128)):
+            pass
+    assert error.value.status_code == 409
@@ -0,0 +1,102 @@
+"""Tests de la coalescencia de peticiones idénticas (single-flight)"""
+import asyncio
+
+import pytest
+
+from shared import singleflight
+from shared.singleflight import SingleFlight, input_key
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(singleflight.settings, "singleflight_enabled", True)
+
+
+def test_input_key_separates_parts():
+    assert input_key("ab", "c") != input_key("a", "bc")
+    assert input_key("hola", "es") == input_key(b"hola", "es")
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_execution():
+    flights = SingleFlight("test")
+    calls = 0
+    release = asyncio.Event()
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"emotion": "joy"}
+
+    waiters = [asyncio.create_task(flights.do("k", compute)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert calls == 1
+    assert results == [{"emotion": "joy"}] * 3
+    assert flights.stats() == {"executed": 1, "coalesced": 2, "inflight": 0}
+
+
+@pytest.mark.asyncio
+async def test_error_reaches_every_waiter_and_is_not_cached():
+    flights = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError("modelo caído")
+
+    waiters = [asyncio.create_task(flights.do("k", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()["inflight"] == 0
+
+    # La siguiente petición con la misma clave vuelve a ejecutar
+    async def ok():
+        return "ok"
+
+    assert await flights.do("k", ok) == "ok"
+    assert flights.metrics["executed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_the_shared_computation():
+    flights = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return 42
+
+    first = asyncio.create_task(flights.do("k", compute))
+    second = asyncio.create_task(flights.do("k", compute))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    release.set()
+    assert await second == 42
+
+
+@pytest.mark.asyncio
+async def test_timeout_is_per_waiter():
+    flights = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return "done"
+
+    impatient = asyncio.create_task(flights.do("k", compute, timeout=0.01))
+    patient = asyncio.create_task(flights.do("k", compute))
+    with pytest.raises(asyncio.TimeoutError):
+        await impatient
+
+    release.set()
+    assert await patient == "done"
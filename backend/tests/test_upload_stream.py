@@ -0,0 +1,116 @@
+"""Tests del reenvío en streaming de archivos (UploadStream, MultipartStreamReader)"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from upload_stream import QUEUE_CHUNKS, UploadStream
+from load_balancer import EndpointPool, NoHealthyEndpoint
+from analyzers import ServiceAnalyzers
+
+# Cabecera JPEG válida para el sniffing de formato
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 60
+
+# Puerto sin servicio: la conexión se rechaza de inmediato
+CLOSED_URL = "http://127.0.0.1:9"
+
+
+async def feed_all(upload: UploadStream, chunks: int, size: int = 1024):
+    await upload.feed(JPEG)
+    for _ in range(chunks):
+        await upload.feed(b"x" * size)
+    await upload.finish()
+
+
+@pytest.mark.asyncio
+async def test_stream_is_consumed_in_order():
+    upload = UploadStream("image", "a.jpg", "image/jpeg", kind="image")
+    producer = asyncio.create_task(feed_all(upload, QUEUE_CHUNKS * 4, size=10))
+    data = await asyncio.wait_for(upload.read(), 5)
+    await producer
+    assert data == JPEG + b"x" * 10 * QUEUE_CHUNKS * 4
+
+
+@pytest.mark.asyncio
+async def test_invalid_format_is_rejected():
+    upload = UploadStream("image", "a.jpg", "image/jpeg", kind="image")
+    with pytest.raises(HTTPException) as error:
+        await upload.feed(b"not an image at all")
+    assert error.value.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_size_limit():
+    upload = UploadStream("image", "a.jpg", "image/jpeg", max_bytes=2048)
+    await upload.feed(b"x" * 2048)
+    with pytest.raises(HTTPException) as error:
+        await upload.feed(b"x")
+    assert error.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_abandon_unblocks_producer():
+    upload = UploadStream("image", "a.jpg", "image/jpeg")
+    producer = asyncio.create_task(feed_all(upload, QUEUE_CHUNKS * 4))
+    await asyncio.sleep(0.01)
+    assert not producer.done()  # Cola llena: espera al consumidor
+    upload.abandon()
+    await asyncio.wait_for(producer, 5)
+
+
+@pytest.mark.asyncio
+async def test_connect_failure_does_not_block_upload():
+    service = ServiceAnalyzers()
+    service.pools["facial"] = EndpointPool("facial", [CLOSED_URL])
+    upload = UploadStream("image", "a.jpg", "image/jpeg", kind="image")
+    try:
+        call = asyncio.create_task(service.analyze_face_stream(upload))
+        await asyncio.wait_for(feed_all(upload, QUEUE_CHUNKS * 4), 5)
+        with pytest.raises(httpx.ConnectError):
+            await call
+    finally:
+        await service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_no_healthy_endpoint_does_not_block_upload():
+    service = ServiceAnalyzers()
+    pool = EndpointPool("facial", [CLOSED_URL])
+    pool.endpoints[0].breaker.trip("test")
+    service.pools["facial"] = pool
+    upload = UploadStream("image", "a.jpg", "image/jpeg", kind="image")
+    try:
+        call = asyncio.create_task(service.analyze_face_stream(upload))
+        await asyncio.wait_for(feed_all(upload, QUEUE_CHUNKS * 4), 5)
+        with pytest.raises(NoHealthyEndpoint):
+            await call
+    finally:
+        await service.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_multimodal_request_completes_when_service_is_down(monkeypatch):
+    import main
+
+    monkeypatch.setitem(main.analyzers.inner.pools, "facial", EndpointPool("facial", [CLOSED_URL]))
+    image = JPEG + b"x" * (QUEUE_CHUNKS * 4 * 65536)
+    encoded = httpx.Request("POST", "http://gateway", files={"image": ("a.jpg", image, "image/jpeg")})
+    body = encoded.read()
+
+    async def upload():
+        # Por bloques, como llega un archivo grande por la red
+        for start in range(0, len(body), 65536):
+            yield body[start:start + 65536]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+        response = await asyncio.wait_for(
+            client.post(
+                "/analyze/multimodal",
+                content=upload(),
+                headers={"Content-Type": encoded.headers["Content-Type"]}
+            ),
+            10
+        )
+    assert response.status_code == 500
@@ -0,0 +1,19 @@
+"""Tests de la división en ventanas del audio largo (pista de audio de un video)"""
+from services.voice.main import MAX_WINDOW_SECONDS, audio_windows
+
+RATE = 16000
+WINDOW = MAX_WINDOW_SECONDS * RATE
+
+
+def test_short_audio_is_one_window():
+    assert audio_windows(5 * RATE, RATE) == [(0, 5 * RATE)]
+
+
+def test_windows_cover_the_whole_audio():
+    windows = audio_windows(2 * WINDOW + 5 * RATE, RATE)
+    assert windows == [(0, WINDOW), (WINDOW, 2 * WINDOW), (2 * WINDOW, 2 * WINDOW + 5 * RATE)]
+
+
+def test_short_last_window_is_merged():
+    windows = audio_windows(2 * WINDOW + 10, RATE)
+    assert windows == [(0, WINDOW), (WINDOW, 2 * WINDOW + 10)]
@@ -0,0 +1,258 @@
+"""
+Reproduce sesiones grabadas de /ws/realtime contra un gateway
+
+Lee los archivos .jsonl.gz que genera la grabación de sesiones
+(SESSION_RECORDING_ENABLED=True) y vuelve a enviar cada mensaje con los
+mismos tiempos entre mensajes, a velocidad real o acelerada, con varias
+sesiones en paralelo. A cada mensaje analyze_* se le añade un "seq" que
+el gateway devuelve en su respuesta, y con eso se mide:
+
+- Latencia de extremo a extremo (envío → analysis_result) por modalidad
+- Mensajes rechazados por admisión ("busy"), con error, y perdidos (sin
+  respuesta al terminar la sesión más el tiempo de drenado)
+- Mensajes que el gateway procesó sin responder (no_reply): texto de 5
+  caracteres o menos, análisis facial o de texto fallido, o resultados
+  con emit_modality_results=False. Como el gateway procesa los mensajes
+  de una conexión en orden, al final se envía un ping: lo que siga sin
+  respuesta cuando llega su pong no se ha perdido
+- Resultados por segundo
+
+Los rate_hint del servidor se cuentan pero no se aplican: la forma del
+tráfico es la grabada.
+
+Uso:
+    python tools/replay_sessions.py recordings/ --speed 4 --concurrency 20
+    python tools/replay_sessions.py sesion.jsonl.gz --repeat 10 --json resultado.json
+"""
+import argparse
+import asyncio
+import gzip
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+import websockets
+
+DEFAULT_URL = "ws://localhost:8004/ws/realtime"
+MODALITIES = {"analyze_frame": "facial", "analyze_audio": "voice", "analyze_text": "text"}
+
+
+class Recording:
+    """Una sesión grabada: mensajes con su instante relativo al inicio"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.messages: List[Tuple[float, str]] = []
+        self.duration = 0.0
+        with gzip.open(path, "rb") as f:
+            self.header = orjson.loads(f.readline())
+            for line in f:
+                entry = orjson.loads(line)
+                self.duration = max(self.duration, entry["t"])
+                if "m" in entry:
+                    self.messages.append((entry["t"], entry["m"]))
+
+
+class ModalityStats:
+    def __init__(self):
+        self.sent = 0
+        self.results = 0
+        self.errors = 0
+        self.busy = 0
+        self.dropped = 0
+        self.no_reply = 0
+        self.latencies_ms: List[float] = []
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies_ms)
+        return {
+            "sent": self.sent,
+            "results": self.results,
+            "errors": self.errors,
+            "busy": self.busy,
+            "dropped": self.dropped,
+            "no_reply": self.no_reply,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": round(latencies[-1], 1) if latencies else None,
+            },
+        }
+
+
+class ReplayStats:
+    """Métricas agregadas de todas las sesiones reproducidas"""
+
+    def __init__(self):
+        self.modalities: Dict[str, ModalityStats] = {m: ModalityStats() for m in MODALITIES.values()}
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.fused_results = 0
+        self.rate_hints = 0
+        self.send_lag_ms: List[float] = []
+
+    def summary(self, elapsed: float) -> dict:
+        results = sum(m.results for m in self.modalities.values())
+        return {
+            "sessions": self.sessions,
+            "failed_sessions": self.failed_sessions,
+            "elapsed_s": round(elapsed, 2),
+            "results_per_s": round(results / elapsed, 2) if elapsed > 0 else 0.0,
+            "fused_results": self.fused_results,
+            "rate_hints": self.rate_hints,
+            # Retraso del propio cliente respecto al horario grabado
+            "send_lag_ms_p95": percentile(sorted(self.send_lag_ms), 95),
+            "modalities": {name: m.summary() for name, m in self.modalities.items() if m.sent},
+        }
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return round(values[index], 1)
+
+
+def find_recordings(paths: List[str]) -> List[Path]:
+    found = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            found.extend(sorted(path.rglob("*.jsonl.gz")))
+        else:
+            found.append(path)
+    return found
+
+
+async def replay_session(recording: Recording, url: str, speed: float, drain: float, stats: ReplayStats):
+    """
+    Reproduce una sesión y acumula sus métricas
+
+    Args:
+        recording: Sesión grabada
+        url: URL del WebSocket de tiempo real
+        speed: Factor de aceleración (0 = sin esperas)
+        drain: Segundos a esperar respuestas pendientes al terminar
+        stats: Métricas agregadas
+    """
+    pending: Dict[int, Tuple[str, float]] = {}
+    # pings enviados (los grabados más el final) y pongs recibidos
+    pings = {"sent": 0, "received": 0, "final": False}
+    finished = asyncio.Event()
+
+    async def receive(ws):
+        async for raw in ws:
+            message = orjson.loads(raw)
+            kind = message.get("type")
+            if kind == "fused_result":
+                stats.fused_results += 1
+            elif kind == "rate_hint":
+                stats.rate_hints += 1
+            elif kind == "pong":
+                pings["received"] += 1
+                if pings["final"] and pings["received"] == pings["sent"]:
+                    # Pong del ping final: el gateway ya procesó todos los mensajes
+                    finished.set()
+            entry = pending.pop(message.get("seq"), None)
+            if entry is None:
+                continue
+            modality, sent_at = entry
+            target = stats.modalities[modality]
+            if kind == "analysis_result":
+                target.results += 1
+                target.latencies_ms.append((time.perf_counter() - sent_at) * 1000)
+            elif kind == "busy":
+                target.busy += 1
+            else:
+                target.errors += 1
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            receiver = asyncio.create_task(receive(ws))
+            start = time.perf_counter()
+            seq = 0
+            for offset, text in recording.messages:
+                if speed > 0:
+                    delay = start + offset / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        stats.send_lag_ms.append(-delay * 1000)
+                message = orjson.loads(text)
+                modality = MODALITIES.get(message.get("type"))
+                if modality is not None:
+                    seq += 1
+                    message["seq"] = seq
+                    pending[seq] = (modality, time.perf_counter())
+                    stats.modalities[modality].sent += 1
+                elif message.get("type") == "ping":
+                    pings["sent"] += 1
+                await ws.send(orjson.dumps(message).decode())
+
+            # Mantener la sesión hasta su duración original y esperar lo pendiente
+            if speed > 0:
+                remaining = start + recording.duration / speed - time.perf_counter()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+            pings["sent"] += 1
+            pings["final"] = True
+            await ws.send(orjson.dumps({"type": "ping"}).decode())
+            try:
+                await asyncio.wait_for(finished.wait(), drain)
+            except asyncio.TimeoutError:
+                pass
+            receiver.cancel()
+    except Exception as e:
+        stats.failed_sessions += 1
+        print(f"Sesión {recording.path.name} falló: {type(e).__name__}: {e}")
+    finally:
+        for modality, _ in pending.values():
+            if finished.is_set():
+                stats.modalities[modality].no_reply += 1
+            else:
+                stats.modalities[modality].dropped += 1
+        stats.sessions += 1
+
+
+async def replay(recordings: List[Recording], url: str, speed: float, concurrency: int,
+                 repeat: int, drain: float) -> dict:
+    stats = ReplayStats()
+    semaphore = asyncio.Semaphore(concurrency or len(recordings) * repeat)
+
+    async def run(recording: Recording):
+        async with semaphore:
+            await replay_session(recording, url, speed, drain, stats)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(r) for r in recordings for _ in range(repeat)))
+    return stats.summary(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce sesiones grabadas de /ws/realtime contra un gateway")
+    parser.add_argument("paths", nargs="+", help="Archivos .jsonl.gz o directorios de grabaciones")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"WebSocket de tiempo real (default: {DEFAULT_URL})")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de aceleración; 0 envía sin esperas (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=0, help="Sesiones simultáneas máximas (default: todas)")
+    parser.add_argument("--repeat", type=int, default=1, help="Veces que se reproduce cada sesión (default: 1)")
+    parser.add_argument("--drain", type=float, default=30.0, help="Espera de respuestas pendientes al final, en s (default: 30)")
+    parser.add_argument("--json", dest="json_path", help="Guarda el resumen en este archivo")
+    args = parser.parse_args()
+
+    paths = find_recordings(args.paths)
+    if not paths:
+        parser.error("No se encontraron grabaciones (*.jsonl.gz)")
+    recordings = [Recording(path) for path in paths]
+    print(f"Reproduciendo {len(recordings)} sesiones x{args.repeat} a {args.speed}x contra {args.url}")
+
+    summary = asyncio.run(replay(recordings, args.url, args.speed, args.concurrency, args.repeat, args.drain))
+    output = orjson.dumps(summary, option=orjson.OPT_INDENT_2)
+    print(output.decode())
+    if args.json_path:
+        Path(args.json_path).write_bytes(output)
+
+
+if __name__ == "__main__":
+    main()
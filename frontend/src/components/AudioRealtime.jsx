@@ -3,8 +3,8 @@ import { Mic, Square, Activity } from 'lucide-react';
 import { useWebSocket } from '../context/WebSocketContext';
 import './AudioRealtime.css';
 
-const CHUNK_DURATION = 6000; // Grabar chunks de 6 segundos (mejor para análisis de voz)
-const MIN_AUDIO_SIZE = 50000; // Tamaño mínimo en bytes para procesar
+const CHUNK_DURATION = 6000; // Grabar chunks de 6 segundos (el servidor lo ajusta con rate_hint)
+const MIN_AUDIO_SIZE = 50000; // Tamaño mínimo en bytes para procesar (chunk de CHUNK_DURATION)
 
 const emotionEmojis = {
   happy: '😊',
@@ -45,6 +45,7 @@ const AudioRealtime = () => {
   const mediaRecorderRef = useRef(null);
   const chunksRef = useRef([]);
   const chunkIntervalRef = useRef(null);
+  const chunkDurationRef = useRef(CHUNK_DURATION);
 
   // Suscribirse a mensajes de voz
   useEffect(() => {
@@ -72,6 +73,30 @@ const AudioRealtime = () => {
     return unsubscribe;
   }, [subscribe]);
 
+  // Ajustar la duración de los chunks según la carga del servidor
+  useEffect(() => {
+    const unsubscribe = subscribe('rate', (hint) => {
+      if (hint.audio_chunk_ms === chunkDurationRef.current) return;
+      chunkDurationRef.current = hint.audio_chunk_ms;
+
+      // Reiniciar el corte de chunks con la nueva duración si está grabando
+      if (chunkIntervalRef.current) {
+        clearInterval(chunkIntervalRef.current);
+        startChunkInterval();
+      }
+    });
+
+    return unsubscribe;
+  }, [subscribe]);
+
+  const startChunkInterval = () => {
+    chunkIntervalRef.current = setInterval(() => {
+      if (mediaRecorderRef.current && mediaRecorderRef.current.state === 'recording') {
+        mediaRecorderRef.current.stop();
+      }
+    }, chunkDurationRef.current);
+  };
+
   // Iniciar grabación continua
   const startRecording = async () => {
     try {
@@ -111,11 +136,7 @@ const AudioRealtime = () => {
       setIsRecording(true);
 
       // Solicitar datos cada X segundos (esto no detiene la grabación)
-      chunkIntervalRef.current = setInterval(() => {
-        if (mediaRecorderRef.current && mediaRecorderRef.current.state === 'recording') {
-          mediaRecorderRef.current.stop();
-        }
-      }, CHUNK_DURATION);
+      startChunkInterval();
 
     } catch (error) {
       console.error('Error al acceder al micrófono:', error);
@@ -134,7 +155,8 @@ const AudioRealtime = () => {
     console.log(`Tamaño del chunk de audio: ${blob.size} bytes`);
     
     // Validar tamaño mínimo del audio antes de enviar
-    if (blob.size < MIN_AUDIO_SIZE) {
+    const minSize = MIN_AUDIO_SIZE * chunkDurationRef.current / CHUNK_DURATION;
+    if (blob.size < minSize) {
       console.log(`Audio chunk too small (${blob.size} bytes), skipping analysis`);
       return;
     }
@@ -174,6 +196,7 @@ const AudioRealtime = () => {
 
     if (chunkIntervalRef.current) {
       clearInterval(chunkIntervalRef.current);
+      chunkIntervalRef.current = null;
     }
 
     setIsRecording(false);
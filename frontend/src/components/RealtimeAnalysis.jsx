@@ -3,7 +3,9 @@ import { Camera, Square, Activity, TrendingUp } from 'lucide-react';
 import { useWebSocket } from '../context/WebSocketContext';
 import './RealtimeAnalysis.css';
 
-const FRAME_INTERVAL = 1000; // Analizar cada 1 segundo
+const FRAME_INTERVAL = 1000; // Analizar cada 1 segundo (el servidor lo ajusta con rate_hint)
+const IMAGE_MAX_WIDTH = 640;
+const JPEG_QUALITY = 0.8;
 
 const emotionColors = {
   happy: '#4CAF50',
@@ -41,6 +43,11 @@ const RealtimeAnalysis = () => {
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
   const frameIntervalRef = useRef(null);
+  const rateRef = useRef({
+    frameInterval: FRAME_INTERVAL,
+    imageMaxWidth: IMAGE_MAX_WIDTH,
+    jpegQuality: JPEG_QUALITY
+  });
   
   const [isActive, setIsActive] = useState(false);
   const [currentEmotion, setCurrentEmotion] = useState(null);
@@ -72,6 +79,28 @@ const RealtimeAnalysis = () => {
     return unsubscribe;
   }, [subscribe]);
 
+  // Ajustar intervalo, resolución y calidad según la carga del servidor
+  useEffect(() => {
+    const unsubscribe = subscribe('rate', (hint) => {
+      const previousInterval = rateRef.current.frameInterval;
+      rateRef.current = {
+        frameInterval: hint.frame_interval_ms,
+        imageMaxWidth: hint.image_max_width,
+        jpegQuality: hint.jpeg_quality
+      };
+
+      // Reiniciar la captura con el nuevo intervalo si está activa
+      if (frameIntervalRef.current && hint.frame_interval_ms !== previousInterval) {
+        clearInterval(frameIntervalRef.current);
+        frameIntervalRef.current = setInterval(() => {
+          captureAndAnalyzeFrame();
+        }, hint.frame_interval_ms);
+      }
+    });
+
+    return unsubscribe;
+  }, [subscribe]);
+
   // Iniciar cámara
   const startCamera = async () => {
     try {
@@ -89,7 +118,7 @@ const RealtimeAnalysis = () => {
       // Iniciar captura de frames
       frameIntervalRef.current = setInterval(() => {
         captureAndAnalyzeFrame();
-      }, FRAME_INTERVAL);
+      }, rateRef.current.frameInterval);
       
     } catch (error) {
       console.error('Error al acceder a la cámara:', error);
@@ -105,13 +134,15 @@ const RealtimeAnalysis = () => {
     const canvas = canvasRef.current;
     const ctx = canvas.getContext('2d');
     
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
+    const { imageMaxWidth, jpegQuality } = rateRef.current;
+    const scale = Math.min(1, imageMaxWidth / video.videoWidth);
+    canvas.width = Math.round(video.videoWidth * scale);
+    canvas.height = Math.round(video.videoHeight * scale);
     
-    ctx.drawImage(video, 0, 0);
+    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
     
     // Convertir a base64
-    const imageData = canvas.toDataURL('image/jpeg', 0.8);
+    const imageData = canvas.toDataURL('image/jpeg', jpegQuality);
     
     // Enviar a través de WebSocket compartido
     sendMessage({
@@ -130,6 +161,7 @@ const RealtimeAnalysis = () => {
     // Detener interval
     if (frameIntervalRef.current) {
       clearInterval(frameIntervalRef.current);
+      frameIntervalRef.current = null;
     }
     
     setIsActive(false);
@@ -8,10 +8,13 @@ export const WebSocketProvider = ({ children }) => {
   const [isConnected, setIsConnected] = useState(false);
   const wsRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
+  const rateHintRef = useRef(null);
   const listenersRef = useRef({
     facial: [],
     voice: [],
     text: [],
+    fused: [],
+    rate: [],
     connected: [],
     error: []
   });
@@ -46,6 +49,13 @@ export const WebSocketProvider = ({ children }) => {
               if (listenersRef.current[modality]) {
                 listenersRef.current[modality].forEach(callback => callback(data));
               }
+            } else if (data.type === 'fused_result') {
+              // Fusión calculada en el servidor (ver mensaje configure_fusion)
+              listenersRef.current.fused.forEach(callback => callback(data));
+            } else if (data.type === 'rate_hint') {
+              // Parámetros de envío ajustados por el servidor según la carga
+              rateHintRef.current = data;
+              listenersRef.current.rate.forEach(callback => callback(data));
             } else if (data.type === 'connected') {
               console.log('Conexión establecida:', data.message);
               listenersRef.current.connected.forEach(callback => callback(data));
@@ -108,6 +118,11 @@ export const WebSocketProvider = ({ children }) => {
       listenersRef.current[modality].push(callback);
     }
 
+    // El último rate_hint se entrega también a quien se suscribe después
+    if (modality === 'rate' && rateHintRef.current) {
+      callback(rateHintRef.current);
+    }
+
     // Retornar función de limpieza
     return () => {
       if (listenersRef.current[modality]) {